@@ -8,6 +8,18 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 
+from bar_store import load_bars
+from equity_curves import open_curve_writer
+from indicator_cache import IndicatorCache, cached, set_cache
+from metrics import DrawdownTracker, metrics_from_sums, summarize_pnl
+from profiling import add_profile_arguments, finish_profile, profiled, stage, start_profile
+from timestamps import parse_timestamps
+
+try:
+    from numba import njit
+except ImportError:  # numba は任意依存。無ければ純Python/NumPy経路で計算する
+    njit = None
+
 
 @dataclass
 class Config:
@@ -29,225 +41,336 @@ def parse_datetime(df: pd.DataFrame) -> pd.DataFrame:
     if dt_col is None:
         raise ValueError("CSVに timestamp/time/datetime/date 列が必要です")
 
-    if np.issubdtype(df[dt_col].dtype, np.number):
-        num = pd.to_numeric(df[dt_col], errors="coerce")
-        max_abs = num.abs().max()
-        unit = "ms" if max_abs > 1e11 else "s"
-        ts = pd.to_datetime(num, unit=unit, utc=True, errors="coerce")
-    else:
-        ts = pd.to_datetime(df[dt_col], utc=True, errors="coerce")
-
+    with stage("parse_datetime", rows=len(df)):
+        ts, time_format = parse_timestamps(df[dt_col])
     if ts.isna().any():
         raise ValueError("日時列のパースに失敗した行があります")
 
     out = df.copy()
     out.index = ts
     out = out.sort_index()
+    out.attrs["time_format"] = time_format
     return out
 
 
-def rma(series: pd.Series, length: int) -> pd.Series:
-    alpha = 1 / length
-    return series.ewm(alpha=alpha, adjust=False).mean()
+def slice_period(df: pd.DataFrame, start: str | None, end: str | None) -> pd.DataFrame:
+    # start <= t <= end。時刻順に並んでいれば二分探索で切り出す（ビューなのでコピーしない）
+    if not start and not end:
+        return df
+    lo = pd.to_datetime(start, utc=True) if start else None
+    hi = pd.to_datetime(end, utc=True) if end else None
+    if not df.index.is_monotonic_increasing:
+        mask = np.ones(len(df), dtype=bool)
+        if lo is not None:
+            mask &= df.index >= lo
+        if hi is not None:
+            mask &= df.index <= hi
+        return df[mask]
+    i0 = df.index.searchsorted(lo, side="left") if lo is not None else 0
+    i1 = df.index.searchsorted(hi, side="right") if hi is not None else len(df)
+    return df.iloc[i0:max(i0, i1)]
 
 
-def calc_atr(df: pd.DataFrame, length: int) -> pd.Series:
-    prev_close = df["close"].shift(1)
-    tr = pd.concat(
-        [
-            (df["high"] - df["low"]).abs(),
-            (df["high"] - prev_close).abs(),
-            (df["low"] - prev_close).abs(),
-        ],
-        axis=1,
-    ).max(axis=1)
-    return rma(tr, length)
+def _ohlc_arrays(df: pd.DataFrame, columns: tuple[str, ...]) -> tuple[np.ndarray, ...]:
+    return tuple(df[c].to_numpy() for c in columns)
 
 
-def calc_supertrend(df: pd.DataFrame, period: int, factor: float) -> tuple[pd.Series, pd.Series]:
-    atr = calc_atr(df, period)
-    hl2 = (df["high"] + df["low"]) / 2.0
-    upper = hl2 + factor * atr
-    lower = hl2 - factor * atr
-
-    final_upper = upper.copy()
-    final_lower = lower.copy()
-    direction = pd.Series(index=df.index, dtype="int64")
-    st = pd.Series(index=df.index, dtype="float64")
-
-    direction.iloc[0] = -1
-    st.iloc[0] = lower.iloc[0]
-
-    for i in range(1, len(df)):
-        if upper.iloc[i] < final_upper.iloc[i - 1] or df["close"].iloc[i - 1] > final_upper.iloc[i - 1]:
-            final_upper.iloc[i] = upper.iloc[i]
+def rma(series: pd.Series, length: int) -> pd.Series:
+    def compute() -> tuple[np.ndarray]:
+        alpha = 1 / length
+        return (series.ewm(alpha=alpha, adjust=False).mean().to_numpy(),)
+
+    (values,) = cached("rma", (series.to_numpy(),), (length,), compute)
+    return pd.Series(values, index=series.index, name=series.name)
+
+
+def calc_atr(df: pd.DataFrame, length: int) -> pd.Series:
+    def compute() -> tuple[np.ndarray]:
+        prev_close = df["close"].shift(1)
+        tr = pd.concat(
+            [
+                (df["high"] - df["low"]).abs(),
+                (df["high"] - prev_close).abs(),
+                (df["low"] - prev_close).abs(),
+            ],
+            axis=1,
+        ).max(axis=1)
+        return (rma(tr, length).to_numpy(),)
+
+    (values,) = cached("atr", _ohlc_arrays(df, ("high", "low", "close")), (length,), compute)
+    return pd.Series(values, index=df.index)
+
+
+def _supertrend_loop(upper, lower, close, final_upper, final_lower, direction, st) -> None:
+    final_upper[0] = upper[0]
+    final_lower[0] = lower[0]
+    direction[0] = -1.0
+    st[0] = lower[0]
+
+    for i in range(1, len(close)):
+        if upper[i] < final_upper[i - 1] or close[i - 1] > final_upper[i - 1]:
+            final_upper[i] = upper[i]
         else:
-            final_upper.iloc[i] = final_upper.iloc[i - 1]
+            final_upper[i] = final_upper[i - 1]
 
-        if lower.iloc[i] > final_lower.iloc[i - 1] or df["close"].iloc[i - 1] < final_lower.iloc[i - 1]:
-            final_lower.iloc[i] = lower.iloc[i]
+        if lower[i] > final_lower[i - 1] or close[i - 1] < final_lower[i - 1]:
+            final_lower[i] = lower[i]
         else:
-            final_lower.iloc[i] = final_lower.iloc[i - 1]
+            final_lower[i] = final_lower[i - 1]
 
-        prev_dir = direction.iloc[i - 1]
-        if prev_dir == -1:
-            direction.iloc[i] = -1 if df["close"].iloc[i] >= final_lower.iloc[i] else 1
+        if direction[i - 1] == -1.0:
+            direction[i] = -1.0 if close[i] >= final_lower[i] else 1.0
         else:
-            direction.iloc[i] = 1 if df["close"].iloc[i] <= final_upper.iloc[i] else -1
+            direction[i] = 1.0 if close[i] <= final_upper[i] else -1.0
 
-        st.iloc[i] = final_lower.iloc[i] if direction.iloc[i] == -1 else final_upper.iloc[i]
+        st[i] = final_lower[i] if direction[i] == -1.0 else final_upper[i]
 
-    return st, direction
 
+_supertrend_loop_jit = njit(cache=True)(_supertrend_loop) if njit is not None else None
 
-def build_heikin_ashi(df: pd.DataFrame) -> pd.DataFrame:
-    ha = pd.DataFrame(index=df.index)
-    ha["ha_close"] = (df["open"] + df["high"] + df["low"] + df["close"]) / 4.0
 
-    ha_open = np.zeros(len(df), dtype=float)
-    ha_open[0] = (df["open"].iloc[0] + df["close"].iloc[0]) / 2.0
-    for i in range(1, len(df)):
-        ha_open[i] = (ha_open[i - 1] + ha["ha_close"].iloc[i - 1]) / 2.0
+def supertrend_kernel(
+    upper: np.ndarray, lower: np.ndarray, close: np.ndarray, jit: bool = True
+) -> tuple[np.ndarray, np.ndarray]:
+    # jit=False なら numba があっても Python 版で回す（supertrend_parity.py の比較用）
+    upper = np.ascontiguousarray(upper, dtype=np.float64)
+    lower = np.ascontiguousarray(lower, dtype=np.float64)
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    n = len(close)
+    if n == 0:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
 
-    ha["ha_open"] = ha_open
-    ha["ha_high"] = pd.concat([df["high"], ha["ha_open"], ha["ha_close"]], axis=1).max(axis=1)
-    ha["ha_low"] = pd.concat([df["low"], ha["ha_open"], ha["ha_close"]], axis=1).min(axis=1)
-    return ha
+    if jit and _supertrend_loop_jit is not None:
+        final_upper = np.empty(n, dtype=np.float64)
+        final_lower = np.empty(n, dtype=np.float64)
+        direction = np.empty(n, dtype=np.float64)
+        st = np.empty(n, dtype=np.float64)
+        _supertrend_loop_jit(upper, lower, close, final_upper, final_lower, direction, st)
+        return st, direction
 
+    # NumPyスカラーの添字アクセスは遅いので、Pythonのfloatリスト上で回す（値はビット単位で同一）
+    final_upper = [0.0] * n
+    final_lower = [0.0] * n
+    direction = [0.0] * n
+    st = [0.0] * n
+    _supertrend_loop(upper.tolist(), lower.tolist(), close.tolist(), final_upper, final_lower, direction, st)
+    return np.array(st, dtype=np.float64), np.array(direction, dtype=np.float64)
 
-def run_backtest(df_raw: pd.DataFrame, cfg: Config, start: str | None, end: str | None) -> tuple[dict, pd.DataFrame]:
-    if start:
-        df_raw = df_raw[df_raw.index >= pd.to_datetime(start, utc=True)]
-    if end:
-        df_raw = df_raw[df_raw.index <= pd.to_datetime(end, utc=True)]
 
-    ha = build_heikin_ashi(df_raw)
-    data = pd.DataFrame(index=df_raw.index)
-    data["open"] = ha["ha_open"]
-    data["high"] = ha["ha_high"]
-    data["low"] = ha["ha_low"]
-    data["close"] = ha["ha_close"]
+def calc_supertrend(df: pd.DataFrame, period: int, factor: float) -> tuple[pd.Series, pd.Series]:
+    def compute() -> tuple[np.ndarray, np.ndarray]:
+        atr = calc_atr(df, period)
+        hl2 = (df["high"] + df["low"]) / 2.0
+        upper = hl2 + factor * atr
+        lower = hl2 - factor * atr
+        return supertrend_kernel(upper.to_numpy(), lower.to_numpy(), df["close"].to_numpy())
 
-    if cfg.ma_type.upper() == "EMA":
-        data["ma_fast"] = data["close"].ewm(span=cfg.ma_fast_len, adjust=False).mean()
-        data["ma_slow"] = data["close"].ewm(span=cfg.ma_slow_len, adjust=False).mean()
+    st, direction = cached(
+        "supertrend", _ohlc_arrays(df, ("high", "low", "close")), (period, float(factor)), compute
+    )
+    return pd.Series(st, index=df.index), pd.Series(direction, index=df.index)
+
+
+@dataclass
+class HeikinAshiState:
+    # 直前バーの HA open/close。count == 0 なら未開始
+    ha_open: float = np.nan
+    ha_close: float = np.nan
+    count: int = 0
+
+
+def _ha_open_loop(seed, ha_close, ha_open) -> None:
+    ha_open[0] = seed
+    for i in range(1, len(ha_close)):
+        ha_open[i] = (ha_open[i - 1] + ha_close[i - 1]) / 2.0
+
+
+_ha_open_loop_jit = njit(cache=True)(_ha_open_loop) if njit is not None else None
+
+
+def _ha_open(seed: float, ha_close: np.ndarray) -> np.ndarray:
+    n = len(ha_close)
+    if _ha_open_loop_jit is not None:
+        ha_open = np.empty(n, dtype=np.float64)
+        _ha_open_loop_jit(seed, ha_close, ha_open)
+        return ha_open
+
+    # ha_open[i] = 0.5 * ha_open[i-1] + 0.5 * ha_close[i-1] は alpha=0.5 の一次フィルタなので
+    # ewm(adjust=False) 1パスで計算できる（2の冪での乗除は丸め誤差を生まず、ループとビット単位で一致）
+    shifted = np.empty(n, dtype=np.float64)
+    shifted[0] = seed
+    shifted[1:] = ha_close[:-1]
+    if np.isfinite(shifted).all():
+        return pd.Series(shifted).ewm(alpha=0.5, adjust=False).mean().to_numpy()
+
+    # NaN を含む場合は ewm と伝播の仕方が異なるのでループで計算する
+    ha_open = [0.0] * n
+    _ha_open_loop(seed, ha_close.tolist(), ha_open)
+    return np.array(ha_open, dtype=np.float64)
+
+
+def heikin_ashi_arrays(
+    open_: np.ndarray,
+    high: np.ndarray,
+    low: np.ndarray,
+    close: np.ndarray,
+    state: HeikinAshiState | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, HeikinAshiState]:
+    open_ = np.asarray(open_, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    if len(close) == 0:
+        empty = np.empty(0, dtype=np.float64)
+        return empty, empty.copy(), empty.copy(), empty.copy(), state or HeikinAshiState()
+
+    ha_close = (open_ + high + low + close) / 4.0
+    if state is None or state.count == 0:
+        seed = (open_[0] + close[0]) / 2.0
     else:
-        data["ma_fast"] = data["close"].rolling(cfg.ma_fast_len).mean()
-        data["ma_slow"] = data["close"].rolling(cfg.ma_slow_len).mean()
+        seed = (state.ha_open + state.ha_close) / 2.0
+    ha_open = _ha_open(seed, ha_close)
 
-    data["st"], data["st_dir"] = calc_supertrend(data, cfg.st_period, cfg.st_factor)
-    data = data.dropna().copy()
+    # pandas の max/min(axis=1) と同じく NaN はスキップする
+    ha_high = np.fmax(np.fmax(high, ha_open), ha_close)
+    ha_low = np.fmin(np.fmin(low, ha_open), ha_close)
+
+    prev_count = state.count if state is not None else 0
+    new_state = HeikinAshiState(float(ha_open[-1]), float(ha_close[-1]), prev_count + len(close))
+    return ha_open, ha_high, ha_low, ha_close, new_state
+
+
+def build_heikin_ashi(df: pd.DataFrame, state: HeikinAshiState | None = None) -> pd.DataFrame:
+    def compute() -> tuple[np.ndarray, ...]:
+        return heikin_ashi_arrays(*_ohlc_arrays(df, ("open", "high", "low", "close")), state)[:4]
+
+    params = (state.ha_open, state.ha_close, state.count) if state is not None else ()
+    ha_open, ha_high, ha_low, ha_close = cached(
+        "heikin_ashi", _ohlc_arrays(df, ("open", "high", "low", "close")), params, compute
+    )
+    return pd.DataFrame(
+        {"ha_close": ha_close, "ha_open": ha_open, "ha_high": ha_high, "ha_low": ha_low},
+        index=df.index,
+    )
+
+
+def calc_ma(close: pd.Series, ma_type: str, length: int) -> pd.Series:
+    def compute() -> tuple[np.ndarray]:
+        if ma_type.upper() == "EMA":
+            return (close.ewm(span=length, adjust=False).mean().to_numpy(),)
+        return (close.rolling(length).mean().to_numpy(),)
 
+    (values,) = cached("ma", (close.to_numpy(),), (ma_type.upper(), length), compute)
+    return pd.Series(values, index=close.index, name=close.name)
+
+
+def infer_pip_unit(closes: np.ndarray) -> float:
     # infer pip / mintick-like unit from price resolution in data
-    closes = data["close"].values
     diffs = np.unique(np.abs(np.diff(np.unique(np.round(closes, 8)))))
     min_step = float(diffs[diffs > 0].min()) if diffs.size and (diffs > 0).any() else 0.01
-    pip_unit = min_step * 10.0
-    touch_margin = cfg.touch_margin_pips * pip_unit
-
-    equity = cfg.initial_capital
+    return min_step * 10.0
+
+
+TRADE_DTYPE = np.dtype(
+    [
+        ("bar", np.int64),
+        ("side", np.int8),  # 1 LONG, -1 SHORT
+        ("entry", np.float64),
+        ("exit", np.float64),
+        ("pnl", np.float64),
+        ("reason", np.int8),  # TRADE_REASONS の添字
+    ]
+)
+TRADE_REASONS = ("ReverseToLong", "TP_MA_down", "SL_ST_flip", "ReverseToShort", "TP_MA_up", "FinalClose")
+_REVERSE_TO_LONG, _TP_MA_DOWN, _SL_ST_FLIP, _REVERSE_TO_SHORT, _TP_MA_UP, _FINAL_CLOSE = range(6)
+
+
+def _record_trade(trades, k, bar, side, entry, exit_, pnl, reason) -> int:
+    # バッファが足りない場合も件数だけは数え、呼び出し側で確保し直す
+    if k < len(trades):
+        t = trades[k]
+        t["bar"] = bar
+        t["side"] = side
+        t["entry"] = entry
+        t["exit"] = exit_
+        t["pnl"] = pnl
+        t["reason"] = reason
+    return k + 1
+
+
+def _backtest_loop(
+    open_, high, low, close, ma_fast, ma_slow, st_dir, touch_margin, initial_capital, qty_pct, trades, equity_curve
+):
+    equity = initial_capital
     position = 0  # 1 long, -1 short, 0 none
     units = 0.0
     entry_price = np.nan
 
     touched_ma_long = False
     touched_ma_short = False
+    k = 0
+    n = len(close)
 
-    trades = []
-    equity_curve = []
+    for i in range(1, n):
+        c = close[i]
+        mf = ma_fast[i]
+        ms = ma_slow[i]
+        prev_mf = ma_fast[i - 1]
+        prev_ms = ma_slow[i - 1]
 
-    for i in range(1, len(data)):
-        row = data.iloc[i]
-        prev = data.iloc[i - 1]
+        gc = mf > ms
+        dc = mf < ms
 
-        gc = row.ma_fast > row.ma_slow
-        dc = row.ma_fast < row.ma_slow
-
-        bull_candle = row.close > row.open
-        bear_candle = row.close < row.open
+        bull_candle = c > open_[i]
+        bear_candle = c < open_[i]
 
         # GC/DC切替で待機状態リセット
-        if row.ma_fast > row.ma_slow and prev.ma_fast <= prev.ma_slow:
+        if mf > ms and prev_mf <= prev_ms:
             touched_ma_long = False
-        if row.ma_fast < row.ma_slow and prev.ma_fast >= prev.ma_slow:
+        if mf < ms and prev_mf >= prev_ms:
             touched_ma_short = False
 
         pos_sign = position
 
         if gc and pos_sign <= 0:
-            if row.low <= (row.ma_fast + touch_margin) or row.low <= (row.ma_slow + touch_margin):
+            if low[i] <= (mf + touch_margin) or low[i] <= (ms + touch_margin):
                 touched_ma_long = True
-            if row.low < row.ma_slow:
+            if low[i] < ms:
                 touched_ma_long = False
 
         if dc and pos_sign >= 0:
-            if row.high >= (row.ma_fast - touch_margin) or row.high >= (row.ma_slow - touch_margin):
+            if high[i] >= (mf - touch_margin) or high[i] >= (ms - touch_margin):
                 touched_ma_short = True
-            if row.high > row.ma_slow:
+            if high[i] > ms:
                 touched_ma_short = False
 
         buy_signal = pos_sign <= 0 and gc and touched_ma_long and bull_candle
         sell_signal = pos_sign >= 0 and dc and touched_ma_short and bear_candle
 
-        ma_fast_down = row.ma_fast < prev.ma_fast
-        ma_fast_up = row.ma_fast > prev.ma_fast
+        ma_fast_down = mf < prev_mf
+        ma_fast_up = mf > prev_mf
 
         exit_long_tp = pos_sign == 1 and ma_fast_down and (not buy_signal)
-        exit_long_sl = pos_sign == 1 and row.st_dir > 0 and (not buy_signal)
+        exit_long_sl = pos_sign == 1 and st_dir[i] > 0 and (not buy_signal)
         exit_short_tp = pos_sign == -1 and ma_fast_up and (not sell_signal)
-        exit_short_sl = pos_sign == -1 and row.st_dir < 0 and (not sell_signal)
+        exit_short_sl = pos_sign == -1 and st_dir[i] < 0 and (not sell_signal)
 
         # ロング側
         if buy_signal:
             if position == -1:
-                pnl = (entry_price - row.close) * units
+                pnl = (entry_price - c) * units
                 equity += pnl
-                trades.append(
-                    {
-                        "time": data.index[i],
-                        "side": "SHORT",
-                        "entry": entry_price,
-                        "exit": row.close,
-                        "pnl": pnl,
-                        "reason": "ReverseToLong",
-                    }
-                )
-            notional = equity * (cfg.qty_pct / 100)
-            units = notional / row.close
-            entry_price = row.close
+                k = _record_trade(trades, k, i, -1, entry_price, c, pnl, _REVERSE_TO_LONG)
+            notional = equity * (qty_pct / 100)
+            units = notional / c
+            entry_price = c
             position = 1
             touched_ma_long = False
 
-        elif exit_long_tp and position == 1:
-            pnl = (row.close - entry_price) * units
-            equity += pnl
-            trades.append(
-                {
-                    "time": data.index[i],
-                    "side": "LONG",
-                    "entry": entry_price,
-                    "exit": row.close,
-                    "pnl": pnl,
-                    "reason": "TP_MA_down",
-                }
-            )
-            position = 0
-            units = 0.0
-            entry_price = np.nan
-
-        elif exit_long_sl and position == 1:
-            pnl = (row.close - entry_price) * units
+        elif (exit_long_tp or exit_long_sl) and position == 1:
+            pnl = (c - entry_price) * units
             equity += pnl
-            trades.append(
-                {
-                    "time": data.index[i],
-                    "side": "LONG",
-                    "entry": entry_price,
-                    "exit": row.close,
-                    "pnl": pnl,
-                    "reason": "SL_ST_flip",
-                }
-            )
+            k = _record_trade(trades, k, i, 1, entry_price, c, pnl, _TP_MA_DOWN if exit_long_tp else _SL_ST_FLIP)
             position = 0
             units = 0.0
             entry_price = np.nan
@@ -255,115 +378,395 @@ def run_backtest(df_raw: pd.DataFrame, cfg: Config, start: str | None, end: str
         # ショート側
         if sell_signal:
             if position == 1:
-                pnl = (row.close - entry_price) * units
+                pnl = (c - entry_price) * units
                 equity += pnl
-                trades.append(
-                    {
-                        "time": data.index[i],
-                        "side": "LONG",
-                        "entry": entry_price,
-                        "exit": row.close,
-                        "pnl": pnl,
-                        "reason": "ReverseToShort",
-                    }
-                )
-            notional = equity * (cfg.qty_pct / 100)
-            units = notional / row.close
-            entry_price = row.close
+                k = _record_trade(trades, k, i, 1, entry_price, c, pnl, _REVERSE_TO_SHORT)
+            notional = equity * (qty_pct / 100)
+            units = notional / c
+            entry_price = c
             position = -1
             touched_ma_short = False
 
-        elif exit_short_tp and position == -1:
-            pnl = (entry_price - row.close) * units
-            equity += pnl
-            trades.append(
-                {
-                    "time": data.index[i],
-                    "side": "SHORT",
-                    "entry": entry_price,
-                    "exit": row.close,
-                    "pnl": pnl,
-                    "reason": "TP_MA_up",
-                }
-            )
-            position = 0
-            units = 0.0
-            entry_price = np.nan
-
-        elif exit_short_sl and position == -1:
-            pnl = (entry_price - row.close) * units
+        elif (exit_short_tp or exit_short_sl) and position == -1:
+            pnl = (entry_price - c) * units
             equity += pnl
-            trades.append(
-                {
-                    "time": data.index[i],
-                    "side": "SHORT",
-                    "entry": entry_price,
-                    "exit": row.close,
-                    "pnl": pnl,
-                    "reason": "SL_ST_flip",
-                }
-            )
+            k = _record_trade(trades, k, i, -1, entry_price, c, pnl, _TP_MA_UP if exit_short_tp else _SL_ST_FLIP)
             position = 0
             units = 0.0
             entry_price = np.nan
 
         mark_to_market = equity
         if position == 1:
-            mark_to_market += (row.close - entry_price) * units
+            mark_to_market += (c - entry_price) * units
         elif position == -1:
-            mark_to_market += (entry_price - row.close) * units
-        equity_curve.append(mark_to_market)
+            mark_to_market += (entry_price - c) * units
+        equity_curve[i - 1] = mark_to_market
 
-    if position != 0 and len(data) > 0:
-        last_close = data["close"].iloc[-1]
+    if position != 0 and n > 0:
+        last_close = close[n - 1]
         if position == 1:
             pnl = (last_close - entry_price) * units
-            side = "LONG"
         else:
             pnl = (entry_price - last_close) * units
-            side = "SHORT"
         equity += pnl
-        trades.append(
-            {
-                "time": data.index[-1],
-                "side": side,
-                "entry": entry_price,
-                "exit": last_close,
-                "pnl": pnl,
-                "reason": "FinalClose",
-            }
-        )
+        k = _record_trade(trades, k, n - 1, position, entry_price, last_close, pnl, _FINAL_CLOSE)
+
+    return k, equity
+
+
+if njit is not None:
+    _record_trade = njit(cache=True)(_record_trade)
+    _backtest_loop_jit = njit(cache=True)(_backtest_loop)
+else:
+    _backtest_loop_jit = None
+
+
+def backtest_kernel(
+    open_: np.ndarray,
+    high: np.ndarray,
+    low: np.ndarray,
+    close: np.ndarray,
+    ma_fast: np.ndarray,
+    ma_slow: np.ndarray,
+    st_dir: np.ndarray,
+    touch_margin: float,
+    initial_capital: float,
+    qty_pct: float,
+) -> tuple[np.ndarray, float, np.ndarray]:
+    cols = [np.ascontiguousarray(a, dtype=np.float64) for a in (open_, high, low, close, ma_fast, ma_slow, st_dir)]
+    n = len(cols[3])
+    capacity = max(64, n // 16)
+    args = (float(touch_margin), float(initial_capital), float(qty_pct))
+
+    while True:
+        trades = np.zeros(capacity, dtype=TRADE_DTYPE)
+        with stage("backtest.bar_loop", rows=n):
+            if _backtest_loop_jit is not None:
+                equity_curve = np.empty(max(n - 1, 0), dtype=np.float64)
+                count, equity = _backtest_loop_jit(*cols, *args, trades, equity_curve)
+            else:
+                # バー単位の読み出しは Python の float リストの方が速い
+                curve = [0.0] * max(n - 1, 0)
+                count, equity = _backtest_loop(*(a.tolist() for a in cols), *args, trades, curve)
+                equity_curve = np.array(curve, dtype=np.float64)
+        if count <= capacity:
+            return trades[:count], equity, equity_curve
+        capacity = count
+
+
+def trades_to_frame(trades: np.ndarray, index: pd.Index) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "time": index[trades["bar"]],
+            "side": np.where(trades["side"] == 1, "LONG", "SHORT").astype(object),
+            "entry": trades["entry"],
+            "exit": trades["exit"],
+            "pnl": trades["pnl"],
+            "reason": np.array(TRADE_REASONS, dtype=object)[trades["reason"]],
+        }
+    )
+
+
+def heikin_ashi_frame(df_raw: pd.DataFrame) -> pd.DataFrame:
+    ha = build_heikin_ashi(df_raw)
+    data = pd.DataFrame(index=df_raw.index)
+    data["open"] = ha["ha_open"]
+    data["high"] = ha["ha_high"]
+    data["low"] = ha["ha_low"]
+    data["close"] = ha["ha_close"]
+    return data
 
-    trades_df = pd.DataFrame(trades)
-    total = len(trades_df)
-    wins = int((trades_df["pnl"] > 0).sum()) if total else 0
-    losses = int((trades_df["pnl"] <= 0).sum()) if total else 0
-    gross_profit = float(trades_df.loc[trades_df["pnl"] > 0, "pnl"].sum()) if total else 0.0
-    gross_loss = float(trades_df.loc[trades_df["pnl"] <= 0, "pnl"].sum()) if total else 0.0
-    pf = gross_profit / abs(gross_loss) if gross_loss < 0 else np.nan
-    win_rate = (wins / total * 100) if total else 0.0
-    net = equity - cfg.initial_capital
-
-    max_dd = 0.0
-    if equity_curve:
-        eq = pd.Series(equity_curve)
-        max_dd = float((eq.cummax() - eq).max())
-
-    result = {
-        "initial_capital": cfg.initial_capital,
-        "final_equity": equity,
-        "net_pnl": net,
-        "net_pct": (net / cfg.initial_capital) * 100,
-        "total_trades": total,
-        "win_rate": win_rate,
-        "profit_factor": pf,
-        "max_drawdown": max_dd,
-        "avg_win": float(trades_df.loc[trades_df["pnl"] > 0, "pnl"].mean()) if wins else 0.0,
-        "avg_loss": float(trades_df.loc[trades_df["pnl"] <= 0, "pnl"].mean()) if losses else 0.0,
-    }
+
+def add_indicators(data: pd.DataFrame, cfg: Config) -> pd.DataFrame:
+    data = data.copy()
+    data["ma_fast"] = calc_ma(data["close"], cfg.ma_type, cfg.ma_fast_len)
+    data["ma_slow"] = calc_ma(data["close"], cfg.ma_type, cfg.ma_slow_len)
+    data["st"], data["st_dir"] = calc_supertrend(data, cfg.st_period, cfg.st_factor)
+    return data
+
+
+@profiled("backtest.metrics")
+def summarize(trades_df: pd.DataFrame, equity_curve: np.ndarray, initial_capital: float, equity: float) -> dict:
+    return summarize_pnl(trades_df["pnl"].to_numpy(dtype=np.float64), equity_curve, initial_capital, equity)
+
+
+def simulate(data: pd.DataFrame, cfg: Config) -> tuple[dict, pd.DataFrame, pd.Series]:
+    # data は heikin_ashi_frame + add_indicators の列を持つフレーム（期間の切り出しは呼び出し側）
+    data = data.dropna()
+
+    touch_margin = cfg.touch_margin_pips * infer_pip_unit(data["close"].values)
+
+    trades, equity, equity_curve = backtest_kernel(
+        data["open"].to_numpy(),
+        data["high"].to_numpy(),
+        data["low"].to_numpy(),
+        data["close"].to_numpy(),
+        data["ma_fast"].to_numpy(),
+        data["ma_slow"].to_numpy(),
+        data["st_dir"].to_numpy(),
+        touch_margin,
+        cfg.initial_capital,
+        cfg.qty_pct,
+    )
+
+    trades_df = trades_to_frame(trades, data.index)
+    result = summarize(trades_df, equity_curve, cfg.initial_capital, equity)
+    # 評価額は2本目のバーから記録される
+    return result, trades_df, pd.Series(equity_curve, index=data.index[1 : len(equity_curve) + 1], name="equity")
+
+
+def run_backtest(df_raw: pd.DataFrame, cfg: Config, start: str | None, end: str | None) -> tuple[dict, pd.DataFrame]:
+    df_raw = slice_period(df_raw, start, end)
+
+    data = add_indicators(heikin_ashi_frame(df_raw), cfg)
+    result, trades_df, _ = simulate(data, cfg)
     return result, trades_df
 
 
+def grid_metrics(result: dict) -> dict:
+    # optimize_*.py が結果CSVに出力する指標列と同じ丸め
+    pf = result["profit_factor"]
+    return {
+        "net": round(result["net_pnl"], 0),
+        "net_pct": round(result["net_pct"], 3),
+        "dd": round(result["max_drawdown"], 0),
+        "dd_pct": round(result["max_drawdown_pct"], 3),
+        "dd_bars": int(result["max_drawdown_bars"]),
+        "pf": round(float(pf) if pd.notna(pf) else 999.0, 3),
+        "wr": round(result["win_rate"], 2),
+        "trades": int(result["total_trades"]),
+    }
+
+
+# 設定数がこれ未満なら1設定ずつ配列カーネルで回す。合成5分足(seed 固定)で batch と1設定ずつの時間を比べた損益分岐:
+# numba なしは 20k 本で約16設定。numba ありは1設定ずつが速く(1本・1設定あたり約0.5µs)、batch はバー単位の
+# 固定費(1本あたり約50µs)が重いので分岐がバー数とともに上がる(20k 本で約110、100k 本で約270、1M 本で約380設定)
+_BATCH_MIN_CONFIGS = 16
+_BATCH_MIN_CONFIGS_JIT = ((50_000, 128), (500_000, 256), (float("inf"), 384))  # (バー数がこれ未満, 設定数)
+
+
+def _batch_min_configs(n_bars: int) -> int:
+    if _backtest_loop_jit is None:
+        return _BATCH_MIN_CONFIGS
+    return next(configs for bars, configs in _BATCH_MIN_CONFIGS_JIT if n_bars < bars)
+
+
+def run_backtest_batch(
+    df_raw: pd.DataFrame,
+    configs: list[Config],
+    start: str | None = None,
+    end: str | None = None,
+    curves: str | Path | None = None,
+) -> pd.DataFrame:
+    # curves は equity_curves.create_curve_store で作ったフォルダ。渡すと各設定の評価額曲線をその行に書き込む
+    df_raw = slice_period(df_raw, start, end)
+    writer = open_curve_writer(curves) if curves is not None else None
+
+    def single(cfg: Config) -> dict:
+        if writer is None:
+            return run_backtest(df_raw, cfg, None, None)[0]
+        result, _, curve = simulate(add_indicators(heikin_ashi_frame(df_raw), cfg), cfg)
+        writer.write_curve(writer.row(cfg), df_raw.index.searchsorted(curve.index), curve.to_numpy(), cfg.initial_capital)
+        return result
+
+    n_cfg = len(configs)
+    if n_cfg < _batch_min_configs(len(df_raw)):
+        # 設定数が少ないとバー単位のベクトル演算のオーバーヘッドが勝つので、1設定ずつ配列カーネルで回す
+        return pd.DataFrame([{**vars(cfg), **grid_metrics(single(cfg))} for cfg in configs])
+
+    data = heikin_ashi_frame(df_raw)
+    n = len(data)
+
+    # 全設定で共通の指標はユニークな組み合わせごとに1回だけ計算し、列番号で参照する
+    ma_keys = sorted({(c.ma_type.upper(), c.ma_fast_len) for c in configs} | {(c.ma_type.upper(), c.ma_slow_len) for c in configs})
+    st_keys = sorted({(c.st_period, c.st_factor) for c in configs})
+    ma_table = np.empty((n, len(ma_keys)), dtype=np.float64)
+    for j, (ma_type, length) in enumerate(ma_keys):
+        ma_table[:, j] = calc_ma(data["close"], ma_type, length).to_numpy()
+    st_valid = np.empty((n, len(st_keys)), dtype=bool)
+    st_dir_table = np.empty((n, len(st_keys)), dtype=np.float64)
+    for j, (period, factor) in enumerate(st_keys):
+        st, st_dir = calc_supertrend(data, period, factor)
+        st_valid[:, j] = st.notna().to_numpy() & st_dir.notna().to_numpy()
+        st_dir_table[:, j] = st_dir.to_numpy()
+
+    fast_idx = np.array([ma_keys.index((c.ma_type.upper(), c.ma_fast_len)) for c in configs], dtype=np.int64)
+    slow_idx = np.array([ma_keys.index((c.ma_type.upper(), c.ma_slow_len)) for c in configs], dtype=np.int64)
+    st_idx = np.array([st_keys.index((c.st_period, c.st_factor)) for c in configs], dtype=np.int64)
+
+    # run_backtest の dropna() に相当する開始位置。欠損が先頭以外にある設定は単体実行にまわす
+    ohlc_valid = data[["open", "high", "low", "close"]].notna().all(axis=1).to_numpy()
+    first = np.full(n_cfg, n, dtype=np.int64)
+    fallback = set()
+    for k in range(n_cfg):
+        valid = (
+            ohlc_valid
+            & ~np.isnan(ma_table[:, fast_idx[k]])
+            & ~np.isnan(ma_table[:, slow_idx[k]])
+            & st_valid[:, st_idx[k]]
+        )
+        if valid.any():
+            first[k] = int(np.argmax(valid))
+            if not valid[first[k]:].all():
+                fallback.add(k)
+
+    close_all = data["close"].to_numpy()
+    pip_units = {f: infer_pip_unit(close_all[f:]) for f in np.unique(first)}
+    touch_margin = np.array(
+        [c.touch_margin_pips * pip_units[first[k]] for k, c in enumerate(configs)], dtype=np.float64
+    )
+    qty_pct = np.array([c.qty_pct for c in configs], dtype=np.float64)
+    initial_capital = np.array([c.initial_capital for c in configs], dtype=np.float64)
+
+    # 設定ごとの状態ベクトル
+    equity = initial_capital.copy()
+    position = np.zeros(n_cfg, dtype=np.int64)
+    units = np.zeros(n_cfg, dtype=np.float64)
+    entry_price = np.full(n_cfg, np.nan)
+    touched_ma_long = np.zeros(n_cfg, dtype=bool)
+    touched_ma_short = np.zeros(n_cfg, dtype=bool)
+    total = np.zeros(n_cfg, dtype=np.int64)
+    wins = np.zeros(n_cfg, dtype=np.int64)
+    gross_profit = np.zeros(n_cfg, dtype=np.float64)
+    gross_loss = np.zeros(n_cfg, dtype=np.float64)
+
+    def close_trades(mask: np.ndarray, pnl: np.ndarray) -> None:
+        pnl = pnl[mask]
+        win = pnl > 0
+        equity[mask] += pnl
+        total[mask] += 1
+        idx = np.flatnonzero(mask)
+        wins[idx[win]] += 1
+        gross_profit[idx[win]] += pnl[win]
+        gross_loss[idx[~win]] += pnl[~win]
+
+    def open_trades(mask: np.ndarray, c: float, side: int) -> None:
+        units[mask] = equity[mask] * (qty_pct[mask] / 100) / c
+        entry_price[mask] = c
+        position[mask] = side
+
+    def flatten(mask: np.ndarray) -> None:
+        position[mask] = 0
+        units[mask] = 0.0
+        entry_price[mask] = np.nan
+
+    open_, high, low = data["open"].to_numpy(), data["high"].to_numpy(), data["low"].to_numpy()
+    # ポジションに依存しない条件はブロック単位でまとめて (バー × 設定) 行列として計算する
+    block = max(64, min(4096, 2_000_000 // max(n_cfg, 1)))
+    b_start = int(first.min()) + 1 if n_cfg else n
+    # 評価額はブロック分を (バー, 設定) の行列に書き、ブロックごとにドローダウンの集計と曲線の保存をまとめて行う。
+    # 開始前の設定は equity = 初期資金・ノーポジなので DD に影響しない
+    curve_blk = np.empty((min(block, max(n - b_start, 0)), n_cfg), dtype=np.float64)
+    drawdown = DrawdownTracker(n_cfg, b_start)
+    rows_idx = np.array([writer.row(cfg) for cfg in configs], dtype=np.int64) if writer is not None else None
+    if writer is not None:
+        writer.write_block(rows_idx, 0, np.broadcast_to(initial_capital, (min(b_start, n), n_cfg)))
+    # 行数は (バー x 設定) の評価数
+    with stage("batch.bar_loop", rows=max(n - b_start, 0) * n_cfg):
+        for b0 in range(b_start, n, block):
+            b1 = min(b0 + block, n)
+            mf = ma_table[b0:b1][:, fast_idx]
+            ms = ma_table[b0:b1][:, slow_idx]
+            prev_mf = ma_table[b0 - 1 : b1 - 1][:, fast_idx]
+            prev_ms = ma_table[b0 - 1 : b1 - 1][:, slow_idx]
+            sd = st_dir_table[b0:b1][:, st_idx]
+            lo = low[b0:b1, None]
+            hi = high[b0:b1, None]
+
+            active = first[None, :] < np.arange(b0, b1)[:, None]
+            gc_blk = active & (mf > ms)
+            dc_blk = active & (mf < ms)
+            reset_long_blk = gc_blk & (prev_mf <= prev_ms)
+            reset_short_blk = dc_blk & (prev_mf >= prev_ms)
+            touch_long_blk = (lo <= (mf + touch_margin)) | (lo <= (ms + touch_margin))
+            below_slow_blk = lo < ms
+            touch_short_blk = (hi >= (mf - touch_margin)) | (hi >= (ms - touch_margin))
+            above_slow_blk = hi > ms
+            exit_long_blk = active & ((mf < prev_mf) | (sd > 0))
+            exit_short_blk = active & ((mf > prev_mf) | (sd < 0))
+
+            for j in range(b1 - b0):
+                i = b0 + j
+                c = close_all[i]
+                gc = gc_blk[j]
+                dc = dc_blk[j]
+
+                # GC/DC切替で待機状態リセット
+                touched_ma_long &= ~reset_long_blk[j]
+                touched_ma_short &= ~reset_short_blk[j]
+
+                m = gc & (position <= 0)
+                touched_ma_long[:] = np.where(m, (touched_ma_long | touch_long_blk[j]) & ~below_slow_blk[j], touched_ma_long)
+                m = dc & (position >= 0)
+                touched_ma_short[:] = np.where(
+                    m, (touched_ma_short | touch_short_blk[j]) & ~above_slow_blk[j], touched_ma_short
+                )
+
+                buy_signal = (position <= 0) & gc & touched_ma_long if c > open_[i] else None
+                sell_signal = (position >= 0) & dc & touched_ma_short if c < open_[i] else None
+                if buy_signal is not None and not buy_signal.any():
+                    buy_signal = None
+                if sell_signal is not None and not sell_signal.any():
+                    sell_signal = None
+
+                exit_long = exit_long_blk[j] & (position == 1)
+                exit_short = exit_short_blk[j] & (position == -1)
+
+                # ロング側
+                if buy_signal is not None:
+                    close_trades(buy_signal & (position == -1), (entry_price - c) * units)
+                    exit_long &= ~buy_signal
+                    exit_short &= ~buy_signal
+                if exit_long.any():
+                    close_trades(exit_long, (c - entry_price) * units)
+                    flatten(exit_long)
+                if buy_signal is not None:
+                    open_trades(buy_signal, c, 1)
+                    touched_ma_long &= ~buy_signal
+
+                # ショート側
+                if sell_signal is not None:
+                    close_trades(sell_signal & (position == 1), (c - entry_price) * units)
+                    exit_short &= ~sell_signal
+                if exit_short.any():
+                    close_trades(exit_short, (entry_price - c) * units)
+                    flatten(exit_short)
+                if sell_signal is not None:
+                    open_trades(sell_signal, c, -1)
+                    touched_ma_short &= ~sell_signal
+
+                np.add(equity, np.where(position != 0, (c - entry_price) * position * units, 0.0), out=curve_blk[j])
+
+            drawdown.update(curve_blk[: b1 - b0])
+            if writer is not None:
+                writer.write_block(rows_idx, b0, curve_blk[: b1 - b0])
+
+    if n:
+        c = close_all[-1]
+        close_trades(position == 1, (c - entry_price) * units)
+        close_trades(position == -1, (entry_price - c) * units)
+
+    m = metrics_from_sums(wins, total - wins, gross_profit, gross_loss)
+    net = equity - initial_capital
+    rows = []
+    for k, cfg in enumerate(configs):
+        if k in fallback:
+            result = single(cfg)
+        else:
+            result = {
+                "net_pnl": net[k],
+                "net_pct": (net[k] / cfg.initial_capital) * 100,
+                "total_trades": int(total[k]),
+                "win_rate": float(m["win_rate"][k]),
+                "profit_factor": float(m["profit_factor"][k]),
+                "max_drawdown": float(drawdown.max_dd[k]),
+                "max_drawdown_pct": float(drawdown.max_pct[k]),
+                "max_drawdown_bars": int(drawdown.max_bars[k]),
+            }
+        rows.append({**vars(cfg), **grid_metrics(result)})
+    return pd.DataFrame(rows)
+
+
 def print_result(result: dict) -> None:
     print("\n=== Heikin Ashi MA Touch (5m) Summary ===")
     print(f"Initial Capital : {result['initial_capital']:.0f}")
@@ -372,29 +775,32 @@ def print_result(result: dict) -> None:
     print(f"Trades          : {result['total_trades']}")
     print(f"Win Rate        : {result['win_rate']:.2f}%")
     print(f"Profit Factor   : {result['profit_factor']:.2f}" if pd.notna(result["profit_factor"]) else "Profit Factor   : inf")
-    print(f"Max Drawdown    : {result['max_drawdown']:.0f}")
+    print(f"Max Drawdown    : {result['max_drawdown']:.0f} ({result['max_drawdown_pct']:.2f}%, {result['max_drawdown_bars']} bars)")
     print(f"Avg Win / Loss  : {result['avg_win']:.0f} / {result['avg_loss']:.0f}")
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Heikin Ashi MA Touch Strategy v4 の5分足ローカル検証")
-    parser.add_argument("--csv", default="data/usdjpy_5m.csv", help="5分足OHLCV CSV")
+    parser.add_argument("--csv", default="data/usdjpy_5m.csv", help="5分足OHLCV CSV またはバーストア(.bars)")
     parser.add_argument("--start", default=None, help="開始日時(例: 2025-01-01)")
     parser.add_argument("--end", default=None, help="終了日時(例: 2026-02-28)")
     parser.add_argument("--ma-type", default="SMA", choices=["SMA", "EMA"], help="MAタイプ")
     parser.add_argument("--out-trades", default="result_trades_ha_touch_5m.csv", help="トレード履歴CSV出力先")
+    parser.add_argument("--cache-dir", default=None, help="指標キャッシュの保存先フォルダ(プロセス間で再利用)")
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    start_profile(args)
 
-    path = Path(args.csv)
-    if not path.exists():
-        raise FileNotFoundError(f"CSVが見つかりません: {path}")
+    if args.cache_dir:
+        set_cache(IndicatorCache(disk_dir=args.cache_dir))
 
-    raw = pd.read_csv(path)
+    df = load_bars(args.csv, args.start, args.end)
     required = {"open", "high", "low", "close"}
-    if not required.issubset(raw.columns):
+    if not required.issubset(df.columns):
         raise ValueError("CSVには open, high, low, close 列が必要です")
+    if df.attrs.get("time_format"):
+        print(f"日時形式: {df.attrs['time_format']}")
 
-    df = parse_datetime(raw)
     cfg = Config(ma_type=args.ma_type)
 
     result, trades = run_backtest(df, cfg, args.start, args.end)
@@ -405,6 +811,8 @@ def main() -> None:
         trades.to_csv(out_path, index=False)
         print(f"\nトレード履歴を出力しました: {out_path}")
 
+    finish_profile(args)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from profiling import stage
+
+# バーストア: 1フォルダに列ごとの .npy（time は UTC ns の int64）と meta.json を置く。
+# 読み込みは np.load(mmap_mode="r") で、期間指定は time の searchsorted で切り出してから行う
+STORE_SUFFIX = ".bars"
+_META = "meta.json"
+_TIME = "time"
+_NPY_HEADER = 128  # 1次元配列の .npy ヘッダ長（行数の桁数によらず一定）
+
+
+def store_path_for(csv_path: str | Path) -> Path:
+    # data/usdjpy_5m.csv -> data/usdjpy_5m.bars
+    return Path(csv_path).with_suffix(STORE_SUFFIX)
+
+
+def is_bar_store(path: str | Path) -> bool:
+    return (Path(path) / _META).is_file()
+
+
+def _write_header(fh, dtype: np.dtype, n: int) -> None:
+    fh.seek(0)
+    np.lib.format.write_array_header_1_0(fh, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (n,)})
+    if fh.tell() != _NPY_HEADER:
+        raise RuntimeError(".npy ヘッダ長が想定と異なります")
+
+
+class BarStoreWriter:
+    # 足を追記していき、close() で行数をヘッダに書き込んで差し替える（途中で落ちても既存のストアは壊さない）
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.tmp = self.path.with_name(f"{self.path.name}.tmp-{os.getpid()}")
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.tmp.mkdir(parents=True)
+        self.files: dict[str, tuple] = {}
+        self.rows = 0
+        self.index_name: str | None = None
+        self.last_ns: int | None = None
+
+    def append(self, bars: pd.DataFrame) -> None:
+        # bars は DatetimeIndex（tz 付き）の OHLCV
+        if bars.empty:
+            return
+        if not self.files:
+            self.index_name = bars.index.name
+            columns = {_TIME: np.dtype(np.int64)}
+            # 元の日時文字列などの非数値列は持たない
+            columns.update({c: bars[c].to_numpy().dtype for c in bars.columns if pd.api.types.is_numeric_dtype(bars[c])})
+            for name, dtype in columns.items():
+                fh = open(self.tmp / f"{name}.npy", "wb")
+                _write_header(fh, dtype, 0)
+                self.files[name] = (fh, dtype)
+
+        ns = bars.index.as_unit("ns").asi8
+        if (self.last_ns is not None and ns[0] <= self.last_ns) or (len(ns) > 1 and (np.diff(ns) <= 0).any()):
+            raise ValueError("バーストアには時刻の昇順・重複なしで追記してください")
+        self.last_ns = int(ns[-1])
+        for name, (fh, dtype) in self.files.items():
+            values = ns if name == _TIME else bars[name].to_numpy()
+            fh.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        self.rows += len(bars)
+
+    def close(self) -> Path:
+        for fh, dtype in self.files.values():
+            _write_header(fh, dtype, self.rows)
+            fh.close()
+        meta = {
+            "rows": self.rows,
+            "columns": [c for c in self.files if c != _TIME],
+            "index_name": self.index_name,
+        }
+        (self.tmp / _META).write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+
+        # 既存のストアは退避してから入れ替え、最後に消す
+        old = self.path.with_name(f"{self.path.name}.old-{os.getpid()}")
+        if self.path.exists():
+            os.replace(self.path, old)
+        os.replace(self.tmp, self.path)
+        shutil.rmtree(old, ignore_errors=True)
+        return self.path
+
+    def abort(self) -> None:
+        for fh, _ in self.files.values():
+            fh.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def write_bar_store(bars: pd.DataFrame, path: str | Path) -> Path:
+    writer = BarStoreWriter(path)
+    try:
+        writer.append(bars)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
+
+
+def _bound(value: str | pd.Timestamp | None) -> int | None:
+    if value is None or value == "":
+        return None
+    return int(pd.to_datetime(value, utc=True).as_unit("ns").value)
+
+
+def load_bar_store(path: str | Path, start: str | None = None, end: str | None = None) -> pd.DataFrame:
+    # run_backtest と同じく start <= t <= end。列は読み取り専用の memmap をそのまま参照する（時刻の索引だけはコピー）
+    path = Path(path)
+    meta = json.loads((path / _META).read_text(encoding="utf-8"))
+    time = np.load(path / f"{_TIME}.npy", mmap_mode="r")
+    lo, hi = _bound(start), _bound(end)
+    i0 = int(np.searchsorted(time, lo, side="left")) if lo is not None else 0
+    i1 = int(np.searchsorted(time, hi, side="right")) if hi is not None else len(time)
+    i1 = max(i0, i1)
+
+    index = pd.DatetimeIndex(np.asarray(time[i0:i1]).view("datetime64[ns]"), name=meta["index_name"]).tz_localize("UTC")
+    # np.asarray で memmap サブクラスを外した ndarray ビューにする（コピーはしない）
+    columns = {c: np.asarray(np.load(path / f"{c}.npy", mmap_mode="r")[i0:i1]) for c in meta["columns"]}
+    return pd.DataFrame(columns, index=index, copy=False)
+
+
+def load_bars(path: str | Path, start: str | None = None, end: str | None = None) -> pd.DataFrame:
+    # バーストアのフォルダ、または CSV と同名の .bars（CSV より新しい場合）があればそちらを使う
+    path = Path(path)
+    store = path if is_bar_store(path) else store_path_for(path)
+    with stage("load_bars") as st:
+        if is_bar_store(store) and (not path.is_file() or store.stat().st_mtime >= path.stat().st_mtime):
+            df = load_bar_store(store, start, end)
+        else:
+            df = read_csv_bars(path, start, end)
+        st.rows = len(df)
+    return df
+
+
+def read_csv_bars(path: str | Path, start: str | None = None, end: str | None = None) -> pd.DataFrame:
+    # CSV の時だけ使う（バックテスト側からも import されるので循環 import を避ける）
+    from backtest_heikin_ashi_ma_touch_5m import parse_datetime, slice_period
+
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"CSVが見つかりません: {path}")
+    return slice_period(parse_datetime(pd.read_csv(path)), start, end)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OHLCV CSV をバーストア(.bars フォルダ)へ変換")
+    parser.add_argument("csv", help="変換元のOHLCV CSV")
+    parser.add_argument("--out", default=None, help="出力先フォルダ(省略時は CSV と同名の .bars)")
+    args = parser.parse_args()
+
+    if is_bar_store(args.csv):
+        raise ValueError(f"すでにバーストアです: {args.csv}")
+    df = read_csv_bars(args.csv)
+    out = write_bar_store(df, args.out or store_path_for(args.csv))
+    print(f"Saved: {out} ({len(df):,} bars)")
+
+
+if __name__ == "__main__":
+    main()
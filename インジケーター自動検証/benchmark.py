@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+from backtest_heikin_ashi_ma_touch_5m import Config, build_heikin_ashi, calc_atr, calc_supertrend, run_backtest
+from grid_runner import run_grid
+from indicator_cache import set_cache
+from merge_oanda_ticks_to_1h import load_single_file, to_ohlcv
+from optimize_ha_touch_5m import SPACE, evaluate
+
+# ベンチマーク: 乱数シード固定の合成 USDJPY データ（5分足・tick）で各段階を計時して JSON に保存する。
+# --baseline を渡すと保存済みの結果と比べ、--threshold を超えて遅くなった段階があれば終了コード 1 で失敗する
+SIZES = {"10k": 10_000, "100k": 100_000, "1M": 1_000_000, "10M": 10_000_000}
+PRICE_TICK = 0.001  # USDJPY の価格の刻み（0.1 pip）
+# 短い段階は1回ごとのばらつき(GC・キャッシュ・割り込み)が大きいので、合計がこの秒数になるまで繰り返して中央値を取る。
+# それでも 0.2 秒未満の段階は同じコードの連続実行で中央値が最大 x1.4 動いたので、中央値が MIN_COMPARE_SECONDS 未満の段階は
+# 表示だけで回帰の判定には使わない（0.5 秒以上は x1.2 未満に収まった）
+MIN_TOTAL_SECONDS = 1.0
+MIN_COMPARE_SECONDS = 0.5
+_MAX_RUNS = 1000
+
+
+def _round_tick(price: np.ndarray) -> np.ndarray:
+    return np.round(price / PRICE_TICK) * PRICE_TICK
+
+
+def synthetic_bars(n: int, seed: int = 0, start: str = "2000-01-03") -> pd.DataFrame:
+    # 対数収益率のランダムウォーク（5分足で平均 2-3 pip 程度の値動き）。価格は 0.001 刻み
+    rng = np.random.default_rng(seed)
+    close = _round_tick(110.0 * np.exp(np.cumsum(rng.normal(0.0, 2.5e-4, n))))
+    open_ = np.r_[close[:1], close[:-1]]
+    wick = _round_tick(np.abs(rng.normal(0.0, 0.02, (2, n))))
+    return pd.DataFrame(
+        {
+            "open": open_,
+            "high": np.maximum(open_, close) + wick[0],
+            "low": np.minimum(open_, close) - wick[1],
+            "close": close,
+            "volume": rng.integers(50, 500, n).astype(np.float64),
+        },
+        index=pd.date_range(start, periods=n, freq="5min", tz="UTC", name="timestamp"),
+    )
+
+
+def synthetic_ticks(n: int, seed: int = 0, start: str = "2024-01-01") -> pd.DataFrame:
+    # tick 間隔は平均 0.8 秒の指数分布（ms 単位）、bid は 0.001 刻みのランダムウォーク、スプレッドは 0.2-0.8 pip
+    rng = np.random.default_rng(seed)
+    gaps = np.maximum(1, rng.exponential(800.0, n).astype(np.int64))
+    index = pd.Timestamp(start, tz="UTC") + pd.to_timedelta(np.cumsum(gaps), unit="ms")
+    bid = _round_tick(110.0 * np.exp(np.cumsum(rng.normal(0.0, 2e-5, n))))
+    spread = rng.integers(2, 9, n) * PRICE_TICK
+    return pd.DataFrame({"bid": bid, "ask": _round_tick(bid + spread)}, index=index.rename("timestamp"))
+
+
+def tick_csv(data_dir: Path, n: int, seed: int) -> Path:
+    # OANDA 形式の tick CSV。作成に時間がかかるので同じ件数・シードのファイルは使い回す
+    path = data_dir / f"ticks_{n}_{seed}.csv"
+    if not path.is_file():
+        data_dir.mkdir(parents=True, exist_ok=True)
+        ticks = synthetic_ticks(n, seed)
+        tmp = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+        ticks.to_csv(tmp, date_format="%Y-%m-%d %H:%M:%S.%f", float_format="%.3f")
+        os.replace(tmp, path)
+    return path
+
+
+def _sweep(df: pd.DataFrame, configs: list[Config]) -> pd.DataFrame:
+    # optimize_ha_touch_5m と同じ評価を全期間・1プロセスで
+    return run_grid(df, configs, partial(evaluate, start=None, end=None), chunk_size=256, progress_interval=0, batch=True)
+
+
+@dataclass
+class Stage:
+    name: str
+    kind: str  # bars: 5分足の DataFrame / tick_file: tick CSV のパス / ticks: 読み込み済みの tick
+    run: Callable[[Any], Any]
+
+
+def build_stages(sweep_configs: int) -> list[Stage]:
+    configs = SPACE.configs(Config())[:sweep_configs]
+    return [
+        Stage("calc_supertrend", "bars", lambda df: calc_supertrend(df, 10, 3.0)),
+        Stage("build_heikin_ashi", "bars", build_heikin_ashi),
+        Stage("calc_atr", "bars", lambda df: calc_atr(df, 14)),
+        Stage("run_backtest", "bars", lambda df: run_backtest(df, Config(), None, None)),
+        Stage("load_single_file", "tick_file", load_single_file),
+        Stage("to_ohlcv", "ticks", lambda ticks: to_ohlcv(ticks, "5min")),
+        Stage(f"optimizer_sweep[{len(configs)}]", "bars", lambda df: _sweep(df, configs)),
+    ]
+
+
+def time_stage(fn: Callable[[], Any], repeat: int) -> tuple[float, float, int]:
+    # (中央値の秒数, 最短の秒数, 実行回数)。--repeat 回以上かつ合計 MIN_TOTAL_SECONDS 以上になるまで繰り返す
+    # （1回で MIN_TOTAL_SECONDS を超える長い段階は1回だけ）
+    times: list[float] = []
+    while len(times) < _MAX_RUNS:
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+        total = sum(times)
+        if total >= MIN_TOTAL_SECONDS and (len(times) >= repeat or times[0] >= MIN_TOTAL_SECONDS):
+            break
+    return float(np.median(times)), min(times), len(times)
+
+
+def machine_info() -> dict:
+    info = {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+    }
+    try:
+        import numba
+
+        info["numba"] = numba.__version__
+    except ImportError:
+        info["numba"] = None
+    cpuinfo = Path("/proc/cpuinfo")
+    if cpuinfo.is_file():
+        model = next((line.split(":", 1)[1].strip() for line in cpuinfo.read_text().splitlines() if line.startswith("model name")), None)
+        info["processor"] = model or info["processor"]
+    if hasattr(os, "sysconf") and "SC_PHYS_PAGES" in os.sysconf_names:
+        info["memory_bytes"] = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    try:
+        rev = subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True, timeout=10)
+        info["git_commit"] = rev.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        info["git_commit"] = None
+    return info
+
+
+def compare(results: list[dict], baseline: dict, threshold: float) -> list[str]:
+    # threshold=0.2 なら中央値が基準より 20% 超遅い段階を回帰とする。基準に無い段階・短すぎる段階は比較しない
+    base = {(r["stage"], r["size"]): r["seconds"] for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        old = base.get((r["stage"], r["size"]))
+        if old is None:
+            continue
+        ratio = r["seconds"] / old if old > 0 else np.inf
+        mark = "  (短いので比較しない)" if old < MIN_COMPARE_SECONDS else ""
+        if old >= MIN_COMPARE_SECONDS and r["seconds"] > old * (1 + threshold):
+            mark = "  <-- 回帰"
+            regressions.append(f"{r['stage']} @ {r['size']}: {old:.3f}s -> {r['seconds']:.3f}s (x{ratio:.2f})")
+        print(f"  {r['stage']:28s} {r['size']:>5s}: {old:8.3f}s -> {r['seconds']:8.3f}s (x{ratio:.2f}){mark}")
+    return regressions
+
+
+def parse_sizes(text: str) -> list[str]:
+    sizes = [s.strip() for s in text.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        raise ValueError(f"未対応のサイズです: {unknown}（{', '.join(SIZES)}）")
+    return sizes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="合成 USDJPY データで指標計算・バックテスト・tick 変換・最適化の処理時間を計測する")
+    parser.add_argument("--sizes", default=",".join(SIZES), help="計測する足数/tick数(カンマ区切り: 10k,100k,1M,10M)")
+    parser.add_argument("--stages", default=None, help="計測する段階名(カンマ区切り、前方一致。省略時は全段階)")
+    parser.add_argument("--seed", type=int, default=0, help="合成データの乱数シード")
+    parser.add_argument("--repeat", type=int, default=5, help="短い段階の最小の繰り返し回数(中央値を採用)")
+    parser.add_argument("--sweep-configs", type=int, default=32, help="最適化スイープで評価する設定数")
+    parser.add_argument(
+        "--data-dir", default=str(Path(tempfile.gettempdir()) / "fx_bench_data"), help="合成 tick CSV の置き場所(次回以降は再利用)"
+    )
+    parser.add_argument("--out", default="bench_results.json", help="結果 JSON の出力先")
+    parser.add_argument("--baseline", default=None, help="比較する基準の結果 JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="基準より何割遅くなったら失敗とするか")
+    parser.add_argument("--update-baseline", action="store_true", help="今回の結果で --baseline を上書きする")
+    args = parser.parse_args()
+
+    sizes = parse_sizes(args.sizes)
+    stages = build_stages(args.sweep_configs)
+    if args.stages:
+        wanted = [s.strip() for s in args.stages.split(",") if s.strip()]
+        stages = [st for st in stages if any(st.name.startswith(w) for w in wanted)]
+        if not stages:
+            raise ValueError(f"該当する段階がありません: {args.stages}")
+    # 同じ入力での再計算がキャッシュから返らないよう、指標キャッシュは切っておく
+    set_cache(None)
+    data_dir = Path(args.data_dir)
+
+    # numba のコンパイル（キャッシュ読み込み）を計測から外すため、小さいデータで一通り動かしておく
+    warm_bars = synthetic_bars(2_000, args.seed)
+    warm_file = tick_csv(data_dir, 2_000, args.seed)
+    warm_ticks = load_single_file(warm_file)
+    for st in stages:
+        st.run({"bars": warm_bars, "tick_file": warm_file, "ticks": warm_ticks}[st.kind])
+
+    results = []
+    for size in sizes:
+        n = SIZES[size]
+        kinds = {st.kind for st in stages}
+        inputs: dict[str, Any] = {}
+        if "bars" in kinds:
+            inputs["bars"] = synthetic_bars(n, args.seed)
+        if kinds & {"tick_file", "ticks"}:
+            inputs["tick_file"] = tick_csv(data_dir, n, args.seed)
+        if "ticks" in kinds:
+            inputs["ticks"] = load_single_file(inputs["tick_file"])
+        for st in stages:
+            seconds, fastest, runs = time_stage(partial(st.run, inputs[st.kind]), args.repeat)
+            results.append(
+                {"stage": st.name, "size": size, "rows": n, "seconds": seconds, "min_seconds": fastest, "rows_per_sec": n / seconds, "runs": runs}
+            )
+            print(f"{st.name:28s} {size:>5s}: {seconds:8.3f}s ({n / seconds:,.0f} rows/s, {runs} 回の中央値)", flush=True)
+        inputs.clear()
+
+    report = {
+        "created": pd.Timestamp.now(tz="UTC").isoformat(),
+        "seed": args.seed,
+        "threshold": args.threshold,
+        "machine": machine_info(),
+        "results": results,
+    }
+    Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\nSaved: {args.out}")
+
+    if not args.baseline:
+        return
+    baseline_path = Path(args.baseline)
+    if args.update_baseline or not baseline_path.is_file():
+        baseline_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"基準を保存しました: {baseline_path}")
+        return
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    if baseline.get("machine", {}).get("processor") != report["machine"]["processor"]:
+        print("[注意] 基準と CPU が異なります。比較は参考値です", file=sys.stderr)
+    print(f"\n基準との比較 ({baseline_path}, threshold={args.threshold:.0%}):")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n[NG] {len(regressions)} 段階が基準より遅くなりました", file=sys.stderr)
+        for line in regressions:
+            print(f"  {line}", file=sys.stderr)
+        sys.exit(1)
+    print("\n[OK] 回帰なし")
+
+
+if __name__ == "__main__":
+    main()
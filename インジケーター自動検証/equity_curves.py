@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+import shutil
+from dataclasses import asdict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from metrics import DrawdownTracker
+
+# 評価額曲線のストア: 1フォルダに equity.npy（設定 x 保存するバーの float32 行列）・time.npy（その列の UTC ns）・
+# meta.json（設定の一覧と間引き幅）を置く。行列は最初に NaN で確保し、各ワーカーが memmap で自分の設定の行だけ書く
+_META = "meta.json"
+_EQUITY = "equity.npy"
+_TIME = "time.npy"
+_RANK_ROWS = 1024  # 順位付けで一度に読む行数
+
+
+def config_key(cfg) -> str:
+    params = cfg if isinstance(cfg, dict) else asdict(cfg)
+    return json.dumps(params, sort_keys=True)
+
+
+def curve_columns(n_bars: int, step: int) -> np.ndarray:
+    # 保存するバーの位置。step 本ごとの最後のバーと、期間の最後のバーは必ず残す
+    if n_bars == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.r_[np.arange(step - 1, n_bars, step), n_bars - 1]).astype(np.int64)
+
+
+def create_curve_store(path: str | Path, index: pd.DatetimeIndex, configs: list, step: int = 1) -> Path:
+    # index は評価期間のバーの時刻（run_backtest_batch が切り出す期間と同じ）
+    if step < 1:
+        raise ValueError("--curve-step は1以上を指定してください")
+    path = Path(path)
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True)
+    _WRITERS.pop(str(path), None)
+
+    cols = curve_columns(len(index), step)
+    np.save(path / _TIME, index.as_unit("ns").asi8[cols])
+    equity = np.lib.format.open_memmap(path / _EQUITY, mode="w+", dtype=np.float32, shape=(len(configs), len(cols)))
+    equity[:] = np.nan
+    equity.flush()
+    del equity
+    meta = {"bars": len(index), "step": step, "configs": [asdict(c) for c in configs]}
+    (path / _META).write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    return path
+
+
+class CurveWriter:
+    # 行列を r+ の memmap で開く。プロセスごとに1回だけ開けばよいよう open_curve_writer でキャッシュする
+    def __init__(self, path: str | Path) -> None:
+        path = Path(path)
+        meta = json.loads((path / _META).read_text(encoding="utf-8"))
+        self.bars = meta["bars"]
+        self.cols = curve_columns(meta["bars"], meta["step"])
+        self.rows = {config_key(c): k for k, c in enumerate(meta["configs"])}
+        self.equity = np.load(path / _EQUITY, mmap_mode="r+")
+
+    def row(self, cfg) -> int:
+        return self.rows[config_key(cfg)]
+
+    def write_block(self, rows: np.ndarray, start: int, block: np.ndarray) -> None:
+        # block は (バー, 設定) で、期間の start 本目からのバー
+        lo, hi = np.searchsorted(self.cols, [start, start + len(block)])
+        if hi > lo:
+            self.equity[np.asarray(rows)[:, None], np.arange(lo, hi)] = block[self.cols[lo:hi] - start].T
+
+    def write_curve(self, row: int, positions: np.ndarray, values: np.ndarray, initial_capital: float) -> None:
+        # 単体実行の曲線（欠損で落ちたバーを除いた位置 positions の値）。記録の無いバーは直前の値、開始前は初期資金
+        last = np.searchsorted(positions, self.cols, side="right") - 1
+        self.equity[row] = np.where(last >= 0, np.asarray(values)[np.maximum(last, 0)], initial_capital)
+
+
+_WRITERS: dict[str, CurveWriter] = {}
+
+
+def open_curve_writer(path: str | Path) -> CurveWriter:
+    key = str(path)
+    if key not in _WRITERS:
+        _WRITERS[key] = CurveWriter(path)
+    return _WRITERS[key]
+
+
+def load_curves(path: str | Path, rows: list[int] | None = None) -> pd.DataFrame:
+    # 時刻 x 設定の行番号の DataFrame（プロット用）
+    path = Path(path)
+    equity = np.load(path / _EQUITY, mmap_mode="r")
+    rows = list(range(len(equity))) if rows is None else list(rows)
+    index = pd.DatetimeIndex(np.load(path / _TIME).view("datetime64[ns]"), name="time").tz_localize("UTC")
+    return pd.DataFrame(np.asarray(equity[rows], dtype=np.float64).T, index=index, columns=rows)
+
+
+def rank_curves(path: str | Path) -> pd.DataFrame:
+    # 保存済みの曲線から設定ごとの最終損益とドローダウンを計算する（再実行なし）。
+    # 間引いて保存した場合、DD は保存したバーだけで見た値になる。まだ書かれていない行は除く
+    path = Path(path)
+    meta = json.loads((path / _META).read_text(encoding="utf-8"))
+    equity = np.load(path / _EQUITY, mmap_mode="r")
+    n_rows, n_cols = equity.shape
+    initial = np.array([c.get("initial_capital", np.nan) for c in meta["configs"]], dtype=np.float64)
+    stats = {k: np.full(n_rows, np.nan) for k in ("net", "net_pct", "dd", "dd_pct", "dd_bars")}
+    written = np.zeros(n_rows, dtype=bool)
+    for r0 in range(0, n_rows if n_cols else 0, _RANK_ROWS):
+        r1 = min(r0 + _RANK_ROWS, n_rows)
+        block = np.asarray(equity[r0:r1], dtype=np.float64).T
+        tracker = DrawdownTracker(r1 - r0)
+        tracker.update(block)
+        written[r0:r1] = ~np.isnan(block[-1])
+        stats["net"][r0:r1] = block[-1] - initial[r0:r1]
+        stats["dd"][r0:r1] = tracker.max_dd
+        stats["dd_pct"][r0:r1] = tracker.max_pct
+        stats["dd_bars"][r0:r1] = tracker.max_bars * meta["step"]
+    stats["net_pct"] = stats["net"] / initial * 100
+
+    out = pd.DataFrame(meta["configs"]).assign(**stats)
+    out.index.name = "row"
+    out = out[written]
+    return out.astype({"dd_bars": np.int64})
+
+
+def plot_curves(path: str | Path, rows: list[int], out: str | Path) -> None:
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError as e:
+        raise ImportError("--plot には matplotlib が必要です（pip install matplotlib）") from e
+
+    curves = load_curves(path, rows)
+    fig, ax = plt.subplots(figsize=(12, 6))
+    for row in rows:
+        ax.plot(curves.index, curves[row], linewidth=0.8, label=f"#{row}")
+    ax.set_ylabel("equity")
+    ax.legend(loc="upper left", fontsize="small")
+    fig.tight_layout()
+    fig.savefig(out)
+    plt.close(fig)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="保存した評価額曲線(.curves)を再実行せずに並べ替え・プロットする")
+    parser.add_argument("store", help="--save-curves で保存したフォルダ")
+    parser.add_argument("--sort", default="net", choices=["net", "net_pct", "dd", "dd_pct", "dd_bars"], help="並べ替えの指標")
+    parser.add_argument("--ascending", action="store_true", help="昇順(dd 系は小さい順に見たいとき)")
+    parser.add_argument("--top", type=int, default=20, help="表示する件数")
+    parser.add_argument("--plot", default=None, help="上位の曲線を画像に保存(matplotlib が必要)")
+    args = parser.parse_args()
+
+    ranked = rank_curves(args.store).sort_values(args.sort, ascending=args.ascending, kind="stable").head(args.top)
+    if ranked.empty:
+        print("No result")
+        return
+    print(ranked.round({"net": 0, "net_pct": 3, "dd": 0, "dd_pct": 3}).to_string())
+    if args.plot:
+        plot_curves(args.store, ranked.index.tolist(), args.plot)
+        print(f"\nSaved: {args.plot}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from profiling import call_profiled, get_profiler, stage
+from result_store import ResultScope
+
+
+@dataclass
+class SharedBars:
+    # 共有メモリ上に置いたバーのメタ情報（pickle してワーカーへ渡す）
+    index_name: str
+    values_name: str
+    columns: list[str]
+    length: int
+    tz: str | None
+    index_label: str | None
+
+
+def share_bars(df: pd.DataFrame) -> tuple[SharedBars, list[shared_memory.SharedMemory]]:
+    columns = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+    n = len(df)
+    index = df.index
+    if not isinstance(index, pd.DatetimeIndex):
+        raise ValueError("DatetimeIndex のデータフレームが必要です")
+
+    idx_shm = shared_memory.SharedMemory(create=True, size=max(n * 8, 1))
+    val_shm = shared_memory.SharedMemory(create=True, size=max(n * len(columns) * 8, 1))
+    # tz 付きでも asi8 は UTC 基準の ns
+    np.ndarray(n, dtype=np.int64, buffer=idx_shm.buf)[:] = index.as_unit("ns").asi8
+    values = np.ndarray((len(columns), n), dtype=np.float64, buffer=val_shm.buf)
+    for j, col in enumerate(columns):
+        values[j] = df[col].to_numpy(dtype=np.float64)
+
+    meta = SharedBars(
+        index_name=idx_shm.name,
+        values_name=val_shm.name,
+        columns=columns,
+        length=n,
+        tz=str(index.tz) if index.tz is not None else None,
+        index_label=index.name,
+    )
+    return meta, [idx_shm, val_shm]
+
+
+def attach_bars(meta: SharedBars) -> tuple[pd.DataFrame, list[shared_memory.SharedMemory]]:
+    # ワーカーは親と同じ resource_tracker を共有するので、unlink は親プロセスだけが行う
+    idx_shm = shared_memory.SharedMemory(name=meta.index_name)
+    val_shm = shared_memory.SharedMemory(name=meta.values_name)
+    n = meta.length
+    ns = np.ndarray(n, dtype=np.int64, buffer=idx_shm.buf)
+    values = np.ndarray((len(meta.columns), n), dtype=np.float64, buffer=val_shm.buf)
+
+    index = pd.DatetimeIndex(ns.view("datetime64[ns]"), name=meta.index_label)
+    if meta.tz is not None:
+        index = index.tz_localize("UTC").tz_convert(meta.tz)
+    # (列, バー) の共有配列の転置をそのまま1ブロックとして持たせ、コピーを避ける
+    df = pd.DataFrame(values.T, index=index, columns=meta.columns, copy=False)
+    return df, [idx_shm, val_shm]
+
+
+_worker: dict[str, Any] = {}
+
+
+def _init_worker(meta: SharedBars, evaluate: Callable, batch: bool) -> None:
+    # Ctrl-C は親プロセスだけが受けて途中結果を保存する
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    df, handles = attach_bars(meta)
+    _worker.update(df=df, handles=handles, evaluate=evaluate, batch=batch)
+
+
+def _init_dataset_worker(metas: dict[str, SharedBars]) -> None:
+    # 複数のデータセットを1つのプールで評価する（run_grids）。evaluate はチャンクごとに受け取る
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    datasets, handles = {}, []
+    for name, meta in metas.items():
+        datasets[name], h = attach_bars(meta)
+        handles += h
+    _worker.update(datasets=datasets, handles=handles)
+
+
+def evaluate_chunk(df: pd.DataFrame, evaluate: Callable, configs: list, batch: bool) -> list[dict | None]:
+    # 行数は評価した設定数
+    with stage("grid.chunk", rows=len(configs)):
+        return list(evaluate(df, configs)) if batch else [evaluate(df, cfg) for cfg in configs]
+
+
+def run_chunk(chunk_id: int, configs: list) -> tuple[int, list[dict | None]]:
+    return chunk_id, evaluate_chunk(_worker["df"], _worker["evaluate"], configs, _worker["batch"])
+
+
+def run_dataset_chunk(chunk_id, dataset: str, evaluate: Callable, batch: bool, configs: list) -> tuple[Any, list[dict | None]]:
+    return chunk_id, evaluate_chunk(_worker["datasets"][dataset], evaluate, configs, batch)
+
+
+def _submit(pool: ProcessPoolExecutor, fn: Callable, *args) -> Future:
+    profiler = get_profiler()
+    if profiler is None:
+        return pool.submit(fn, *args)
+    # --profile 時はワーカーの計測結果もチャンクごとに受け取り、chunk_result で合算する
+    return pool.submit(call_profiled, profiler.trace, fn, *args)
+
+
+def submit_chunk(pool: ProcessPoolExecutor, chunk_id: int, configs: list) -> Future:
+    return _submit(pool, run_chunk, chunk_id, configs)
+
+
+def chunk_result(fut: Future) -> tuple[int, list[dict | None]]:
+    result = fut.result()
+    profiler = get_profiler()
+    if profiler is not None:
+        result, snap = result
+        profiler.merge(snap)
+    return result
+
+
+@contextmanager
+def worker_pool(df: pd.DataFrame, evaluate: Callable, workers: int, batch: bool = False) -> Iterator[ProcessPoolExecutor]:
+    # バーを共有メモリに置き、各ワーカーは run_chunk で evaluate を呼ぶ
+    meta, handles = share_bars(df)
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(meta, evaluate, batch))
+    try:
+        yield pool
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    else:
+        pool.shutdown()
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+
+
+@contextmanager
+def dataset_pool(datasets: dict[str, pd.DataFrame], workers: int) -> Iterator[ProcessPoolExecutor]:
+    # 全データセットのバーを1回ずつ共有メモリに置き、どのワーカーもどのデータセットのチャンクでも評価できるようにする
+    metas, handles = {}, []
+    try:
+        for name, df in datasets.items():
+            metas[name], h = share_bars(df)
+            handles += h
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_dataset_worker, initargs=(metas,))
+        try:
+            yield pool
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        else:
+            pool.shutdown()
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+
+
+def _format_seconds(sec: float) -> str:
+    sec = int(sec)
+    if sec >= 3600:
+        return f"{sec // 3600}h{sec % 3600 // 60:02d}m"
+    if sec >= 60:
+        return f"{sec // 60}m{sec % 60:02d}s"
+    return f"{sec}s"
+
+
+class ProgressLine:
+    def __init__(self, total: int, interval: float, label: str = "grid") -> None:
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.done = 0
+        self.t0 = time.perf_counter()
+        self.last = 0.0
+
+    def update(self, n: int, force: bool = False) -> None:
+        self.done += n
+        if self.interval <= 0:
+            return
+        now = time.perf_counter()
+        if not force and now - self.last < self.interval:
+            return
+        self.last = now
+        elapsed = now - self.t0
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else float("nan")
+        pct = self.done / self.total * 100 if self.total else 100.0
+        eta_text = _format_seconds(eta) if np.isfinite(eta) else "-"
+        print(
+            f"\r[{self.label}] {self.done:,}/{self.total:,} ({pct:.1f}%) elapsed {_format_seconds(elapsed)} ETA {eta_text}",
+            end="",
+            file=sys.stderr,
+            flush=True,
+        )
+
+    def finish(self) -> None:
+        if self.interval > 0:
+            self.update(0, force=True)
+            print(file=sys.stderr)
+
+
+class RowWriter:
+    # 完了した行を到着順に追記する（行の順序は呼び出し側で設定順に並べ直す）
+    def __init__(self, out_path: str | Path | None) -> None:
+        self.path = Path(out_path) if out_path else None
+        self.header_written = False
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.unlink(missing_ok=True)
+
+    def write(self, rows: list[dict]) -> None:
+        if self.path is None or not rows:
+            return
+        pd.DataFrame(rows).to_csv(self.path, mode="a", header=not self.header_written, index=False)
+        self.header_written = True
+
+
+@dataclass
+class GridJob:
+    # run_grids の1ジョブ。dataset は datasets のキーで、同じデータセットを複数のジョブで使ってよい
+    name: str
+    dataset: str
+    configs: list
+    evaluate: Callable
+    batch: bool = False
+    store: ResultScope | None = None
+    out_path: str | Path | None = None
+
+
+def run_grid(
+    df: pd.DataFrame,
+    configs: list,
+    evaluate: Callable,
+    *,
+    workers: int = 1,
+    chunk_size: int = 16,
+    out_path: str | Path | None = None,
+    progress_interval: float = 1.0,
+    batch: bool = False,
+    store: ResultScope | None = None,
+) -> pd.DataFrame:
+    # evaluate(df, cfg) -> dict | None。batch=True なら evaluate(df, configs) -> list[dict | None]。
+    # store を渡すと保存済みの設定は評価せずにその行を使い、評価した分はチャンクごとにストアへ追記する
+    job = GridJob("grid", "df", configs, evaluate, batch, store, out_path)
+    return run_grids({"df": df}, [job], workers=workers, chunk_size=chunk_size, progress_interval=progress_interval)[0]
+
+
+def run_grids(
+    datasets: dict[str, pd.DataFrame],
+    jobs: list[GridJob],
+    *,
+    workers: int = 1,
+    chunk_size: int = 16,
+    progress_interval: float = 1.0,
+) -> list[pd.DataFrame]:
+    # 複数のジョブのチャンクを1つのプールに順に流し、ジョブごとの結果（configs の順）を返す。
+    # チャンクはジョブの順に投入するので、同じデータセットの設定が続き各ワーカーの指標キャッシュが効く
+    chunk_size = max(1, chunk_size)
+    for job in jobs:
+        if job.store is not None:
+            # BEST/SAFE 表（top_results）を今回の設定に絞るため
+            job.store.track(job.configs)
+    stored = [job.store.lookup(job.configs) if job.store is not None else {} for job in jobs]
+    chunks: dict[tuple[int, int], list[int]] = {}
+    for j, job in enumerate(jobs):
+        todo = [i for i in range(len(job.configs)) if i not in stored[j]]
+        for c, k in enumerate(range(0, len(todo), chunk_size)):
+            chunks[j, c] = todo[k : k + chunk_size]
+        if stored[j]:
+            label = "" if len(jobs) == 1 else f" {job.name}:"
+            print(f"[store]{label} 評価済み {len(stored[j]):,}/{len(job.configs):,} 件はストアの結果を使います", file=sys.stderr)
+    results: dict[tuple[int, int], list[dict | None]] = {}
+    writers = [RowWriter(job.out_path) for job in jobs]
+    for writer, rows in zip(writers, stored):
+        writer.write([r for r in rows.values() if r is not None])
+    total = sum(len(c) for c in chunks.values())
+    progress = ProgressLine(total, progress_interval)
+
+    def chunk_configs(key: tuple[int, int]) -> list:
+        return [jobs[key[0]].configs[i] for i in chunks[key]]
+
+    def collect(key: tuple[int, int], rows: list[dict | None]) -> None:
+        results[key] = rows
+        store = jobs[key[0]].store
+        if store is not None:
+            store.save(chunk_configs(key), rows)
+        writers[key[0]].write([r for r in rows if r is not None])
+        progress.update(len(rows))
+
+    interrupted = False
+    if workers <= 1:
+        try:
+            for key in chunks:
+                job = jobs[key[0]]
+                collect(key, evaluate_chunk(datasets[job.dataset], job.evaluate, chunk_configs(key), job.batch))
+        except KeyboardInterrupt:
+            interrupted = True
+    else:
+        used = {job.dataset: datasets[job.dataset] for job in jobs}
+        try:
+            with dataset_pool(used, workers) as pool:
+
+                def submit(key: tuple[int, int]) -> Future:
+                    job = jobs[key[0]]
+                    return _submit(pool, run_dataset_chunk, key, job.dataset, job.evaluate, job.batch, chunk_configs(key))
+
+                # 同時に投入するチャンクはワーカー数の数倍までに抑え、Ctrl-C で捨てる量を減らす
+                pending = set()
+                queue = iter(chunks)
+                for key in queue:
+                    pending.add(submit(key))
+                    if len(pending) >= workers * 4:
+                        break
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        collect(*chunk_result(fut))
+                        nxt = next(queue, None)
+                        if nxt is not None:
+                            pending.add(submit(nxt))
+        except KeyboardInterrupt:
+            interrupted = True
+
+    progress.finish()
+    if interrupted:
+        print(f"[中断] 完了済み {progress.done:,}/{total:,} 件の結果を保存しました", file=sys.stderr)
+
+    # ジョブごとに configs の順（保存済みの行と今回評価した行を合わせる）
+    out = []
+    for j, job in enumerate(jobs):
+        by_config = dict(stored[j])
+        for key, rows in results.items():
+            if key[0] == j:
+                by_config.update(zip(chunks[key], rows))
+        out.append(pd.DataFrame([by_config[i] for i in range(len(job.configs)) if by_config.get(i) is not None]))
+    return out
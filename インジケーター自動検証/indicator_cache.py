@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from profiling import count, stage
+
+
+def fingerprint(*arrays: np.ndarray) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        h.update(f"{arr.dtype.str}{arr.shape}".encode())
+        h.update(memoryview(arr).cast("B"))
+    return h.hexdigest()
+
+
+def make_key(name: str, fp: str, params: tuple) -> str:
+    return hashlib.blake2b(f"{name}|{fp}|{params!r}".encode(), digest_size=16).hexdigest()
+
+
+class IndicatorCache:
+    def __init__(self, max_bytes: int = 512 * 1024**2, disk_dir: str | Path | None = None) -> None:
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        self._entries: OrderedDict[str, tuple[np.ndarray, ...]] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.npz"
+
+    def get(self, key: str) -> tuple[np.ndarray, ...] | None:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            count("indicator_cache.hit")
+            return value
+
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            if path.exists():
+                try:
+                    with np.load(path) as npz:
+                        value = tuple(npz[f"arr_{i}"] for i in range(len(npz.files)))
+                except (OSError, ValueError, KeyError):
+                    value = None  # 書き込み途中・破損ファイルはミス扱い
+                if value is not None:
+                    self.disk_hits += 1
+                    count("indicator_cache.disk_hit")
+                    self._store(key, value)
+                    return self._entries.get(key, value)
+
+        self.misses += 1
+        count("indicator_cache.miss")
+        return None
+
+    def _store(self, key: str, value: tuple[np.ndarray, ...]) -> None:
+        for arr in value:
+            arr.flags.writeable = False
+        size = sum(arr.nbytes for arr in value)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= sum(arr.nbytes for arr in old)
+        self._entries[key] = value
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= sum(arr.nbytes for arr in evicted)
+
+    def put(self, key: str, value: tuple[np.ndarray, ...]) -> None:
+        value = tuple(np.ascontiguousarray(arr) for arr in value)
+        self._store(key, value)
+        if self.disk_dir is not None:
+            # 他プロセスが読みかけのファイルを壊さないよう一時ファイル経由で置き換える
+            path = self._disk_path(key)
+            tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+            np.savez(tmp, *value)
+            os.replace(tmp, path)
+
+    def get_or_compute(
+        self, name: str, inputs: tuple[np.ndarray, ...], params: tuple, compute: Callable[[], tuple[np.ndarray, ...]]
+    ) -> tuple[np.ndarray, ...]:
+        key = make_key(name, fingerprint(*inputs), params)
+        value = self.get(key)
+        if value is None:
+            value = tuple(compute())
+            self.put(key, value)
+            value = self._entries.get(key, value)
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+
+_cache: IndicatorCache | None = IndicatorCache()
+
+
+def get_cache() -> IndicatorCache | None:
+    return _cache
+
+
+def set_cache(cache: IndicatorCache | None) -> None:
+    # None を渡すとキャッシュを無効化する
+    global _cache
+    _cache = cache
+
+
+def cached(
+    name: str, inputs: tuple[np.ndarray, ...], params: tuple, compute: Callable[[], tuple[np.ndarray, ...]]
+) -> tuple[np.ndarray, ...]:
+    with stage(f"indicator.{name}", rows=len(inputs[0]) if inputs else 0):
+        if _cache is None:
+            return tuple(compute())
+        return _cache.get_or_compute(name, inputs, params, compute)
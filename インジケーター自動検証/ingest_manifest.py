@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+# 差分取り込み用の manifest: 入力ファイルごとのサイズ・更新時刻・内容のハッシュと、
+# そのファイルの tick の範囲・作った足の範囲を出力CSVの隣に JSON で置く
+MANIFEST_SUFFIX = ".manifest.json"
+_HASH_CHUNK = 1 << 20
+
+
+def manifest_path_for(out_path: str | Path) -> Path:
+    # data/usdjpy_1h.csv -> data/usdjpy_1h.manifest.json
+    return Path(out_path).with_suffix(MANIFEST_SUFFIX)
+
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as fh:
+        while chunk := fh.read(_HASH_CHUNK):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@dataclass
+class FileEntry:
+    size: int
+    mtime_ns: int
+    sha256: str
+    first: str  # 最初と最後の tick（UTC, ISO 形式）
+    last: str
+    ticks: int
+    bars: list[str]  # 最も細かい足で、このファイルの tick が入る最初と最後の足
+
+
+@dataclass
+class IngestManifest:
+    timeframes: list[str]
+    tz: str
+    outputs: list[str]
+    origin: str  # resample の起点（全体の最初の tick の日の0時）
+    files: dict[str, FileEntry] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: Path) -> IngestManifest | None:
+        if not path.is_file():
+            return None
+        raw = json.loads(path.read_text(encoding="utf-8"))
+        files = {name: FileEntry(**entry) for name, entry in raw.pop("files").items()}
+        return cls(**raw, files=files)
+
+    def save(self, path: Path) -> None:
+        tmp = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+        tmp.write_text(json.dumps(asdict(self), ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def settings_differ(self, timeframes: list[str], tz: str, outputs: list[Path]) -> str | None:
+        # 前回と設定が違う・出力が消えている場合は、その理由を返す（差分では作れない）
+        if self.timeframes != timeframes:
+            return f"時間足が前回と異なります（前回: {','.join(self.timeframes)}）"
+        if self.tz != tz:
+            return f"タイムゾーンが前回と異なります（前回: {self.tz}）"
+        if self.outputs != [str(p) for p in outputs]:
+            return "出力先が前回と異なります"
+        missing = [p for p in outputs if not p.is_file()]
+        if missing:
+            return f"出力ファイルがありません: {missing[0]}"
+        return None
+
+
+def changed_files(files: list[Path], manifest: IngestManifest) -> tuple[list[Path], list[str]]:
+    # (追加・変更されたファイル, 消えたファイル名)。サイズと更新時刻が前回と同じならハッシュは計算しない。
+    # 更新時刻だけ変わって中身が同じファイルは、記録を今の更新時刻に直して未変更として扱う
+    changed = []
+    for path in files:
+        entry = manifest.files.get(path.name)
+        st = path.stat()
+        if entry is not None and (entry.size, entry.mtime_ns) == (st.st_size, st.st_mtime_ns):
+            continue
+        if entry is not None and entry.size == st.st_size and entry.sha256 == file_digest(path):
+            entry.mtime_ns = st.st_mtime_ns
+            continue
+        changed.append(path)
+    names = {path.name for path in files}
+    removed = [name for name in manifest.files if name not in names]
+    return changed, removed
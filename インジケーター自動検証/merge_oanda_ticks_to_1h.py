@@ -2,11 +2,28 @@
 from __future__ import annotations
 
 import argparse
+import csv
+import gzip
+import importlib.util
+import os
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator
 
 import numpy as np
 import pandas as pd
+from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import Day, Tick
+
+from bar_store import BarStoreWriter, is_bar_store, load_bar_store, load_bars, store_path_for, write_bar_store
+from ingest_manifest import FileEntry, IngestManifest, changed_files, file_digest, manifest_path_for
+from profiling import add_profile_arguments, call_profiled, finish_profile, get_profiler, profiled, stage, start_profile
+from timestamps import parse_date_time, parse_timestamps
 
 
 def normalize_name(name: str) -> str:
@@ -22,27 +39,35 @@ def find_column(columns: Iterable[str], candidates: set[str]) -> str | None:
     return None
 
 
-def parse_timestamp(series: pd.Series) -> pd.DatetimeIndex:
-    if np.issubdtype(series.dtype, np.number):
-        num = pd.to_numeric(series, errors="coerce")
-        max_abs = num.abs().max()
-        unit = "ms" if max_abs > 1e11 else "s"
-        ts = pd.to_datetime(num, unit=unit, utc=True, errors="coerce")
-    else:
-        ts = pd.to_datetime(series, utc=True, errors="coerce")
-    if ts.isna().all():
-        raise ValueError("日時列をパースできませんでした")
-    return ts
+@dataclass(frozen=True)
+class TickSchema:
+    # 1ファイルの列構成。同じヘッダのファイルでは使い回す
+    sep: str | None
+    quotechar: str
+    skipinitialspace: bool
+    date_col: str | None
+    time_col: str | None
+    ts_col: str | None
+    bid_col: str | None
+    ask_col: str | None
+    price_col: str | None
+
+    def usecols(self) -> list[str]:
+        cols = [self.date_col, self.time_col] if self.date_col and self.time_col else [self.ts_col]
+        cols += [self.bid_col, self.ask_col] if self.bid_col and self.ask_col else [self.price_col]
+        return list(dict.fromkeys(c for c in cols if c is not None))
 
+    def price_cols(self) -> list[str]:
+        return [self.bid_col, self.ask_col] if self.bid_col and self.ask_col else [self.price_col]
 
-def load_single_file(path: Path) -> pd.DataFrame:
-    df = pd.read_csv(path, sep=None, engine="python", compression="infer")
 
-    date_col = find_column(df.columns, {"date", "tradedate", "businessdate", "day"})
-    time_col = find_column(df.columns, {"time", "tradetime", "timestampms", "hhmmss"})
+def resolve_schema(columns: Iterable[str], path: Path, dialect: type[csv.Dialect] | None = None) -> TickSchema:
+    columns = list(columns)
+    date_col = find_column(columns, {"date", "tradedate", "businessdate", "day"})
+    time_col = find_column(columns, {"time", "tradetime", "timestampms", "hhmmss"})
 
     ts_col = find_column(
-        df.columns,
+        columns,
         {
             "timestamp",
             "time",
@@ -57,56 +82,926 @@ def load_single_file(path: Path) -> pd.DataFrame:
     if ts_col is None and not (date_col and time_col):
         raise ValueError(f"日時列が見つかりません: {path.name}")
 
-    bid_col = find_column(df.columns, {"bid", "bidprice", "b"})
-    ask_col = find_column(df.columns, {"ask", "askprice", "a"})
-    price_col = find_column(df.columns, {"price", "last", "close", "c", "mid", "midprice"})
-
-    if date_col and time_col:
-        dt_text = df[date_col].astype(str).str.strip() + " " + df[time_col].astype(str).str.strip()
-        ts = pd.to_datetime(dt_text, utc=True, errors="coerce")
-        if ts.isna().all():
-            ts = pd.to_datetime(
-                df[date_col].astype(str).str.replace(".", "-", regex=False)
-                + " "
-                + df[time_col].astype(str).str.strip(),
-                utc=True,
-                errors="coerce",
-            )
-        if ts.isna().all():
-            raise ValueError(f"DATE/TIME列の結合パースに失敗: {path.name}")
-    else:
-        ts = parse_timestamp(df[ts_col])
+    bid_col = find_column(columns, {"bid", "bidprice", "b"})
+    ask_col = find_column(columns, {"ask", "askprice", "a"})
+    price_col = find_column(columns, {"price", "last", "close", "c", "mid", "midprice"})
+    if not (bid_col and ask_col) and not price_col:
+        raise ValueError(f"価格列が見つかりません(bid/ask or price): {path.name}")
+    sep, quotechar, skip = (dialect.delimiter, dialect.quotechar, dialect.skipinitialspace) if dialect else (None, '"', False)
+    return TickSchema(sep, quotechar, skip, date_col, time_col, ts_col, bid_col, ask_col, price_col)
+
 
+def ticks_from_frame(df: pd.DataFrame, path: Path, schema: TickSchema | None = None) -> pd.DataFrame:
+    if schema is None:
+        schema = resolve_schema(df.columns, path)
+    date_col, time_col, ts_col = schema.date_col, schema.time_col, schema.ts_col
+    bid_col, ask_col, price_col = schema.bid_col, schema.ask_col, schema.price_col
+
+    with stage("converter.parse_timestamps", rows=len(df)):
+        if date_col and time_col:
+            ts, time_format = parse_date_time(df[date_col], df[time_col])
+            if ts.isna().all():
+                raise ValueError(f"DATE/TIME列の結合パースに失敗: {path.name}")
+        else:
+            ts, time_format = parse_timestamps(df[ts_col])
+            if ts.isna().all():
+                raise ValueError("日時列をパースできませんでした")
+
+    # price は bid/ask の仲値。bid/ask がある時はスプレッドの集計用にそのまま持っておく
     if bid_col and ask_col:
-        price = (pd.to_numeric(df[bid_col], errors="coerce") + pd.to_numeric(df[ask_col], errors="coerce")) / 2.0
-    elif price_col:
-        price = pd.to_numeric(df[price_col], errors="coerce")
+        bid = pd.to_numeric(df[bid_col], errors="coerce").to_numpy(dtype=np.float64)
+        ask = pd.to_numeric(df[ask_col], errors="coerce").to_numpy(dtype=np.float64)
+        out = pd.DataFrame({"price": (bid + ask) / 2.0, "bid": bid, "ask": ask}, index=ts)
     else:
-        raise ValueError(f"価格列が見つかりません(bid/ask or price): {path.name}")
-
-    out = pd.DataFrame({"price": price.values}, index=ts)
+        price = pd.to_numeric(df[price_col], errors="coerce")
+        out = pd.DataFrame({"price": price.values}, index=ts)
     out = out[~out.index.isna()]
     out = out.dropna(subset=["price"])
-    out = out.sort_index()
+    # ファイルはほぼ時刻順なので、並んでいない時だけ並べ替える（同時刻は元の行順のまま）
+    if not out.index.is_monotonic_increasing:
+        out = out.sort_index(kind="stable")
+    out.attrs["time_format"] = time_format
     return out
 
 
+_HEAD_BYTES = 64 * 1024
+_SNIFF_LINES = 20
+_schema_cache: dict[str, TickSchema] = {}
+
+
+def _read_head(path: Path) -> list[str]:
+    # 先頭数KBだけを展開して読む（pandas の compression="infer" と同じ拡張子判定）
+    suffix = path.suffix.lower()
+    if suffix == ".gz":
+        with gzip.open(path, "rb") as fh:
+            raw = fh.read(_HEAD_BYTES)
+    elif suffix == ".zip":
+        with zipfile.ZipFile(path) as zf:
+            names = [n for n in zf.namelist() if not n.endswith("/")]
+            if len(names) != 1:
+                raise ValueError(f"zip内のファイルは1つである必要があります: {path.name}")
+            with zf.open(names[0]) as fh:
+                raw = fh.read(_HEAD_BYTES)
+    else:
+        with path.open("rb") as fh:
+            raw = fh.read(_HEAD_BYTES)
+    lines = raw.decode("utf-8-sig", errors="replace").splitlines()
+    # 途中で切れた最終行は使わない
+    return lines[:-1] if len(raw) == _HEAD_BYTES and len(lines) > 1 else lines
+
+
+def sniff_schema(path: Path) -> TickSchema:
+    lines = [line for line in _read_head(path) if line.strip()]
+    if not lines:
+        raise ValueError(f"空のファイルです: {path.name}")
+    header = lines[0]
+    schema = _schema_cache.get(header)
+    if schema is not None:
+        return schema
+
+    try:
+        dialect = csv.Sniffer().sniff("\n".join(lines[:_SNIFF_LINES]), delimiters=",;\t| ")
+    except csv.Error:
+        # pandas の sep=None と同じく1行目だけで判定する
+        dialect = csv.Sniffer().sniff(header)
+    columns = next(csv.reader([header], dialect))
+    schema = resolve_schema(columns, path, dialect)
+    _schema_cache[header] = schema
+    return schema
+
+
+def _read_options(schema: TickSchema, engine: str, float_dtype: bool) -> dict:
+    options = dict(
+        sep=schema.sep,
+        quotechar=schema.quotechar,
+        skipinitialspace=schema.skipinitialspace,
+        engine=engine,
+        compression="infer",
+        usecols=schema.usecols(),
+    )
+    if float_dtype:
+        options["dtype"] = {c: np.float64 for c in schema.price_cols()}
+    return options
+
+
+def read_tick_frames(path: Path, engine: str = "c", chunk_size: int | None = None) -> Iterator[tuple[pd.DataFrame, TickSchema]]:
+    # 区切り文字と列は先頭だけで判定し、本体は C/pyarrow エンジンで必要な列だけを読む
+    try:
+        schema = sniff_schema(path)
+    except csv.Error:
+        # 判定できない場合は従来どおり Python エンジンで全体を読む
+        df = pd.read_csv(path, sep=None, engine="python", compression="infer")
+        yield df, resolve_schema(df.columns, path)
+        return
+
+    if chunk_size is None:
+        try:
+            df = pd.read_csv(path, **_read_options(schema, engine, True))
+        except ValueError:
+            # 数値以外が混ざる列は従来どおり to_numeric(errors="coerce") で扱う
+            df = pd.read_csv(path, **_read_options(schema, engine, False))
+        yield df, schema
+        return
+
+    # pyarrow エンジンは chunksize に対応しないので、チャンク読みは C エンジンで行う
+    consumed = 0
+    float_dtype = True
+    while True:
+        # 型指定なしで読み直すときは先頭から読み、返し終えた行を捨てる。skiprows はファイルの物理行で数えるので、
+        # 空行を飛ばした分だけずれて行が重複・欠落する
+        skip = consumed
+        try:
+            with pd.read_csv(path, chunksize=chunk_size, **_read_options(schema, "c", float_dtype)) as reader:
+                for chunk in reader:
+                    if skip:
+                        drop = min(skip, len(chunk))
+                        skip -= drop
+                        chunk = chunk.iloc[drop:]
+                        if chunk.empty:
+                            continue
+                    consumed += len(chunk)
+                    yield chunk, schema
+            return
+        except ValueError:
+            if not float_dtype:
+                raise
+            float_dtype = False
+
+
+def load_single_file(path: Path, engine: str = "c") -> pd.DataFrame:
+    with stage("converter.read_csv") as st:
+        df, schema = next(read_tick_frames(path, engine))
+        st.rows = len(df)
+    return ticks_from_frame(df, path, schema)
+
+
+def load_file_arrays(
+    path: Path, engine: str = "c"
+) -> tuple[np.ndarray | None, np.ndarray | None, list[str] | None, str | None, str | None, str | None]:
+    # ワーカー用: DataFrame ではなく UTC ns の int64 と float64 の価格配列（tick 数 x 列）だけを返す（pickle が小さい）
+    try:
+        ticks = load_single_file(path, engine)
+    except Exception as exc:
+        return None, None, None, None, None, str(exc)
+    ns = ticks.index.as_unit("ns").asi8
+    return ns, ticks.to_numpy(dtype=np.float64), list(ticks.columns), ticks.index.name, ticks.attrs.get("time_format"), None
+
+
+def arrays_to_ticks(ns: np.ndarray, values: np.ndarray, columns: list[str], index_name: str | None) -> pd.DataFrame:
+    index = pd.DatetimeIndex(ns.view("datetime64[ns]"), name=index_name).tz_localize("UTC")
+    return pd.DataFrame(values, columns=columns, index=index)
+
+
+def iter_loaded_files(
+    files: list[Path], workers: int, engine: str = "c"
+) -> Iterator[tuple[Path, pd.DataFrame | None, str | None]]:
+    # ファイル名順に (ファイル, tick, エラー) を返す。workers > 1 ならプロセスプールで先読みする
+    if workers <= 1:
+        for file in files:
+            try:
+                yield file, load_single_file(file, engine), None
+            except Exception as exc:
+                yield file, None, str(exc)
+        return
+
+    profiler = get_profiler()
+
+    def submit(pool: ProcessPoolExecutor, file: Path):
+        if profiler is None:
+            return pool.submit(load_file_arrays, file, engine)
+        # --profile 時はワーカーの計測結果も受け取って合算する
+        return pool.submit(call_profiled, profiler.trace, load_file_arrays, file, engine)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # 先読みはワーカー数の2倍までに抑え、読み終えたファイルが溜まりすぎないようにする
+        queue = iter(files)
+        pending = deque((file, submit(pool, file)) for file in islice(queue, workers * 2))
+        while pending:
+            file, fut = pending.popleft()
+            nxt = next(queue, None)
+            if nxt is not None:
+                pending.append((nxt, submit(pool, nxt)))
+            result = fut.result()
+            if profiler is not None:
+                result, snap = result
+                profiler.merge(snap)
+            ns, values, columns, index_name, time_format, error = result
+            if error is not None:
+                yield file, None, error
+            else:
+                ticks = arrays_to_ticks(ns, values, columns, index_name)
+                ticks.attrs["time_format"] = time_format
+                yield file, ticks, None
+
+
+def format_note(formats: Iterable[str | None]) -> str:
+    # [OK] 行に添える、判定した日時の形式
+    formats = [f for f in dict.fromkeys(formats) if f]
+    return f"（日時: {' / '.join(formats)}）" if formats else ""
+
+
+def iter_file_chunks(path: Path, chunk_size: int) -> Iterator[pd.DataFrame]:
+    # 1ファイルを chunk_size 行ずつ読み、チャンクごとに tick へ変換する
+    frames = read_tick_frames(path, chunk_size=chunk_size)
+    while True:
+        with stage("converter.read_csv") as st:
+            item = next(frames, None)
+            st.rows = len(item[0]) if item is not None else 0
+        if item is None:
+            return
+        yield ticks_from_frame(item[0], path, item[1])
+
+
+# tick から足を作る時の列ごとの集計 (出力列, tick の列, 方法)。bid/ask の無い tick では仲値と件数だけ
+_TICK_AGG = [
+    ("open", "price", "first"),
+    ("high", "price", "max"),
+    ("low", "price", "min"),
+    ("close", "price", "last"),
+    ("volume", None, "count"),
+    ("bid_open", "bid", "first"),
+    ("bid_high", "bid", "max"),
+    ("bid_low", "bid", "min"),
+    ("bid_close", "bid", "last"),
+    ("ask_open", "ask", "first"),
+    ("ask_high", "ask", "max"),
+    ("ask_low", "ask", "min"),
+    ("ask_close", "ask", "last"),
+    ("spread_mean", "spread", "mean"),
+    ("spread_max", "spread", "max"),
+]
+# 足から粗い足を作る時の集計。spread_mean は tick 数(volume)で重み付けする
+_BAR_AGG = {name: "sum" if how == "count" else how for name, _, how in _TICK_AGG}
+
+
+def _reduce(values: np.ndarray, starts: np.ndarray, ends: np.ndarray, how: str) -> np.ndarray:
+    # starts[i]:ends[i] が i 本目の足の区間（空の区間は無い）
+    if how == "first":
+        return values[starts]
+    if how == "last":
+        return values[ends - 1]
+    if how == "max":
+        return np.maximum.reduceat(values, starts)
+    if how == "min":
+        return np.minimum.reduceat(values, starts)
+    if how == "sum":
+        return np.add.reduceat(values, starts)
+    if how == "mean":
+        return np.add.reduceat(values, starts) / (ends - starts)
+    raise ValueError(f"未対応の集計です: {how}")
+
+
+def bucket_starts(index: pd.DatetimeIndex, timeframe: str, origin: str | pd.Timestamp = "start_day") -> tuple[np.ndarray, pd.DatetimeIndex]:
+    # 時刻順の index を足ごとの連続区間に分け、(各足の先頭位置, 足のラベル) を返す。tick の無い足は含めない。
+    # 区切りは resample(timeframe, origin=origin) と同じ
+    fixed = _fixed_ns(timeframe)
+    if fixed is None:
+        # 暦で決まる足（日・週・月）は区切りを pandas に任せ、足ごとの件数から区間を求める
+        counts = pd.Series(np.zeros(len(index)), index=index).resample(timeframe, origin=origin).count()
+        counts = counts[counts > 0]
+        starts = np.concatenate([[0], np.cumsum(counts.to_numpy())[:-1]])
+        return starts, counts.index.rename(index.name)
+
+    # 固定長の足の区切りは起点（start_day なら最初の tick の現地0時）から足の長さごと。
+    # tick は時刻順なので、各区切りの位置を二分探索すれば tick ごとの計算は要らない
+    if isinstance(origin, str):
+        if origin != "start_day":
+            raise ValueError(f"未対応の origin です: {origin}")
+        base = index[0].normalize()
+    else:
+        base = pd.Timestamp(origin)
+    ns = index.asi8
+    edges = np.arange((ns[0] - base.value) // fixed, (ns[-1] - base.value) // fixed + 1) * fixed + base.value
+    bounds = np.searchsorted(ns, edges, side="left")
+    filled = bounds != np.append(bounds[1:], len(ns))
+    labels = pd.DatetimeIndex(edges[filled].view("datetime64[ns]"), name=index.name)
+    return bounds[filled], labels.tz_localize("UTC").tz_convert(index.tz)
+
+
+def aggregate_ticks(ticks: pd.DataFrame, timeframe: str, origin: str | pd.Timestamp = "start_day") -> pd.DataFrame:
+    # tick を1回走査して足を作る: 時刻順の tick を足ごとの区間に分け、各列を ufunc.reduceat で区間ごとに集計する。
+    # 仲値の OHLC と件数に加え、bid/ask があればそれぞれの OHLC とスプレッドの平均・最大も出す
+    columns = {"price": ticks["price"].to_numpy(dtype=np.float64)}
+    if "bid" in ticks.columns and "ask" in ticks.columns:
+        columns["bid"] = ticks["bid"].to_numpy(dtype=np.float64)
+        columns["ask"] = ticks["ask"].to_numpy(dtype=np.float64)
+        columns["spread"] = columns["ask"] - columns["bid"]
+    spec = [(name, src, how) for name, src, how in _TICK_AGG if src is None or src in columns]
+    if ticks.empty:
+        return pd.DataFrame({name: [] for name, _, _ in spec}, index=ticks.index[:0])
+
+    with stage("converter.aggregate", rows=len(ticks)):
+        starts, labels = bucket_starts(ticks.index, timeframe, origin)
+        ends = np.append(starts[1:], len(ticks))
+        out = {}
+        for name, src, how in spec:
+            out[name] = ends - starts if how == "count" else _reduce(columns[src], starts, ends, how)
+        return pd.DataFrame(out, index=labels)
+
+
+def aggregate_bars(bars: pd.DataFrame, starts: np.ndarray, labels: pd.DatetimeIndex) -> pd.DataFrame:
+    # 足の区間ごとにまとめて1本にする（粗い足への集計と、チャンクをまたいだ足の結合に使う）
+    ends = np.append(starts[1:], len(bars))
+    volume = bars["volume"].to_numpy()
+    out = {}
+    for name in bars.columns:
+        values = bars[name].to_numpy()
+        how = _BAR_AGG[name]
+        if how == "mean":
+            out[name] = np.add.reduceat(values * volume, starts) / np.add.reduceat(volume, starts)
+        else:
+            out[name] = _reduce(values, starts, ends, how)
+    return pd.DataFrame(out, index=labels)
+
+
+def rollup_ohlcv(bars: pd.DataFrame, timeframe: str, origin: str | pd.Timestamp = "start_day") -> pd.DataFrame:
+    # 細かい足から粗い足を作る（tick は読み直さない）。区切りが細かい足の区切りと一致する前提（rollup_plan で確認済み）
+    if bars.empty:
+        return bars
+    return aggregate_bars(bars, *bucket_starts(bars.index, timeframe, origin))
+
+
+_HOUR_NS = 3600 * 10**9
+_DAY_NS = 24 * _HOUR_NS
+
+
+def _fixed_ns(timeframe: str) -> int | None:
+    # 固定長の足（min, h など）なら長さ(ns)、日・週・月など暦で決まる足なら None
+    offset = to_offset(timeframe)
+    if not isinstance(offset, Tick) or isinstance(offset, Day):
+        return None
+    return int(offset.nanos)
+
+
+def _approx_ns(timeframe: str) -> int:
+    fixed = _fixed_ns(timeframe)
+    if fixed is not None:
+        return fixed
+    base = pd.Timestamp("2000-01-03")
+    return int((base + to_offset(timeframe) - base).value)
+
+
+def calendar_span_ns(tz: str) -> int:
+    # 日・週・月の区切りは現地時刻の0時で、固定長の足の区切りは起点（最初の現地0時）から足の長さごと。
+    # 現地0時どうしの間隔は1日から UTC との差の変化分（夏時間）だけずれるので、暦の足はこの長さを割り切る足からだけ集計できる。
+    # UTC や夏時間の無いタイムゾーンなら1日、夏時間が1時間なら1時間、30分単位の時差（+05:30 など）があれば30分以下
+    if tz.upper() == "UTC":
+        return _DAY_NS
+    days = pd.date_range("1970-01-01", "2100-01-01", freq="D", tz="UTC")
+    offsets = np.unique((days.tz_convert(tz).tz_localize(None) - days.tz_localize(None)).asi8)
+    return int(np.gcd.reduce(np.concatenate([[_DAY_NS], np.diff(offsets), offsets % _HOUR_NS])))
+
+
+def rollup_plan(text: str, tz: str = "UTC") -> list[tuple[str, str | None]]:
+    # "1min,5min,1h" -> [(1min, None), (5min, 1min), (1h, 5min)]。
+    # 最も細かい足は tick から作り、それ以外は割り切れる中で最も粗い足から集計する（割り切れる足が無ければ tick から作る）
+    timeframes = list(dict.fromkeys(tf.strip() for tf in text.split(",") if tf.strip()))
+    if not timeframes:
+        raise ValueError("--timeframe が空です")
+    timeframes.sort(key=_approx_ns)
+
+    calendar = calendar_span_ns(tz)
+    plan: list[tuple[str, str | None]] = [(timeframes[0], None)]
+    for i, tf in enumerate(timeframes[1:], start=1):
+        span = _fixed_ns(tf) or calendar
+        sources = [src for src in timeframes[:i] if _fixed_ns(src) and span % _fixed_ns(src) == 0]
+        plan.append((tf, sources[-1] if sources else None))
+    return plan
+
+
+def output_path_for(output: str, timeframe: str, multi: bool) -> Path:
+    # --output に {tf} があれば足の名前に置き換える。
+    # 複数の足で {tf} が無い時は、末尾の "_1h" などを付け替える（data/usdjpy_1h.csv -> data/usdjpy_5m.csv）
+    label = timeframe.lower().replace("min", "m")
+    if "{tf}" in output:
+        return Path(output.replace("{tf}", label))
+    path = Path(output)
+    if not multi:
+        return path
+    stem = re.sub(r"_\d+[a-z]+$", "", path.stem, flags=re.IGNORECASE)
+    return path.with_name(f"{stem}_{label}{path.suffix}")
+
+
 def to_ohlcv(ticks: pd.DataFrame, timeframe: str) -> pd.DataFrame:
-    ohlc = ticks["price"].resample(timeframe).ohlc()
-    vol = ticks["price"].resample(timeframe).count().rename("volume")
-    bars = pd.concat([ohlc, vol], axis=1).dropna(subset=["open", "high", "low", "close"])
+    bars = aggregate_ticks(ticks, timeframe)
     bars = bars.reset_index().rename(columns={"index": "timestamp"})
     return bars
 
 
+class BarChain:
+    # 1つの時間足の出力。未確定の最終足（開いている足）だけを持ち越し、確定した足を追記して
+    # より粗い足（children）へ渡す
+    def __init__(self, timeframe: str, out_path: Path, store: BarStoreWriter | None = None) -> None:
+        self.timeframe = timeframe
+        self.out_path = out_path
+        self.store = store
+        self.children: list[BarChain] = []
+        self.open_bar: pd.DataFrame | None = None
+        self.header_written = False
+        self.bars = 0
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        out_path.unlink(missing_ok=True)
+
+    def push(self, bars: pd.DataFrame, origin: pd.Timestamp) -> None:
+        # bars はこの時間足で区切った部分足。先頭は持ち越し中の足の続きのことがある
+        if bars.empty:
+            return
+        if self.open_bar is not None:
+            if bars.index[0] == self.open_bar.index[0]:
+                head = aggregate_bars(pd.concat([self.open_bar, bars.iloc[:1]]), np.array([0]), bars.index[:1])
+                bars = pd.concat([head, bars.iloc[1:]])
+            else:
+                self._write(self.open_bar, origin)
+        self._write(bars.iloc[:-1], origin)
+        self.open_bar = bars.iloc[-1:]
+
+    def _write(self, bars: pd.DataFrame, origin: pd.Timestamp) -> None:
+        if bars.empty:
+            return
+        with stage("converter.write", rows=len(bars)):
+            # 時刻の列名は入力ファイルの列名によらず timestamp（メモリ上でまとめる場合と同じ）
+            out = bars.rename_axis("timestamp").reset_index()
+            out.to_csv(self.out_path, mode="a", header=not self.header_written, index=False)
+            self.header_written = True
+            self.bars += len(bars)
+            if self.store is not None:
+                self.store.append(bars)
+        for child in self.children:
+            child.push(rollup_ohlcv(bars, child.timeframe, origin), origin)
+
+    def finish(self, origin: pd.Timestamp | None) -> None:
+        if self.open_bar is not None:
+            self._write(self.open_bar, origin)
+            self.open_bar = None
+        for child in self.children:
+            child.finish(origin)
+        if self.store is not None:
+            if self.bars:
+                self.store.close()
+            else:
+                self.store.abort()
+            self.store = None
+
+
+class StreamingBarWriter:
+    # チャンクごとに tick から作る足（最も細かい足と、細かい足から集計できない足）の部分足を作り、
+    # BarChain へ渡して確定した足から順に追記する。持ち越すのは開いている足だけなので、メモリはデータ全体ではなくチャンクの大きさで決まる
+    def __init__(self, roots: list[BarChain], tz: str) -> None:
+        self.roots = roots
+        self.tz = tz
+        self.origin: pd.Timestamp | None = None
+        self.held: pd.DataFrame | None = None
+        self.watermark: pd.Timestamp | None = None
+        self.ticks = 0
+        self.late = 0
+
+    def add(self, ticks: pd.DataFrame) -> None:
+        if self.held is not None:
+            ticks = pd.concat([self.held, ticks])
+        if ticks.empty:
+            return
+        ticks = ticks.sort_index(kind="stable")
+        ticks = ticks[~ticks.index.duplicated(keep="last")]
+
+        # 集計済みの時刻以前の tick は出力済みの足を書き換えられないので除外して数える
+        if self.watermark is not None:
+            late = ticks.index <= self.watermark
+            if late.any():
+                self.late += int(late.sum())
+                ticks = ticks[~late]
+                if ticks.empty:
+                    return
+
+        # 末尾と同時刻の tick が次のチャンクに続く場合に備え、最後の1件は次回まで集計しない（重複は後勝ち）
+        self.held = ticks.iloc[-1:]
+        self._aggregate(ticks.iloc[:-1])
+
+    def _aggregate(self, ticks: pd.DataFrame) -> None:
+        if ticks.empty:
+            return
+        self.watermark = ticks.index[-1]
+        self.ticks += len(ticks)
+        if self.tz.upper() != "UTC":
+            ticks = ticks.set_axis(ticks.index.tz_convert(self.tz))
+        if self.origin is None:
+            # 一括変換の resample(origin="start_day") と同じ区切りにする
+            self.origin = ticks.index[0].normalize()
+        for root in self.roots:
+            root.push(aggregate_ticks(ticks, root.timeframe, self.origin), self.origin)
+
+    def finish(self) -> None:
+        if self.held is not None:
+            self._aggregate(self.held)
+            self.held = None
+        for root in self.roots:
+            root.finish(self.origin)
+
+
+def build_chains(plan: list[tuple[str, str | None]], paths: list[Path], bar_store: bool) -> list[BarChain]:
+    chains: dict[str, BarChain] = {}
+    for (tf, src), path in zip(plan, paths):
+        store = BarStoreWriter(store_path_for(path)) if bar_store else None
+        chains[tf] = BarChain(tf, path, store)
+        if src is not None:
+            chains[src].children.append(chains[tf])
+    return list(chains.values())
+
+
+def print_outputs(timeframes: list[str], counts: list[int], paths: list[Path], bar_store: bool) -> None:
+    for tf, n, path in zip(timeframes, counts, paths):
+        print(f"{tf}本数  : {n:,}")
+        print(f"出力先       : {path}")
+        if bar_store:
+            print(f"バーストア   : {store_path_for(path)}")
+
+
+TickRange = tuple[pd.Timestamp, pd.Timestamp, int]
+
+
+def tick_range(ticks: pd.DataFrame) -> TickRange | None:
+    # (最初の tick, 最後の tick, 件数)。tick はファイル内で時刻順に並べ替え済み
+    if ticks.empty:
+        return None
+    return ticks.index[0], ticks.index[-1], len(ticks)
+
+
+def _extend_range(current: TickRange | None, ticks: pd.DataFrame) -> TickRange | None:
+    add = tick_range(ticks)
+    if current is None or add is None:
+        return current or add
+    return min(current[0], add[0]), max(current[1], add[1]), current[2] + add[2]
+
+
+def run_streaming(
+    files: list[Path], args: argparse.Namespace, plan: list[tuple[str, str | None]], paths: list[Path]
+) -> tuple[dict[str, TickRange], pd.Timestamp | None]:
+    chains = build_chains(plan, paths, args.bar_store)
+    writer = StreamingBarWriter([chain for chain, (_, src) in zip(chains, plan) if src is None], args.tz)
+    ranges: dict[str, TickRange] = {}
+    if args.workers > 1:
+        # 並列時はファイル単位で読み込むので、同時に保持するのは先読み分のファイルまで
+        for file, ticks, error in iter_loaded_files(files, args.workers, args.csv_engine):
+            if error is not None:
+                print(f"[SKIP] {file.name}: {error}")
+                continue
+            writer.add(ticks)
+            if not ticks.empty:
+                ranges[file.name] = tick_range(ticks)
+            print(f"[OK] {file.name}: {len(ticks):,} ticks{format_note([ticks.attrs.get('time_format')])}")
+    else:
+        for file in files:
+            n = 0
+            span = None
+            formats = []
+            try:
+                for ticks in iter_file_chunks(file, args.chunk_size):
+                    writer.add(ticks)
+                    span = _extend_range(span, ticks)
+                    n += len(ticks)
+                    formats.append(ticks.attrs.get("time_format"))
+                print(f"[OK] {file.name}: {n:,} ticks{format_note(formats)}")
+                if span is not None:
+                    ranges[file.name] = span
+            except Exception as exc:
+                note = f"（先頭 {n:,} ticks は集計済み）" if n else ""
+                print(f"[SKIP] {file.name}: {exc}{note}")
+    writer.finish()
+
+    if writer.ticks == 0:
+        raise RuntimeError("読み込めるファイルがありませんでした")
+    if writer.late:
+        print(f"[WARN] 集計済みの時刻より古い tick {writer.late:,} 件を除外しました（ファイルが時系列順か確認してください）")
+
+    print("\n=== Done ===")
+    print(f"入力ファイル数: {len(files)}")
+    print(f"統合tick数   : {writer.ticks:,}")
+    print_outputs([tf for tf, _ in plan], [c.bars for c in chains], paths, args.bar_store)
+    return ranges, writer.origin
+
+
+@dataclass
+class MergeStats:
+    overlaps: int = 0  # それまでのファイルと時刻が重なったファイル数
+    overlap_ticks: int = 0  # 重なり部分としてマージした tick 数
+    duplicates: int = 0  # 同時刻のため除いた tick 数
+
+
+def _dedup_last(ns: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray, int]:
+    # 時刻順の配列から、同時刻の tick は最後の1件だけを残す（values は tick 数 x 列）
+    if len(ns) < 2:
+        return ns, values, 0
+    keep = np.empty(len(ns), dtype=bool)
+    keep[-1] = True
+    np.not_equal(ns[1:], ns[:-1], out=keep[:-1])
+    dropped = len(ns) - int(np.count_nonzero(keep))
+    if dropped == 0:
+        return ns, values, 0
+    return ns[keep], values[keep], dropped
+
+
+def merge_sorted_ticks(all_ticks: list[pd.DataFrame]) -> tuple[pd.DataFrame, MergeStats]:
+    # ファイル順に時刻順の tick を足していく。それまでの tick と時刻が重ならなければ後ろにつなぐだけで、
+    # 重なる時だけ重なり部分（既存の末尾とファイルの先頭）を安定ソートでマージする（同時刻は後のファイルを残す）。
+    # 全体の並べ替えと全件のハッシュによる重複判定はしない
+    stats = MergeStats()
+    pieces: list[tuple[np.ndarray, np.ndarray]] = []
+    all_ticks = [ticks for ticks in all_ticks if not ticks.empty]
+    # bid/ask の無いファイルが混ざる時は全ファイルにある列（仲値）だけにそろえる。時刻の列名はファイルによらず timestamp
+    columns = [c for c in all_ticks[0].columns if all(c in t.columns for t in all_ticks)] if all_ticks else ["price"]
+    for ticks in all_ticks:
+        ns, values, dropped = _dedup_last(ticks.index.as_unit("ns").asi8, ticks[columns].to_numpy(dtype=np.float64))
+        stats.duplicates += dropped
+        if not pieces or ns[0] > pieces[-1][0][-1]:
+            pieces.append((ns, values))
+            continue
+
+        stats.overlaps += 1
+        # 既存側の ns[0] 以降（末尾のいくつかの塊にまたがることがある）
+        edge = []
+        while pieces and pieces[-1][0][0] >= ns[0]:
+            edge.append(pieces.pop())
+        if pieces:
+            head_ns, head_values = pieces[-1]
+            i = int(np.searchsorted(head_ns, ns[0], side="left"))
+            if i < len(head_ns):
+                edge.append((head_ns[i:], head_values[i:]))
+                pieces[-1] = (head_ns[:i], head_values[:i])
+        edge.reverse()
+        # ファイル側は既存の最後の時刻まで
+        j = int(np.searchsorted(ns, edge[-1][0][-1], side="right"))
+        edge.append((ns[:j], values[:j]))
+
+        edge_ns = np.concatenate([e[0] for e in edge])
+        edge_values = np.concatenate([e[1] for e in edge])
+        # 時刻順の列どうしのマージ（timsort が並んだ区間をそのままつなぐ）。同時刻は既存側が先、ファイル側が後
+        order = np.argsort(edge_ns, kind="stable")
+        edge_ns, edge_values, dropped = _dedup_last(edge_ns[order], edge_values[order])
+        stats.duplicates += dropped
+        stats.overlap_ticks += len(edge_ns)
+        pieces.append((edge_ns, edge_values))
+        if j < len(ns):
+            pieces.append((ns[j:], values[j:]))
+
+    if not pieces:
+        return arrays_to_ticks(np.empty(0, dtype=np.int64), np.empty((0, len(columns))), columns, "timestamp"), stats
+    ns = np.concatenate([p[0] for p in pieces])
+    values = np.concatenate([p[1] for p in pieces])
+    return arrays_to_ticks(ns, values, columns, "timestamp"), stats
+
+
+def merge_ticks(all_ticks: list[pd.DataFrame], tz: str) -> tuple[pd.DataFrame, MergeStats]:
+    with stage("converter.merge", rows=sum(len(t) for t in all_ticks)):
+        merged, stats = merge_sorted_ticks(all_ticks)
+    if tz.upper() != "UTC":
+        merged.index = merged.index.tz_convert(tz)
+    return merged, stats
+
+
+def build_frames(
+    ticks: pd.DataFrame, plan: list[tuple[str, str | None]], origin: str | pd.Timestamp = "start_day"
+) -> dict[str, pd.DataFrame]:
+    # tick から作るのは最も細かい足だけで、粗い足はそこから順に集計する
+    frames: dict[str, pd.DataFrame] = {}
+    for tf, src in plan:
+        frames[tf] = aggregate_ticks(ticks, tf, origin) if src is None else rollup_ohlcv(frames[src], tf, origin)
+    return frames
+
+
+@profiled("converter.write")
+def write_outputs(frames: dict[str, pd.DataFrame], paths: list[Path], bar_store: bool) -> None:
+    for bars, out_path in zip(frames.values(), paths):
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        bars.reset_index().rename(columns={"index": "timestamp"}).to_csv(out_path, index=False)
+        if bar_store:
+            write_bar_store(bars, store_path_for(out_path))
+
+
+def run_in_memory(
+    files: list[Path], args: argparse.Namespace, plan: list[tuple[str, str | None]], paths: list[Path]
+) -> tuple[dict[str, TickRange], pd.Timestamp]:
+    all_ticks = []
+    ranges: dict[str, TickRange] = {}
+    for file, ticks, error in iter_loaded_files(files, args.workers, args.csv_engine):
+        if error is not None:
+            print(f"[SKIP] {file.name}: {error}")
+            continue
+        all_ticks.append(ticks)
+        if not ticks.empty:
+            ranges[file.name] = tick_range(ticks)
+        print(f"[OK] {file.name}: {len(ticks):,} ticks{format_note([ticks.attrs.get('time_format')])}")
+
+    if not all_ticks:
+        raise RuntimeError("読み込めるファイルがありませんでした")
+
+    merged, stats = merge_ticks(all_ticks, args.tz)
+    frames = build_frames(merged, plan)
+    write_outputs(frames, paths, args.bar_store)
+
+    print("\n=== Done ===")
+    print(f"入力ファイル数: {len(files)}")
+    print(f"統合tick数   : {len(merged):,}")
+    print(f"時刻の重なり : {stats.overlaps} ファイル（{stats.overlap_ticks:,} ticks をマージ）")
+    print(f"重複tick     : {stats.duplicates:,} 件を除外（後のファイル・後の行を残す）")
+    print_outputs(list(frames), [len(bars) for bars in frames.values()], paths, args.bar_store)
+    return ranges, merged.index[0].normalize()
+
+
+def bucket_label(t: pd.Timestamp, timeframe: str, origin: pd.Timestamp) -> pd.Timestamp:
+    # t を含む足のラベル（resample と同じ区切り・ラベルの規則で求める）
+    return pd.Series([0.0], index=pd.DatetimeIndex([t])).resample(timeframe, origin=origin).count().index[0]
+
+
+def file_entry(path: Path, span: TickRange, plan: list[tuple[str, str | None]], origin: pd.Timestamp) -> FileEntry:
+    first, last, n = span
+    st = path.stat()
+    finest = plan[0][0]
+    bars = [bucket_label(t.tz_convert(origin.tz), finest, origin).isoformat() for t in (first, last)]
+    return FileEntry(st.st_size, st.st_mtime_ns, file_digest(path), first.isoformat(), last.isoformat(), n, bars)
+
+
+def _line_start(fh, pos: int, header_end: int) -> int:
+    # pos を含む行の次の行頭（pos がちょうど行頭なら pos）
+    if pos <= header_end:
+        return header_end
+    fh.seek(pos - 1)
+    fh.readline()
+    return fh.tell()
+
+
+def _row_offset(fh, size: int, header_end: int, target: pd.Timestamp, right: bool) -> int:
+    # 時刻順に並んだCSVの行を二分探索し、target 以上（right なら target より後）の最初の行の先頭バイト位置を返す
+    lo, hi = header_end, size
+    while lo < hi:
+        mid = _line_start(fh, (lo + hi) // 2, header_end)
+        if mid >= hi:
+            mid = lo
+        fh.seek(mid)
+        t = pd.Timestamp(fh.readline().split(b",", 1)[0].decode())
+        if t > target or (t == target and not right):
+            hi = mid
+        else:
+            lo = fh.tell()
+    return lo
+
+
+def splice_output(out_path: Path, new: pd.DataFrame, lo_bar: pd.Timestamp, hi_bar: pd.Timestamp, bar_store: bool) -> None:
+    # 書き出し済みのCSVのうち lo_bar〜hi_bar の行だけを new に差し替える。
+    # 範囲外の行は解析も書式化もせずバイト列のまま残すので、全体を作り直した時と同じ内容になる
+    size = out_path.stat().st_size
+    with out_path.open("rb") as fh:
+        header_end = len(fh.readline())
+        off0 = _row_offset(fh, size, header_end, lo_bar, right=False)
+        off1 = _row_offset(fh, size, header_end, hi_bar, right=True)
+        fh.seek(0)
+        head = fh.read(off0)
+        fh.seek(off1)
+        tail = fh.read()
+    body = new.reset_index().rename(columns={"index": "timestamp"}).to_csv(index=False, header=False) if len(new) else ""
+    tmp = out_path.with_name(f"{out_path.name}.tmp-{os.getpid()}")
+    with tmp.open("wb") as fh:
+        fh.write(head)
+        fh.write(body.encode("utf-8"))
+        fh.write(tail)
+    os.replace(tmp, out_path)
+
+    if bar_store:
+        store = store_path_for(out_path)
+        if is_bar_store(store):
+            old = load_bar_store(store)
+            i0, i1 = old.index.searchsorted(lo_bar, side="left"), old.index.searchsorted(hi_bar, side="right")
+            new = new.set_axis(new.index.tz_convert("UTC").rename(old.index.name)) if len(new) else old.iloc[:0]
+            bars = pd.concat([old.iloc[:i0], new, old.iloc[i1:]])
+        else:
+            bars = load_bars(out_path)
+        write_bar_store(bars, store)
+
+
+def run_incremental(
+    files: list[Path],
+    args: argparse.Namespace,
+    plan: list[tuple[str, str | None]],
+    paths: list[Path],
+    manifest: IngestManifest,
+    changed: list[Path],
+) -> bool:
+    # 変更のあったファイルの範囲の足だけを作り直し、既存の出力に差し込む。
+    # 既存の足の起点より前の tick が増えた場合は区切りが変わるので False を返す（全体を作り直す）
+    # 保存した ISO 形式は固定の時差になるので、夏時間の区切りが合うよう --tz のタイムゾーンに戻す
+    origin = pd.Timestamp(manifest.origin).tz_convert(manifest.tz)
+    timeframes = [tf for tf, _ in plan]
+    by_name = {f.name: f for f in files}
+    entries = manifest.files
+    loaded: dict[str, pd.DataFrame] = {}
+
+    def load(names: list[str]) -> None:
+        for file, ticks, error in iter_loaded_files([by_name[n] for n in names], args.workers, args.csv_engine):
+            if error is not None:
+                # 読めなくなったファイルは tick なしとして扱い、記録から外す（次回また読み直す）
+                print(f"[SKIP] {file.name}: {error}")
+                loaded[file.name] = pd.DataFrame({"price": np.empty(0)}, index=pd.DatetimeIndex([], tz="UTC"))
+                continue
+            loaded[file.name] = ticks
+            print(f"[OK] {file.name}: {len(ticks):,} ticks{format_note([ticks.attrs.get('time_format')])}")
+
+    def span_of(name: str) -> tuple[pd.Timestamp, pd.Timestamp]:
+        entry = entries[name]
+        return pd.Timestamp(entry.first), pd.Timestamp(entry.last)
+
+    load([f.name for f in changed])
+    # 作り直す時刻の窓: 変更ファイルの今回と前回の tick の範囲
+    bounds = [tick_range(loaded[f.name])[:2] for f in changed if not loaded[f.name].empty]
+    bounds += [span_of(f.name) for f in changed if f.name in entries]
+    if not bounds:
+        lo = hi = None
+    else:
+        lo, hi = min(b[0] for b in bounds), max(b[1] for b in bounds)
+        if lo < origin:
+            return False
+
+    def shares_bar(a: pd.Timestamp, b: pd.Timestamp) -> bool:
+        a, b = a.tz_convert(origin.tz), b.tz_convert(origin.tz)
+        return any(bucket_label(a, tf, origin) == bucket_label(b, tf, origin) for tf in timeframes)
+
+    # 窓と重なるファイルと、窓の端の足（月をまたぐ週足・日足など）に tick がある隣のファイルも読む。
+    # 窓は広げないので、隣のファイルから使うのは端の足の分だけ
+    while lo is not None:
+        rest = [n for n in entries if n in by_name and n not in loaded]
+        extra = [n for n in rest if span_of(n)[0] <= hi and span_of(n)[1] >= lo]
+        before = max((n for n in rest if span_of(n)[1] < lo), key=lambda n: span_of(n)[1], default=None)
+        after = min((n for n in rest if span_of(n)[0] > hi), key=lambda n: span_of(n)[0], default=None)
+        if before is not None and shares_bar(span_of(before)[1], lo):
+            extra.append(before)
+        if after is not None and shares_bar(span_of(after)[0], hi):
+            extra.append(after)
+        if not extra:
+            break
+        load(list(dict.fromkeys(extra)))
+
+    all_ticks = [loaded[f.name] for f in files if f.name in loaded and not loaded[f.name].empty]
+    frames = build_frames(merge_ticks(all_ticks, args.tz)[0], plan, origin) if all_ticks else {}
+
+    print("\n=== Done (差分) ===")
+    print(f"変更ファイル数: {len(changed)}（読み直し {len(loaded)} / 全 {len(files)}）")
+    # 窓の端の足を含め、窓にかかる足だけを差し替える（tick のない新規ファイルだけなら出力はそのまま）
+    for tf, out_path in zip(timeframes, paths) if lo is not None else ():
+        lo_bar = bucket_label(lo.tz_convert(origin.tz), tf, origin)
+        hi_bar = bucket_label(hi.tz_convert(origin.tz), tf, origin)
+        new = frames[tf] if tf in frames else pd.DataFrame()
+        if len(new):
+            new = new[(new.index >= lo_bar) & (new.index <= hi_bar)]
+        splice_output(out_path, new, lo_bar, hi_bar, args.bar_store)
+        print(f"{tf}作り直し: {len(new):,} 本（{lo_bar} 〜 {hi_bar}）")
+        print(f"出力先       : {out_path}")
+
+    for name, ticks in loaded.items():
+        span = tick_range(ticks)
+        if span is None:
+            entries.pop(name, None)
+        else:
+            entries[name] = file_entry(by_name[name], span, plan, origin)
+    return True
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="OANDA月次tick CSVを結合し任意時間足OHLCVへ変換")
     parser.add_argument("--input-dir", required=True, help="月次CSV(またはcsv.gz/zip)を置いたフォルダ")
-    parser.add_argument("--output", default="data/usdjpy_1h.csv", help="出力先CSV")
-    parser.add_argument("--timeframe", default="1h", help="リサンプリング足 (例: 5min, 15min, 1h)")
+    parser.add_argument(
+        "--output", default="data/usdjpy_1h.csv", help="出力先CSV。複数の足では {tf} を足の名前に置き換える（無ければ末尾の _1h などを付け替え）"
+    )
+    parser.add_argument(
+        "--timeframe", default="1h", help="リサンプリング足。カンマ区切りで複数可 (例: 5min / 1min,5min,15min,1h)"
+    )
     parser.add_argument("--tz", default="UTC", help="出力タイムゾーン（既定: UTC）")
+    parser.add_argument(
+        "--stream", action="store_true", help="ファイルをチャンク単位で読み、足を逐次書き出す（時系列順のファイル向け・省メモリ）"
+    )
+    parser.add_argument("--chunk-size", type=int, default=1_000_000, help="--stream 時に一度に読む行数")
+    parser.add_argument("--workers", type=int, default=1, help="ファイル読み込みの並列プロセス数")
+    parser.add_argument(
+        "--bar-store", action="store_true", help="出力CSVと同名の .bars フォルダにも列ごとの .npy で保存する（バックテストの高速読み込み用）"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="出力の隣の manifest を使い、追加・変更された入力ファイルの範囲の足だけを作り直す",
+    )
+    parser.add_argument(
+        "--csv-engine", default="c", choices=["c", "pyarrow"], help="CSV本体の読み込みエンジン（pyarrow は要インストール）"
+    )
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
+    start_profile(args)
+    try:
+        convert(args)
+    finally:
+        finish_profile(args)
+
+
+def convert(args: argparse.Namespace) -> None:
+    if args.csv_engine == "pyarrow" and importlib.util.find_spec("pyarrow") is None:
+        raise ImportError("--csv-engine pyarrow には pyarrow のインストールが必要です")
+
     in_dir = Path(args.input_dir)
     if not in_dir.exists():
         raise FileNotFoundError(f"入力フォルダが見つかりません: {in_dir}")
@@ -115,35 +1010,43 @@ def main() -> None:
     if not files:
         raise ValueError("入力フォルダにCSV系ファイルがありません")
 
-    all_ticks = []
-    for file in files:
-        try:
-            ticks = load_single_file(file)
-            all_ticks.append(ticks)
-            print(f"[OK] {file.name}: {len(ticks):,} ticks")
-        except Exception as exc:
-            print(f"[SKIP] {file.name}: {exc}")
-
-    if not all_ticks:
-        raise RuntimeError("読み込めるファイルがありませんでした")
-
-    merged = pd.concat(all_ticks).sort_index()
-    merged = merged[~merged.index.duplicated(keep="last")]
+    plan = rollup_plan(args.timeframe, args.tz)
+    paths = [output_path_for(args.output, tf, len(plan) > 1) for tf, _ in plan]
+    if len(set(paths)) != len(paths):
+        raise ValueError("時間足ごとの出力先が重複しています（--output に {tf} を入れてください）")
 
-    if args.tz.upper() != "UTC":
-        merged.index = merged.index.tz_convert(args.tz)
+    manifest_path = manifest_path_for(paths[0])
+    if args.incremental:
+        manifest = IngestManifest.load(manifest_path)
+        reason = "manifest がありません" if manifest is None else manifest.settings_differ([tf for tf, _ in plan], args.tz, paths)
+        if reason is None:
+            changed, removed = changed_files(files, manifest)
+            if removed:
+                reason = f"前回の入力ファイルがありません: {removed[0]}"
+            elif not changed:
+                manifest.save(manifest_path)
+                print("変更のある入力ファイルはありません")
+                return
+            elif run_incremental(files, args, plan, paths, manifest, changed):
+                manifest.save(manifest_path)
+                print(f"manifest     : {manifest_path}")
+                return
+            else:
+                reason = "既存の足より前の tick が追加されています"
+        print(f"[FULL] {reason}。全体を作り直します")
 
-    bars = to_ohlcv(merged, args.timeframe)
-
-    out_path = Path(args.output)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    bars.to_csv(out_path, index=False)
+    if args.stream:
+        ranges, origin = run_streaming(files, args, plan, paths)
+    else:
+        ranges, origin = run_in_memory(files, args, plan, paths)
 
-    print("\n=== Done ===")
-    print(f"入力ファイル数: {len(files)}")
-    print(f"統合tick数   : {len(merged):,}")
-    print(f"{args.timeframe}本数  : {len(bars):,}")
-    print(f"出力先       : {out_path}")
+    if args.incremental:
+        manifest = IngestManifest([tf for tf, _ in plan], args.tz, [str(p) for p in paths], origin.isoformat())
+        by_name = {f.name: f for f in files}
+        for name, span in ranges.items():
+            manifest.files[name] = file_entry(by_name[name], span, plan, origin)
+        manifest.save(manifest_path)
+        print(f"manifest     : {manifest_path}")
 
 
 if __name__ == "__main__":
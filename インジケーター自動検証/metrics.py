@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from timestamps import parse_timestamps
+
+try:
+    from numba import njit
+except ImportError:  # numba は任意依存。無ければ NumPy の累積演算で計算する
+    njit = None
+
+# 損益の集計（run_backtest の summarize・scripts/aggregate_trades*.py・最適化の評価で共通）。
+# 「グループ番号 x 勝ち負け」をキーに np.bincount を件数と合計の2回だけ回し、残りの指標はそこから求める
+
+
+def pnl_sums(pnl: np.ndarray, group: np.ndarray | None = None, n_groups: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    # (件数, 合計)。どちらも (グループ数, 2) で、列 0 が負け（pnl <= 0）、列 1 が勝ち
+    pnl = np.asarray(pnl, dtype=np.float64)
+    key = (pnl > 0).astype(np.int64)
+    if group is not None:
+        key += np.asarray(group, dtype=np.int64) * 2
+    counts = np.bincount(key, minlength=2 * n_groups).reshape(n_groups, 2)
+    sums = np.bincount(key, weights=pnl, minlength=2 * n_groups).reshape(n_groups, 2)
+    return counts, sums
+
+
+def metrics_from_sums(wins, losses, gross_profit, gross_loss) -> dict[str, np.ndarray]:
+    # 勝ち負けの件数・合計（設定やグループごとの配列）から各指標を配列のまま計算する。PF は負けが無ければ NaN
+    wins = np.asarray(wins, dtype=np.int64)
+    losses = np.asarray(losses, dtype=np.int64)
+    gross_profit = np.asarray(gross_profit, dtype=np.float64)
+    gross_loss = np.asarray(gross_loss, dtype=np.float64)
+    total = wins + losses
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "total_trades": total,
+            "wins": wins,
+            "losses": losses,
+            "net": gross_profit + gross_loss,
+            "gross_profit": gross_profit,
+            "gross_loss": gross_loss,
+            "win_rate": np.where(total > 0, wins / total * 100, 0.0),
+            "profit_factor": np.where(gross_loss < 0, gross_profit / np.abs(gross_loss), np.nan),
+            "avg_win": np.where(wins > 0, gross_profit / wins, 0.0),
+            "avg_loss": np.where(losses > 0, gross_loss / losses, 0.0),
+        }
+
+
+def trade_metrics(pnl: np.ndarray, group: np.ndarray | None = None, n_groups: int = 1) -> dict[str, np.ndarray]:
+    counts, sums = pnl_sums(pnl, group, n_groups)
+    return metrics_from_sums(counts[:, 1], counts[:, 0], sums[:, 1], sums[:, 0])
+
+
+def max_drawdown(curve: np.ndarray) -> float:
+    # 評価額の曲線の最大ドローダウン
+    curve = np.asarray(curve, dtype=np.float64)
+    return float((np.maximum.accumulate(curve) - curve).max()) if len(curve) else 0.0
+
+
+def _drawdown_loop(curves, start, peak, peak_pos, max_dd, max_pct, max_bars) -> None:
+    # curves は (バー, 曲線)。状態の配列を書き換えるので、ブロックに分けて時刻順に続けて呼べる
+    for i in range(curves.shape[0]):
+        for k in range(curves.shape[1]):
+            v = curves[i, k]
+            if v >= peak[k]:
+                peak[k] = v
+                peak_pos[k] = start + i
+                continue
+            dd = peak[k] - v
+            if dd > max_dd[k]:
+                max_dd[k] = dd
+            pct = dd / peak[k] * 100
+            if pct > max_pct[k]:
+                max_pct[k] = pct
+            if start + i - peak_pos[k] > max_bars[k]:
+                max_bars[k] = start + i - peak_pos[k]
+
+
+_drawdown_loop_jit = njit(cache=True)(_drawdown_loop) if njit is not None else None
+
+
+class DrawdownTracker:
+    # 曲線ごとの最大ドローダウン（額・ピーク比%）と最長のドローダウン期間（ピークから回復までのバー数。
+    # 回復していなければ最後のバーまで）。(バー, 曲線) のブロックを時刻順に update していく
+    def __init__(self, n_curves: int, start: int = 0) -> None:
+        self.pos = start
+        self.peak = np.full(n_curves, -np.inf)
+        self.peak_pos = np.full(n_curves, start, dtype=np.int64)
+        self.max_dd = np.zeros(n_curves, dtype=np.float64)
+        self.max_pct = np.zeros(n_curves, dtype=np.float64)
+        self.max_bars = np.zeros(n_curves, dtype=np.int64)
+
+    def update(self, block: np.ndarray) -> None:
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim == 1:
+            block = block[:, None]
+        if len(block) == 0:
+            return
+        if _drawdown_loop_jit is not None:
+            _drawdown_loop_jit(
+                np.ascontiguousarray(block), self.pos, self.peak, self.peak_pos, self.max_dd, self.max_pct, self.max_bars
+            )
+        else:
+            run = np.maximum.accumulate(block, axis=0)
+            np.maximum(run, self.peak, out=run)
+            dd = run - block
+            with np.errstate(divide="ignore", invalid="ignore"):
+                np.maximum(self.max_dd, dd.max(axis=0), out=self.max_dd)
+                np.maximum(self.max_pct, (dd / run * 100).max(axis=0), out=self.max_pct)
+            pos = np.arange(self.pos, self.pos + len(block))[:, None]
+            last = np.maximum.accumulate(np.where(block >= run, pos, -1), axis=0)
+            np.maximum(last, self.peak_pos, out=last)
+            np.maximum(self.max_bars, (pos - last).max(axis=0), out=self.max_bars)
+            self.peak = run[-1].copy()
+            self.peak_pos = last[-1].copy()
+        self.pos += len(block)
+
+
+def drawdown_stats(curve: np.ndarray) -> tuple[float, float, int]:
+    # (最大DD額, 最大DD%, 最長DD期間のバー数) を1回の走査で
+    tracker = DrawdownTracker(1)
+    tracker.update(curve)
+    return float(tracker.max_dd[0]), float(tracker.max_pct[0]), int(tracker.max_bars[0])
+
+
+def summarize_pnl(pnl: np.ndarray, equity_curve: np.ndarray, initial_capital: float, final_equity: float) -> dict:
+    # run_backtest の結果 dict
+    m = trade_metrics(pnl)
+    net = final_equity - initial_capital
+    dd, dd_pct, dd_bars = drawdown_stats(equity_curve)
+    return {
+        "initial_capital": initial_capital,
+        "final_equity": final_equity,
+        "net_pnl": net,
+        "net_pct": (net / initial_capital) * 100,
+        "total_trades": int(m["total_trades"][0]),
+        "win_rate": float(m["win_rate"][0]),
+        "profit_factor": float(m["profit_factor"][0]),
+        "max_drawdown": dd,
+        "max_drawdown_pct": dd_pct,
+        "max_drawdown_bars": dd_bars,
+        "avg_win": float(m["avg_win"][0]),
+        "avg_loss": float(m["avg_loss"][0]),
+    }
+
+
+def batch_metrics(pnls: list[np.ndarray], initial_capital: float | np.ndarray | None = None) -> dict[str, np.ndarray]:
+    # 複数の実行（設定）の損益をまとめて1回で集計する。initial_capital を渡すと、
+    # 約定ごとの評価額（初期資金 + 累積損益）の最大ドローダウンも "max_drawdown" に入れる
+    lengths = np.array([len(p) for p in pnls], dtype=np.int64)
+    pnl = np.concatenate(pnls).astype(np.float64, copy=False) if len(pnls) else np.empty(0)
+    run = np.repeat(np.arange(len(pnls)), lengths)
+    m = trade_metrics(pnl, run, len(pnls))
+    if initial_capital is not None:
+        capital = np.broadcast_to(np.asarray(initial_capital, dtype=np.float64), len(pnls))
+        m["max_drawdown"] = np.array([max_drawdown(c + np.cumsum(p)) for c, p in zip(capital, pnls)], dtype=np.float64)
+    return m
+
+
+def month_labels(times) -> np.ndarray:
+    # "2025-01" 形式の月（時刻の列のタイムゾーンのまま）
+    index = pd.DatetimeIndex(times)
+    local = index.tz_localize(None) if index.tz is not None else index
+    return local.to_numpy().astype("datetime64[M]").astype(str)
+
+
+def breakdown(labels, pnl: np.ndarray) -> pd.DataFrame:
+    # ラベル（サイド・決済理由・月など）ごとの集計。ラベルの昇順
+    codes, uniques = pd.factorize(np.asarray(labels), sort=True)
+    m = trade_metrics(pnl, codes, len(uniques))
+    return pd.DataFrame(
+        {
+            "trades": m["total_trades"],
+            "net": m["net"],
+            "win_rate": m["win_rate"],
+            "profit_factor": m["profit_factor"],
+            "avg_win": m["avg_win"],
+            "avg_loss": m["avg_loss"],
+        },
+        index=pd.Index(uniques),
+    )
+
+
+def trade_breakdowns(trades: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    # トレード履歴（trades_to_frame の列）のサイド別・決済理由別・月別
+    pnl = trades["pnl"].to_numpy(dtype=np.float64)
+    out = {}
+    if "side" in trades:
+        out["side"] = breakdown(trades["side"], pnl)
+    if "reason" in trades:
+        out["reason"] = breakdown(trades["reason"], pnl)
+    if "time" in trades:
+        times = trades["time"]
+        if not isinstance(times.dtype, pd.DatetimeTZDtype) and not pd.api.types.is_datetime64_dtype(times.dtype):
+            times, _ = parse_timestamps(times)
+        out["month"] = breakdown(month_labels(times), pnl)
+    return out
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import pandas as pd
+
+from backtest_heikin_ashi_ma_touch_5m import Config, run_backtest_batch
+from bar_store import load_bars
+from profiling import finish_profile, start_profile
+from search_space import Param, SearchSpace, add_search_arguments, open_result_store, run_search, top_results
+
+GRID_COLUMNS = {
+    "ma_type": "ma",
+    "ma_fast_len": "fast",
+    "ma_slow_len": "slow",
+    "st_period": "st_p",
+    "st_factor": "st_f",
+    "touch_margin_pips": "touch",
+}
+START, END = "2025-01-01", "2026-02-28"
+MAX_DD = 3000  # SAFE 表の dd 上限（tpe の制約にも使う）
+STRATEGY = "ha_touch_5m/1"  # バックテストや evaluate の列を変えたら上げる（結果ストアの既存行を使わなくなる）
+OUT_PATH = "result_grid_ha_touch_5m.csv"
+
+SPACE = SearchSpace(
+    [
+        Param("ma_type", ["SMA", "EMA"]),
+        Param("ma_fast_len", [10, 15, 20, 25]),
+        Param("ma_slow_len", [40, 50, 60, 80]),
+        Param("st_period", [7, 10, 14]),
+        Param("st_factor", [2.0, 2.5, 3.0]),
+        Param("touch_margin_pips", [1.0, 2.0, 3.0]),
+    ]
+)
+
+
+def evaluate(
+    df: pd.DataFrame, configs: list[Config], start: str = START, end: str = END, curves: str | None = None
+) -> list[dict | None]:
+    # チャンク内の全設定を1回のバー走査でまとめて評価する
+    res = run_backtest_batch(df, configs, start, end, curves)
+    res = res[[*GRID_COLUMNS, "net", "net_pct", "dd", "dd_pct", "dd_bars", "pf", "wr", "trades"]].rename(columns=GRID_COLUMNS)
+    return [row if row["trades"] > 0 else None for row in res.to_dict("records")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Heikin Ashi MA Touch(5分足)のグリッドサーチ")
+    add_search_arguments(parser, chunk_size=256)
+    args = parser.parse_args()
+    start_profile(args)
+
+    df = load_bars("data/usdjpy_5m.csv")
+
+    store = open_result_store(args, df, START, END, OUT_PATH, STRATEGY)
+    res = run_search(df, SPACE, Config(), evaluate, args, START, END, OUT_PATH, MAX_DD, batch=True, store=store)
+    finish_profile(args)
+    if res.empty:
+        print("No result")
+        return
+
+    res = res.sort_values(["net", "pf"], ascending=[False, False])
+    best, safe = top_results(res, store, 10, MAX_DD)
+
+    print("BEST_NET_TOP10")
+    print(best.to_string(index=False))
+    print(f"\nSAFE_TOP10(net>0, dd<={MAX_DD})")
+    print("None" if safe.empty else safe.to_string(index=False))
+
+    res.to_csv(OUT_PATH, index=False)
+    print(f"\nSaved: {OUT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
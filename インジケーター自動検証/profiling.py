@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from functools import wraps
+from pathlib import Path
+from typing import Callable
+
+try:
+    import resource
+except ImportError:  # Windows には resource が無い（ピークRSSは記録しない）
+    resource = None
+
+# 段階ごとの計測（--profile）。無効時の stage() は使い回しの何もしないオブジェクトを返すだけで、計測のコストはかからない。
+# 有効時は段階名ごとの回数・時間・処理行数（足数や tick 数）とカウンタを集め、JSON か Chrome trace で書き出す。
+# 並列スイープではワーカーの集計を snapshot() で親へ返し、merge() で合算する
+_profiler: Profiler | None = None
+
+
+def _peak_rss() -> int | None:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return int(rss) if sys.platform == "darwin" else int(rss) * 1024
+
+
+class _Stage:
+    # rows は with の中で後から設定してもよい（読み込んでみるまで件数が分からない段階など）
+    __slots__ = ("profiler", "name", "rows", "t0")
+
+    def __init__(self, profiler: Profiler, name: str, rows: int) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self) -> _Stage:
+        self.t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.profiler.add(self.name, self.t0, time.perf_counter_ns() - self.t0, self.rows)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self) -> _NullStage:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+    @property
+    def rows(self) -> int:
+        return 0
+
+    @rows.setter
+    def rows(self, value: int) -> None:
+        pass
+
+
+_NULL = _NullStage()
+
+
+class Profiler:
+    def __init__(self, trace: bool = False) -> None:
+        self.trace = trace
+        self.pid = os.getpid()
+        self.t0 = time.perf_counter_ns()
+        self.stages: dict[str, list[int]] = {}  # 段階名 -> [回数, 時間(ns), 行数]
+        self.counters: dict[str, int] = {}
+        self.events: list[tuple] = []  # Chrome trace 用 (段階名, 開始ns, 時間ns, pid, 行数)
+        self.peak_rss: dict[int, int] = {}  # pid -> ピークRSS(バイト)
+
+    def add(self, name: str, start_ns: int, dur_ns: int, rows: int = 0) -> None:
+        stat = self.stages.get(name)
+        if stat is None:
+            self.stages[name] = [1, dur_ns, rows]
+        else:
+            stat[0] += 1
+            stat[1] += dur_ns
+            stat[2] += rows
+        if self.trace:
+            self.events.append((name, start_ns, dur_ns, os.getpid(), rows))
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> dict:
+        # ワーカーから親へ返す分。返した分は消して次のチャンクと重複しないようにする
+        rss = _peak_rss()
+        snap = {"stages": self.stages, "counters": self.counters, "events": self.events, "peak_rss": {os.getpid(): rss} if rss else {}}
+        self.stages, self.counters, self.events = {}, {}, []
+        return snap
+
+    def merge(self, snap: dict) -> None:
+        for name, (calls, ns, rows) in snap["stages"].items():
+            stat = self.stages.setdefault(name, [0, 0, 0])
+            stat[0] += calls
+            stat[1] += ns
+            stat[2] += rows
+        for name, n in snap["counters"].items():
+            self.count(name, n)
+        self.events.extend(snap["events"])
+        for pid, rss in snap["peak_rss"].items():
+            self.peak_rss[pid] = max(self.peak_rss.get(pid, 0), rss)
+
+    def report(self) -> dict:
+        wall = (time.perf_counter_ns() - self.t0) / 1e9
+        rss = _peak_rss()
+        if rss:
+            self.peak_rss[os.getpid()] = max(self.peak_rss.get(os.getpid(), 0), rss)
+        stages = {}
+        # 入れ子の段階も含むので share の合計は 100% を超えることがある
+        for name, (calls, ns, rows) in sorted(self.stages.items(), key=lambda kv: -kv[1][1]):
+            sec = ns / 1e9
+            stages[name] = {
+                "calls": calls,
+                "seconds": sec,
+                "share": sec / wall if wall > 0 else 0.0,
+                "rows": rows,
+                "rows_per_sec": rows / sec if rows and sec > 0 else None,
+            }
+        hits = self.counters.get("indicator_cache.hit", 0) + self.counters.get("indicator_cache.disk_hit", 0)
+        lookups = hits + self.counters.get("indicator_cache.miss", 0)
+        return {
+            "wall_seconds": wall,
+            "processes": max(len(self.peak_rss), 1),
+            "peak_rss_bytes": self.peak_rss.get(os.getpid()),
+            "worker_peak_rss_bytes": max((v for k, v in self.peak_rss.items() if k != os.getpid()), default=None),
+            "stages": stages,
+            "counters": dict(sorted(self.counters.items())),
+            "indicator_cache_hit_rate": hits / lookups if lookups else None,
+        }
+
+    def chrome_trace(self) -> dict:
+        # chrome://tracing / Perfetto で開ける形式（時刻は計測開始からの µs）
+        events = [
+            {
+                "name": name,
+                "cat": name.split(".", 1)[0],
+                "ph": "X",
+                "ts": (start - self.t0) / 1000,
+                "dur": dur / 1000,
+                "pid": pid,
+                "tid": pid,
+                "args": {"rows": rows} if rows else {},
+            }
+            for name, start, dur, pid, rows in self.events
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.report()}
+
+
+def get_profiler() -> Profiler | None:
+    return _profiler
+
+
+def set_profiler(profiler: Profiler | None) -> None:
+    # None を渡すと計測を止める
+    global _profiler
+    _profiler = profiler
+
+
+def stage(name: str, rows: int = 0) -> _Stage | _NullStage:
+    # with stage("backtest.bar_loop", rows=len(bars)): ...
+    if _profiler is None:
+        return _NULL
+    return _Stage(_profiler, name, rows)
+
+
+def count(name: str, n: int = 1) -> None:
+    if _profiler is not None:
+        _profiler.count(name, n)
+
+
+def profiled(name: str) -> Callable:
+    # 関数全体を1つの段階として計測するデコレータ
+    def decorate(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return fn(*args, **kwargs)
+            with _Stage(_profiler, name, 0):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def call_profiled(trace: bool, fn: Callable, *args):
+    # プロセスプールのワーカー側で fn を計測付きで呼び、(結果, 集計) を返す。親は Profiler.merge で合算する。
+    # fork で親の Profiler を引き継いだ場合も、親の分を二重に数えないようワーカー用に作り直す
+    if _profiler is None or _profiler.pid != os.getpid():
+        set_profiler(Profiler(trace))
+    result = fn(*args)
+    return result, _profiler.snapshot()
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="profile.json",
+        default=None,
+        help="段階ごとの計測結果を書き出す(既定: profile.json。拡張子 .trace.json なら Chrome trace 形式)",
+    )
+
+
+def start_profile(args: argparse.Namespace) -> None:
+    if getattr(args, "profile", None):
+        set_profiler(Profiler(trace=args.profile.endswith(".trace.json")))
+
+
+def finish_profile(args: argparse.Namespace) -> None:
+    profiler = _profiler
+    if profiler is None or not getattr(args, "profile", None):
+        return
+    out = profiler.chrome_trace() if profiler.trace else profiler.report()
+    Path(args.profile).write_text(json.dumps(out, ensure_ascii=False, indent=2), encoding="utf-8")
+    print_report(out.get("otherData", out))
+    print(f"profile: {args.profile}")
+
+
+def print_report(report: dict, top: int = 12) -> None:
+    print(f"\n=== profile (wall {report['wall_seconds']:.2f}s, {report['processes']} process) ===")
+    for name, st in list(report["stages"].items())[:top]:
+        rate = f"{st['rows_per_sec']:>14,.0f} rows/s" if st["rows_per_sec"] else ""
+        print(f"{name:32s} {st['seconds']:9.3f}s {st['share'] * 100:6.1f}% x{st['calls']:<6d} {rate}")
+    if report["indicator_cache_hit_rate"] is not None:
+        print(f"indicator cache hit rate : {report['indicator_cache_hit_rate'] * 100:.1f}%")
+    if report["peak_rss_bytes"]:
+        print(f"peak RSS                 : {report['peak_rss_bytes'] / 1024**2:,.0f} MiB")
+    if report["worker_peak_rss_bytes"]:
+        print(f"worker peak RSS          : {report['worker_peak_rss_bytes'] / 1024**2:,.0f} MiB")
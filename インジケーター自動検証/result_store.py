@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import sqlite3
+from dataclasses import fields
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from indicator_cache import fingerprint
+
+# 最適化結果のストア（SQLite）。1行が1設定の評価で、キーは (データの指紋, 戦略のバージョン, Config 全体, start, end) のハッシュ。
+# 評価済みの設定は再実行時に飛ばし、BEST/SAFE の上位は SQL で引く（実行中は今回の設定だけ、CLI は scope 全体）。
+# scope はデータの指紋・戦略・期間の組で、同じ scope なら後からグリッドの値を足しても既存の行はそのまま使える
+STORE_SUFFIX = ".sqlite"
+_SQL_VARS = 900  # 1回の IN (...) に渡すキー数（SQLite の変数上限より小さく）
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scopes (
+    scope TEXT PRIMARY KEY, data TEXT NOT NULL, strategy TEXT NOT NULL, start TEXT, end TEXT, created TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY, scope TEXT NOT NULL, config TEXT NOT NULL, row TEXT, net REAL, dd REAL, pf REAL
+);
+CREATE INDEX IF NOT EXISTS results_rank ON results (scope, net DESC, pf DESC);
+CREATE TEMP TABLE IF NOT EXISTS run_keys (run INTEGER NOT NULL, key TEXT NOT NULL, PRIMARY KEY (run, key));
+"""
+
+
+def store_path_for(out_path: str | Path) -> Path:
+    # result_grid_ha_touch_5m.csv -> result_grid_ha_touch_5m.sqlite
+    return Path(out_path).with_suffix(STORE_SUFFIX)
+
+
+def data_fingerprint(df: pd.DataFrame) -> str:
+    # 評価期間のバーの時刻と数値列
+    cols = [df[c].to_numpy(dtype=np.float64) for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+    return fingerprint(df.index.as_unit("ns").asi8, *cols)
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"JSON にできない値です: {value!r}")
+
+
+def _dumps(value, sort_keys: bool = True) -> str:
+    return json.dumps(value, sort_keys=sort_keys, ensure_ascii=False, default=_json_default)
+
+
+def _digest(*parts) -> str:
+    return hashlib.blake2b(_dumps(parts).encode(), digest_size=16).hexdigest()
+
+
+def config_json(cfg) -> str:
+    # Config 全体（フィールド名の順）。asdict は値を deepcopy して遅いので、スカラーだけのフィールドを直接読む
+    return _dumps({f.name: getattr(cfg, f.name) for f in fields(cfg)})
+
+
+class ResultStore:
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        # WAL にしておくと書き込み中でも別プロセスから上位を読める。チャンクごとの commit で落ちても途中までは残る
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+        self.runs = 0
+
+    def scope(self, data: str, strategy: str, start: str | None, end: str | None, reuse: bool = True) -> ResultScope:
+        scope = _digest(data, strategy, start, end)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO scopes VALUES (?, ?, ?, ?, ?, ?)",
+                (scope, data, strategy, start, end, pd.Timestamp.now(tz="UTC").isoformat()),
+            )
+        return ResultScope(self, scope, reuse)
+
+    def scopes(self) -> pd.DataFrame:
+        return pd.read_sql_query(
+            "SELECT s.scope, s.strategy, s.start, s.end, s.created, COUNT(r.key) AS rows FROM scopes s"
+            " LEFT JOIN results r ON r.scope = s.scope GROUP BY s.scope ORDER BY s.created",
+            self.conn,
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class ResultScope:
+    def __init__(self, store: ResultStore, scope: str, reuse: bool = True) -> None:
+        # reuse=False なら保存済みでも評価し直して上書きする（評価額曲線を保存するときなど）
+        self.store = store
+        self.scope = scope
+        self.reuse = reuse
+        self.run: int | None = None  # track() した今回の設定の番号（接続ごとの一時テーブル run_keys）
+
+    def key(self, cfg_json: str) -> str:
+        return hashlib.blake2b(f"{self.scope}:{cfg_json}".encode(), digest_size=16).hexdigest()
+
+    def lookup(self, configs: list) -> dict[int, dict | None]:
+        # 保存済みの設定の {configs の位置: 行}。取引なしで行が無い設定は None
+        if not self.reuse:
+            return {}
+        keys = [self.key(config_json(cfg)) for cfg in configs]
+        found: dict[str, dict | None] = {}
+        for i in range(0, len(keys), _SQL_VARS):
+            part = keys[i : i + _SQL_VARS]
+            sql = f"SELECT key, row FROM results WHERE key IN ({','.join('?' * len(part))})"
+            for key, row in self.store.conn.execute(sql, part):
+                found[key] = json.loads(row) if row is not None else None
+        return {k: found[key] for k, key in enumerate(keys) if key in found}
+
+    def track(self, configs: list) -> None:
+        # 今回の実行の設定を記録し、best/safe をその設定だけに絞る（結果CSVと同じ設定の表にする）
+        self.store.runs += 1
+        self.run = self.store.runs
+        keys = [(self.run, self.key(config_json(cfg))) for cfg in configs]
+        with self.store.conn:
+            self.store.conn.executemany("INSERT OR IGNORE INTO temp.run_keys VALUES (?, ?)", keys)
+
+    def save(self, configs: list, rows: list[dict | None]) -> None:
+        records = []
+        for cfg, row in zip(configs, rows):
+            cfg_json = config_json(cfg)
+            if row is None:
+                records.append((self.key(cfg_json), self.scope, cfg_json, None, None, None, None))
+            else:
+                # 行は列の順のまま保存する（表示や CSV の列順を保つ）
+                row_json = _dumps(row, sort_keys=False)
+                records.append((self.key(cfg_json), self.scope, cfg_json, row_json, row.get("net"), row.get("dd"), row.get("pf")))
+        with self.store.conn:
+            self.store.conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)", records)
+
+    def _frame(self, sql: str, params: tuple) -> pd.DataFrame:
+        return pd.DataFrame([json.loads(row) for (row,) in self.store.conn.execute(sql, params)])
+
+    def _ranked(self, where: str, order: str, params: tuple, k: int, whole: bool) -> pd.DataFrame:
+        # track() 済みなら今回の設定だけ、whole=True か未記録なら scope 全体（過去の実行の設定も含む）
+        if whole or self.run is None:
+            sql = f"SELECT row FROM results WHERE scope = ? AND {where} ORDER BY {order} LIMIT ?"
+            return self._frame(sql, (self.scope, *params, k))
+        sql = (
+            "SELECT row FROM results JOIN temp.run_keys USING (key)"
+            f" WHERE run = ? AND scope = ? AND {where} ORDER BY {order} LIMIT ?"
+        )
+        return self._frame(sql, (self.run, self.scope, *params, k))
+
+    def best(self, k: int, whole: bool = False) -> pd.DataFrame:
+        # optimize_*.py の BEST 表と同じ並び（net 降順、同点は pf 降順）
+        return self._ranked("net IS NOT NULL", "net DESC, pf DESC", (), k, whole)
+
+    def safe(self, k: int, max_dd: float, whole: bool = False) -> pd.DataFrame:
+        # SAFE 表: net > 0 かつ dd <= max_dd を net 降順（同点は dd 昇順）
+        return self._ranked("net > 0 AND dd <= ?", "net DESC, dd ASC", (max_dd,), k, whole)
+
+    def rows(self) -> pd.DataFrame:
+        return self._frame("SELECT row FROM results WHERE scope = ? AND row IS NOT NULL ORDER BY rowid", (self.scope,))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="最適化結果ストア(.sqlite)の BEST/SAFE 上位を表示する")
+    parser.add_argument("store", help="optimize_*.py が結果CSVの隣に作る .sqlite")
+    parser.add_argument("--scope", default=None, help="表示する scope(先頭一致。省略時は最後に作った scope)")
+    parser.add_argument("--top", type=int, default=10, help="表示する件数")
+    parser.add_argument("--max-dd", type=float, default=None, help="SAFE 表の dd 上限(省略時は SAFE 表を出さない)")
+    args = parser.parse_args()
+
+    if not Path(args.store).is_file():
+        raise FileNotFoundError(f"ストアが見つかりません: {args.store}")
+    store = ResultStore(args.store)
+    scopes = store.scopes()
+    if scopes.empty:
+        print("No result")
+        return
+    print(scopes.to_string(index=False))
+    chosen = scopes if args.scope is None else scopes[scopes["scope"].str.startswith(args.scope)]
+    if chosen.empty:
+        raise ValueError(f"scope が見つかりません: {args.scope}")
+    scope = ResultScope(store, chosen["scope"].iloc[-1])
+
+    # ストアの scope 全体（これまでの実行で評価した全設定）の上位
+    best = scope.best(args.top, whole=True)
+    print(f"\nBEST_NET_TOP{args.top}(scope 全体)")
+    print("None" if best.empty else best.to_string(index=False))
+    if args.max_dd is not None:
+        safe = scope.safe(args.top, args.max_dd, whole=True)
+        print(f"\nSAFE_TOP{args.top}(scope 全体, net>0, dd<={args.max_dd:g})")
+        print("None" if safe.empty else safe.to_string(index=False))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,53 @@
 #!/usr/bin/env python3
-import pandas as pd
+import sys
 from pathlib import Path
-p=Path('result_trades_ha_touch_5m.csv')
-if not p.exists():
-    print(f"CSV not found: {p}")
-    raise SystemExit(1)
 
-df=pd.read_csv(p)
-if df.empty:
-    print('トレード履歴が空です')
-    raise SystemExit(0)
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from metrics import batch_metrics, trade_breakdowns  # noqa: E402
 
+p = Path('result_trades_ha_touch_5m.csv')
 initial_cap = 100000.0
 
-total=len(df)
-net=df['pnl'].sum()
-gross_profit=df.loc[df['pnl']>0,'pnl'].sum()
-gross_loss=df.loc[df['pnl']<=0,'pnl'].sum()
-pf = gross_profit / -gross_loss if gross_loss<0 else float('inf')
-wins=(df['pnl']>0).sum()
-win_rate = wins/total*100 if total else 0
-avg_win = df.loc[df['pnl']>0,'pnl'].mean() if wins else 0
-avg_loss = df.loc[df['pnl']<=0,'pnl'].mean() if (total-wins) else 0
-
-equity = (df['pnl'].cumsum()+initial_cap)
-max_dd = (equity.cummax() - equity).max()
-
-print('=== 集計結果 (result_trades_ha_touch_5m.csv) ===')
-print(f"Total trades : {total}")
-print(f"Net PnL      : {net:.2f}")
-print(f"Gross Profit : {gross_profit:.2f}")
-print(f"Gross Loss   : {gross_loss:.2f}")
-print(f"Profit Factor: {pf:.2f}" if pf!=float('inf') else 'Profit Factor: inf')
-print(f"Win Rate     : {win_rate:.2f}% ({wins}/{total})")
-print(f"Avg Win/Loss : {avg_win:.2f} / {avg_loss:.2f}")
-print(f"Max Drawdown : {max_dd:.2f}")
-
-print('\n--- サイド別 ---')
-for side in ['LONG','SHORT']:
-    sub=df[df['side']==side]
-    if len(sub)==0:
-        continue
-    nn=len(sub)
-    nnet=sub['pnl'].sum()
-    nwin=(sub['pnl']>0).sum()
-    nwr = nwin/nn*100
-    print(f"{side}: trades={nn}, net={nnet:.2f}, win_rate={nwr:.2f}%")
-
-print('\nファイル: result_trades_ha_touch_5m.csv')
+
+def report_lines(df: pd.DataFrame) -> list[str]:
+    m = {k: v[0] for k, v in batch_metrics([df['pnl'].to_numpy()], initial_cap).items()}
+    total, wins = int(m['total_trades']), int(m['wins'])
+    pf = m['profit_factor']
+
+    lines = [f'=== 集計結果 ({p}) ===']
+    lines.append(f"Total trades : {total}")
+    lines.append(f"Net PnL      : {m['net']:.2f}")
+    lines.append(f"Gross Profit : {m['gross_profit']:.2f}")
+    lines.append(f"Gross Loss   : {m['gross_loss']:.2f}")
+    lines.append(f"Profit Factor: {pf:.2f}" if pd.notna(pf) else 'Profit Factor: inf')
+    lines.append(f"Win Rate     : {m['win_rate']:.2f}% ({wins}/{total})")
+    lines.append(f"Avg Win/Loss : {m['avg_win']:.2f} / {m['avg_loss']:.2f}")
+    lines.append(f"Max Drawdown : {m['max_drawdown']:.2f}")
+
+    groups = trade_breakdowns(df)
+    for key, title in [('side', 'サイド別'), ('reason', '決済理由別'), ('month', '月別')]:
+        if key not in groups:
+            continue
+        lines.append(f'\n--- {title} ---')
+        for label, row in groups[key].iterrows():
+            lines.append(f"{label}: trades={row['trades']:.0f}, net={row['net']:.2f}, win_rate={row['win_rate']:.2f}%")
+    return lines
+
+
+def load_trades() -> pd.DataFrame | None:
+    if not p.exists():
+        print(f"CSV not found: {p}")
+        raise SystemExit(1)
+    df = pd.read_csv(p)
+    return None if df.empty else df
+
+
+if __name__ == '__main__':
+    df = load_trades()
+    if df is None:
+        print('トレード履歴が空です')
+        raise SystemExit(0)
+    print('\n'.join(report_lines(df)))
+    print(f'\nファイル: {p}')
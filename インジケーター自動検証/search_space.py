@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import inspect
+import math
+from dataclasses import dataclass, field, replace
+from functools import partial
+from typing import Any, Callable
+
+import pandas as pd
+
+from equity_curves import create_curve_store
+from grid_runner import run_grid
+from profiling import add_profile_arguments
+from result_store import ResultScope, ResultStore, data_fingerprint, store_path_for
+from tpe_search import tpe_search
+
+
+@dataclass
+class Param:
+    name: str  # Config のフィールド名
+    values: list
+    # 例: when={"use_be": True}。条件を満たさないときは default に固定して探索しない
+    when: dict[str, Any] = field(default_factory=dict)
+    default: Any = None
+
+    def active(self, assigned: dict[str, Any]) -> bool:
+        for key, cond in self.when.items():
+            value = assigned.get(key)
+            if isinstance(cond, (list, tuple, set)):
+                if value not in cond:
+                    return False
+            elif value != cond:
+                return False
+        return True
+
+
+class SearchSpace:
+    def __init__(self, params: list[Param]) -> None:
+        names = [p.name for p in params]
+        if len(set(names)) != len(names):
+            raise ValueError("パラメータ名が重複しています")
+        for i, p in enumerate(params):
+            unknown = [k for k in p.when if k not in names[:i]]
+            if unknown:
+                raise ValueError(f"{p.name} の条件は先に定義したパラメータのみ参照できます: {unknown}")
+            if not p.values:
+                raise ValueError(f"{p.name} の候補値が空です")
+        self.params = params
+
+    def assignments(self) -> list[dict[str, Any]]:
+        out: list[dict[str, Any]] = [{}]
+        for p in self.params:
+            nxt = []
+            for assigned in out:
+                if p.active(assigned):
+                    nxt.extend({**assigned, p.name: v} for v in p.values)
+                else:
+                    default = p.default if p.default is not None else p.values[0]
+                    nxt.append({**assigned, p.name: default})
+            out = nxt
+
+        # 同じ値の組み合わせ（候補値の重複など）は1つにまとめる
+        seen = set()
+        unique = []
+        for assigned in out:
+            key = tuple(assigned[p.name] for p in self.params)
+            if key not in seen:
+                seen.add(key)
+                unique.append(assigned)
+        return unique
+
+    def configs(self, base: Any) -> list:
+        return [replace(base, **assigned) for assigned in self.assignments()]
+
+    def full_product_size(self) -> int:
+        return math.prod(len(p.values) for p in self.params)
+
+
+class _Indexed:
+    # run_grid は成績なしの行を落とすので、設定の通し番号を行に付けて対応を取る
+    def __init__(self, evaluate: Callable, batch: bool) -> None:
+        self.evaluate = evaluate
+        self.batch = batch
+
+    def __call__(self, df: pd.DataFrame, items):
+        if self.batch:
+            rows = self.evaluate(df, [cfg for _, cfg in items])
+            return [None if row is None else {**row, "_idx": idx} for (idx, _), row in zip(items, rows)]
+        idx, cfg = items
+        row = self.evaluate(df, cfg)
+        return None if row is None else {**row, "_idx": idx}
+
+
+def successive_halving(
+    df: pd.DataFrame,
+    configs: list,
+    evaluate: Callable,
+    windows: list[tuple[str, str]],
+    keep: float,
+    *,
+    score_col: str = "net",
+    out_path: str | None = None,
+    batch: bool = False,
+    curves: str | None = None,
+    store: ResultScope | None = None,
+    **grid_kwargs,
+) -> pd.DataFrame:
+    # evaluate(df, cfg, start=..., end=...)。windows は短い期間から順に並べ、最後が本番の期間。
+    # curves（評価額曲線の保存先）と store（結果ストア）は最後の期間の評価にだけ渡す
+    candidates = list(configs)
+    for rung, (start, end) in enumerate(windows[:-1]):
+        window_eval = _Indexed(partial(evaluate, start=start, end=end), batch)
+        res = run_grid(df, list(enumerate(candidates)), window_eval, batch=batch, **grid_kwargs)
+        n_keep = max(1, math.ceil(len(candidates) * keep))
+        ranked = [] if res.empty else res.sort_values(score_col, ascending=False, kind="stable")["_idx"].tolist()
+        # 取引なしで行が無い設定は最下位として扱う
+        scored = set(ranked)
+        ranked += [i for i in range(len(candidates)) if i not in scored]
+        survivors = sorted(ranked[:n_keep])
+        print(f"[halving] rung {rung + 1}: {start}..{end} {len(candidates):,} -> {len(survivors):,} 件")
+        candidates = [candidates[i] for i in survivors]
+
+    start, end = windows[-1]
+    final_kwargs = {"curves": curves} if curves is not None else {}
+    final_eval = partial(evaluate, start=start, end=end, **final_kwargs)
+    return run_grid(df, candidates, final_eval, out_path=out_path, batch=batch, store=store, **grid_kwargs)
+
+
+def add_search_arguments(parser: argparse.ArgumentParser, chunk_size: int = 8) -> None:
+    parser.add_argument("--workers", type=int, default=1, help="並列ワーカー数")
+    parser.add_argument("--chunk-size", type=int, default=chunk_size, help="ワーカーへ一度に渡す設定数")
+    parser.add_argument("--progress-interval", type=float, default=1.0, help="進捗表示の間隔(秒)。0で非表示")
+    parser.add_argument("--search", default="grid", choices=["grid", "tpe"], help="grid: 全組み合わせ / tpe: 予算内でベイズ最適化")
+    parser.add_argument("--budget", type=int, default=200, help="tpe の評価回数")
+    parser.add_argument("--seed", type=int, default=None, help="tpe の乱数シード")
+    parser.add_argument("--halving", action="store_true", help="短期間で全設定を評価し、上位のみ全期間で検証する")
+    parser.add_argument("--halving-months", type=int, default=3, help="短期間評価の月数(期間末尾から)")
+    parser.add_argument("--halving-keep", type=float, default=0.25, help="全期間へ進める上位割合")
+    parser.add_argument("--save-curves", default=None, help="全設定の評価額曲線を保存するフォルダ(grid のみ。equity_curves.py で並べ替え・プロット)")
+    parser.add_argument("--curve-step", type=int, default=1, help="--save-curves で保存するバーの間引き幅(N本ごと)")
+    parser.add_argument("--store", default=None, help="結果ストア(.sqlite)のパス(既定: 結果CSVと同じ名前の .sqlite)")
+    parser.add_argument("--no-store", action="store_true", help="結果ストアを使わず全設定を評価し直す")
+    add_profile_arguments(parser)
+
+
+def open_result_store(
+    args: argparse.Namespace, df: pd.DataFrame, start: str, end: str, out_path: str, strategy: str
+) -> ResultScope | None:
+    # strategy は戦略（バックテストと evaluate の行）のバージョン。変えると別の scope になり、既存の行は使わない。
+    # tpe は評価する設定が乱数で変わるのでストアを使わない。--save-curves では曲線を書くため全設定を評価し直す
+    if args.no_store or args.search == "tpe":
+        return None
+    # データの指紋は期間の終わりまでのバーで取る（後ろにバーを追記しても同じ scope のまま）
+    bars = df[df.index <= pd.to_datetime(end, utc=True)]
+    store = ResultStore(args.store or store_path_for(out_path))
+    return store.scope(data_fingerprint(bars), strategy, start, end, reuse=not getattr(args, "save_curves", None))
+
+
+def top_results(
+    res: pd.DataFrame, store: ResultScope | None, k: int, max_dd: float
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # (BEST, SAFE) の上位 k 件。ストアがあれば今回の設定（res と同じ設定）の行を SQL で引く
+    if store is not None:
+        return store.best(k), store.safe(k, max_dd)
+    best = res.sort_values(["net", "pf"], ascending=[False, False])
+    safe = best[(best["net"] > 0) & (best["dd"] <= max_dd)].sort_values(["net", "dd"], ascending=[False, True])
+    return best.head(k), safe.head(k)
+
+
+def run_search(
+    df: pd.DataFrame,
+    space: SearchSpace,
+    base: Any,
+    evaluate: Callable,
+    args: argparse.Namespace,
+    start: str,
+    end: str,
+    out_path: str,
+    max_dd: float | None = None,
+    batch: bool = False,
+    store: ResultScope | None = None,
+) -> pd.DataFrame:
+    grid_kwargs = dict(workers=args.workers, progress_interval=args.progress_interval)
+    if args.search == "tpe" and getattr(args, "save_curves", None):
+        raise ValueError("--save-curves は grid 探索のみ対応しています（tpe は評価する設定が事前に決まらないため）")
+    if args.search == "tpe":
+        # 目的関数は net。SAFE 表と同じ dd 上限を制約として扱う
+        return tpe_search(
+            df,
+            space,
+            base,
+            partial(evaluate, start=start, end=end),
+            args.budget,
+            max_dd=max_dd,
+            seed=args.seed,
+            out_path=out_path,
+            batch=batch,
+            **grid_kwargs,
+        )
+
+    configs = space.configs(base)
+    grid_kwargs["chunk_size"] = args.chunk_size
+    curves = None
+    if getattr(args, "save_curves", None):
+        if "curves" not in inspect.signature(evaluate).parameters:
+            raise ValueError("この最適化は --save-curves に対応していません")
+        # 行列の行は configs の順、列は評価期間のバー（run_backtest と同じ start <= t <= end）
+        period = df.index[(df.index >= pd.to_datetime(start, utc=True)) & (df.index <= pd.to_datetime(end, utc=True))]
+        curves = str(create_curve_store(args.save_curves, period, configs, args.curve_step))
+    if args.halving:
+        short_start = (pd.Timestamp(end) - pd.DateOffset(months=args.halving_months)).strftime("%Y-%m-%d")
+        windows = [(max(start, short_start), end), (start, end)]
+        return successive_halving(
+            df,
+            configs,
+            evaluate,
+            windows,
+            args.halving_keep,
+            out_path=out_path,
+            batch=batch,
+            curves=curves,
+            store=store,
+            **grid_kwargs,
+        )
+    curve_kwargs = {"curves": curves} if curves is not None else {}
+    grid_eval = partial(evaluate, start=start, end=end, **curve_kwargs)
+    return run_grid(df, configs, grid_eval, out_path=out_path, batch=batch, store=store, **grid_kwargs)
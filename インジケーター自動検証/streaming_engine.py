@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from backtest_heikin_ashi_ma_touch_5m import (
+    TRADE_REASONS,
+    Config,
+    HeikinAshiState,
+    add_indicators,
+    heikin_ashi_frame,
+    infer_pip_unit,
+    run_backtest,
+)
+from bar_store import load_bars
+
+# 1バーごとに定数時間で更新する指標の状態。いずれも pandas の計算手順をそのままなぞり、
+# バッチ版（ewm / rolling / max(axis=1)）とビット単位で同じ値を返す
+
+
+class EmaState:
+    # Series.ewm(alpha=... or span=..., adjust=False).mean() と同じ更新式
+    def __init__(self, alpha: float | None = None, span: float | None = None) -> None:
+        com = (span - 1) / 2 if span is not None else (1 - alpha) / alpha
+        alpha = 1.0 / (1.0 + com)
+        self.old_wt_factor = 1.0 - alpha
+        self.new_wt = alpha
+        self.old_wt = 1.0
+        self.weighted = math.nan
+        self.nobs = 0
+        self.started = False
+
+    def update(self, value: float) -> float:
+        is_observation = value == value
+        if not self.started:
+            self.started = True
+            self.weighted = value
+            self.nobs = int(is_observation)
+        else:
+            self.nobs += is_observation
+            if self.weighted == self.weighted:
+                self.old_wt *= self.old_wt_factor
+                if is_observation:
+                    # 定数列で丸め誤差が出ないよう、同じ値なら更新しない（pandas と同じ）
+                    if self.weighted != value:
+                        self.weighted = self.old_wt * self.weighted + self.new_wt * value
+                        self.weighted /= self.old_wt + self.new_wt
+                    self.old_wt = 1.0
+            elif is_observation:
+                self.weighted = value
+        return self.weighted if self.nobs >= 1 else math.nan
+
+
+class SmaState:
+    # Series.rolling(length).mean() と同じ Kahan 補正付きの加算・減算（窓はリングバッファ）
+    def __init__(self, length: int) -> None:
+        self.length = length
+        self.buffer = [math.nan] * length
+        self.pos = 0
+        self.count = 0
+        self.nobs = 0
+        self.neg_ct = 0
+        self.sum_x = 0.0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+        self.same_count = 0
+        self.prev_value = math.nan
+
+    def update(self, value: float) -> float:
+        if self.count == 0:
+            self.prev_value = value
+        if self.count >= self.length:
+            old = self.buffer[self.pos]
+            if old == old:
+                self.nobs -= 1
+                y = -old - self.comp_remove
+                t = self.sum_x + y
+                self.comp_remove = t - self.sum_x - y
+                self.sum_x = t
+                if math.copysign(1.0, old) < 0:
+                    self.neg_ct -= 1
+
+        if value == value:
+            self.nobs += 1
+            y = value - self.comp_add
+            t = self.sum_x + y
+            self.comp_add = t - self.sum_x - y
+            self.sum_x = t
+            if math.copysign(1.0, value) < 0:
+                self.neg_ct += 1
+            self.same_count = self.same_count + 1 if value == self.prev_value else 1
+            self.prev_value = value
+
+        self.buffer[self.pos] = value
+        self.pos = (self.pos + 1) % self.length
+        self.count += 1
+
+        if self.nobs < self.length or self.nobs == 0:
+            return math.nan
+        if self.same_count >= self.nobs:
+            return self.prev_value
+        result = self.sum_x / self.nobs
+        if self.neg_ct == 0 and result < 0:
+            return 0.0
+        if self.neg_ct == self.nobs and result > 0:
+            return 0.0
+        return result
+
+
+def _nanmax(*values: float) -> float:
+    valid = [v for v in values if v == v]
+    return max(valid) if valid else math.nan
+
+
+def _fmax(a: float, b: float) -> float:
+    if a != a:
+        return b
+    if b != b:
+        return a
+    return a if a >= b else b
+
+
+def _fmin(a: float, b: float) -> float:
+    if a != a:
+        return b
+    if b != b:
+        return a
+    return a if a <= b else b
+
+
+class SupertrendState:
+    # RMA ベースの ATR と上下バンド・方向（calc_supertrend と同じ漸化式）
+    def __init__(self, period: int, factor: float) -> None:
+        self.factor = factor
+        self.atr = EmaState(alpha=1 / period)
+        self.prev_close = math.nan
+        self.final_upper = math.nan
+        self.final_lower = math.nan
+        self.direction = math.nan
+        self.count = 0
+
+    def update(self, high: float, low: float, close: float) -> tuple[float, float]:
+        prev_close = self.prev_close
+        tr = _nanmax(abs(high - low), abs(high - prev_close), abs(low - prev_close))
+        atr = self.atr.update(tr)
+        hl2 = (high + low) / 2.0
+        upper = hl2 + self.factor * atr
+        lower = hl2 - self.factor * atr
+
+        if self.count == 0:
+            self.final_upper = upper
+            self.final_lower = lower
+            self.direction = -1.0
+        else:
+            if upper < self.final_upper or prev_close > self.final_upper:
+                self.final_upper = upper
+            if lower > self.final_lower or prev_close < self.final_lower:
+                self.final_lower = lower
+            if self.direction == -1.0:
+                self.direction = -1.0 if close >= self.final_lower else 1.0
+            else:
+                self.direction = 1.0 if close <= self.final_upper else -1.0
+
+        self.prev_close = close
+        self.count += 1
+        st = self.final_lower if self.direction == -1.0 else self.final_upper
+        return st, self.direction
+
+
+@dataclass
+class Fill:
+    # 決済済みトレード1件（trades_to_frame の1行と同じ列）
+    time: Any
+    side: str
+    entry: float
+    exit: float
+    pnl: float
+    reason: str
+
+
+@dataclass
+class BarEvent:
+    time: Any
+    active: bool  # 指標のウォームアップが終わり、売買判定を行ったバーか
+    buy_signal: bool = False
+    sell_signal: bool = False
+    fills: list[Fill] = field(default_factory=list)
+    position: int = 0
+    equity: float = math.nan  # 含み損益込みの評価額
+
+
+class StreamingEngine:
+    # 5分足を1本ずつ受け取り、run_backtest と同じシグナル・約定を定数時間で出す
+    def __init__(self, cfg: Config, pip_unit: float) -> None:
+        self.cfg = cfg
+        self.touch_margin = cfg.touch_margin_pips * pip_unit
+        self.ha = HeikinAshiState()
+        if cfg.ma_type.upper() == "EMA":
+            self.ma_fast = EmaState(span=cfg.ma_fast_len)
+            self.ma_slow = EmaState(span=cfg.ma_slow_len)
+        else:
+            self.ma_fast = SmaState(cfg.ma_fast_len)
+            self.ma_slow = SmaState(cfg.ma_slow_len)
+        self.supertrend = SupertrendState(cfg.st_period, cfg.st_factor)
+
+        self.equity = cfg.initial_capital
+        self.position = 0
+        self.units = 0.0
+        self.entry_price = math.nan
+        self.touched_ma_long = False
+        self.touched_ma_short = False
+
+        # 直前の有効バー（run_backtest の dropna 後の1本前に相当）
+        self.prev_mf = math.nan
+        self.prev_ms = math.nan
+        self.last_time: Any = None
+        self.last_close = math.nan
+        self.valid_bars = 0
+
+    def _close(self, t: Any, side: int, exit_price: float, reason: int) -> Fill:
+        if side == 1:
+            pnl = (exit_price - self.entry_price) * self.units
+        else:
+            pnl = (self.entry_price - exit_price) * self.units
+        self.equity += pnl
+        return Fill(t, "LONG" if side == 1 else "SHORT", self.entry_price, exit_price, pnl, TRADE_REASONS[reason])
+
+    def _open(self, c: float, side: int) -> None:
+        notional = self.equity * (self.cfg.qty_pct / 100)
+        self.units = notional / c
+        self.entry_price = c
+        self.position = side
+
+    def _flatten(self) -> None:
+        self.position = 0
+        self.units = 0.0
+        self.entry_price = math.nan
+
+    def on_bar(self, t: Any, open_: float, high: float, low: float, close: float) -> BarEvent:
+        # Heikin Ashi
+        ha_close = (open_ + high + low + close) / 4.0
+        if self.ha.count == 0:
+            ha_open = (open_ + close) / 2.0
+        else:
+            ha_open = (self.ha.ha_open + self.ha.ha_close) / 2.0
+        self.ha = HeikinAshiState(ha_open, ha_close, self.ha.count + 1)
+        o = ha_open
+        h = _fmax(_fmax(high, ha_open), ha_close)
+        lo = _fmin(_fmin(low, ha_open), ha_close)
+        c = ha_close
+
+        mf = self.ma_fast.update(c)
+        ms = self.ma_slow.update(c)
+        st, st_dir = self.supertrend.update(h, lo, c)
+
+        if any(v != v for v in (o, h, lo, c, mf, ms, st, st_dir)):
+            return BarEvent(t, False, position=self.position)
+
+        self.valid_bars += 1
+        prev_mf, prev_ms = self.prev_mf, self.prev_ms
+        self.prev_mf, self.prev_ms = mf, ms
+        self.last_time, self.last_close = t, c
+        if self.valid_bars == 1:
+            return BarEvent(t, False, position=self.position)
+
+        # 以下は _backtest_loop の1バー分と同じ判定順
+        gc = mf > ms
+        dc = mf < ms
+        if mf > ms and prev_mf <= prev_ms:
+            self.touched_ma_long = False
+        if mf < ms and prev_mf >= prev_ms:
+            self.touched_ma_short = False
+
+        pos_sign = self.position
+        margin = self.touch_margin
+        if gc and pos_sign <= 0:
+            if lo <= (mf + margin) or lo <= (ms + margin):
+                self.touched_ma_long = True
+            if lo < ms:
+                self.touched_ma_long = False
+        if dc and pos_sign >= 0:
+            if h >= (mf - margin) or h >= (ms - margin):
+                self.touched_ma_short = True
+            if h > ms:
+                self.touched_ma_short = False
+
+        buy_signal = pos_sign <= 0 and gc and self.touched_ma_long and c > o
+        sell_signal = pos_sign >= 0 and dc and self.touched_ma_short and c < o
+
+        exit_long_tp = pos_sign == 1 and mf < prev_mf and not buy_signal
+        exit_long_sl = pos_sign == 1 and st_dir > 0 and not buy_signal
+        exit_short_tp = pos_sign == -1 and mf > prev_mf and not sell_signal
+        exit_short_sl = pos_sign == -1 and st_dir < 0 and not sell_signal
+
+        fills = []
+        if buy_signal:
+            if self.position == -1:
+                fills.append(self._close(t, -1, c, 0))  # ReverseToLong
+            self._open(c, 1)
+            self.touched_ma_long = False
+        elif (exit_long_tp or exit_long_sl) and self.position == 1:
+            fills.append(self._close(t, 1, c, 1 if exit_long_tp else 2))
+            self._flatten()
+
+        if sell_signal:
+            if self.position == 1:
+                fills.append(self._close(t, 1, c, 3))  # ReverseToShort
+            self._open(c, -1)
+            self.touched_ma_short = False
+        elif (exit_short_tp or exit_short_sl) and self.position == -1:
+            fills.append(self._close(t, -1, c, 4 if exit_short_tp else 2))
+            self._flatten()
+
+        mark_to_market = self.equity
+        if self.position == 1:
+            mark_to_market += (c - self.entry_price) * self.units
+        elif self.position == -1:
+            mark_to_market += (self.entry_price - c) * self.units
+        return BarEvent(t, True, buy_signal, sell_signal, fills, self.position, mark_to_market)
+
+    def finish(self) -> Fill | None:
+        # バックテスト終了時の強制決済（FinalClose）
+        if self.position == 0 or self.valid_bars == 0:
+            return None
+        fill = self._close(self.last_time, self.position, self.last_close, 5)
+        self._flatten()
+        return fill
+
+
+def replay(df_raw: pd.DataFrame, cfg: Config, pip_unit: float) -> tuple[list[Fill], list[float], np.ndarray, float]:
+    engine = StreamingEngine(cfg, pip_unit)
+    fills: list[Fill] = []
+    curve: list[float] = []
+    columns = [df_raw[c].to_numpy(dtype=np.float64).tolist() for c in ("open", "high", "low", "close")]
+    latency = np.empty(len(df_raw), dtype=np.int64)
+    clock = time.perf_counter_ns
+    for i, (t, o, h, lo, c) in enumerate(zip(df_raw.index, *columns)):
+        t0 = clock()
+        event = engine.on_bar(t, o, h, lo, c)
+        latency[i] = clock() - t0
+        fills.extend(event.fills)
+        if event.active:
+            curve.append(event.equity)
+    final = engine.finish()
+    if final is not None:
+        fills.append(final)
+    return fills, curve, latency, engine.equity
+
+
+def check_parity(df_raw: pd.DataFrame, cfg: Config) -> dict:
+    # 同じ期間を run_backtest と1本ずつの再生で計算し、約定と最終資産が一致することを確かめる
+    result, trades = run_backtest(df_raw, cfg, None, None)
+    data = add_indicators(heikin_ashi_frame(df_raw), cfg).dropna()
+    pip_unit = infer_pip_unit(data["close"].values)
+    fills, curve, latency, equity = replay(df_raw, cfg, pip_unit)
+
+    stream = pd.DataFrame([vars(f) for f in fills], columns=list(trades.columns))
+    pd.testing.assert_frame_equal(stream, trades, check_exact=True, check_dtype=False)
+    # python -O でも確認が消えないよう assert 文ではなく明示的に例外を出す
+    if equity != result["final_equity"]:
+        raise AssertionError(f"最終資産が一致しません: stream={equity!r} run_backtest={result['final_equity']!r}")
+    curve = np.asarray(curve)
+    dd = float((np.maximum.accumulate(curve) - curve).max()) if len(curve) else 0.0
+    if dd != result["max_drawdown"]:
+        raise AssertionError(f"最大ドローダウンが一致しません: stream={dd!r} run_backtest={result['max_drawdown']!r}")
+    return {"bars": len(df_raw), "trades": len(fills), "final_equity": equity, "latency_ns": latency}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ストリーミングエンジンを過去データで再生し、run_backtest との一致とバー毎の処理時間を確認する")
+    parser.add_argument("--csv", default="data/usdjpy_5m.csv", help="5分足OHLCV CSV またはバーストア(.bars)")
+    parser.add_argument("--start", default=None, help="開始日時(例: 2025-01-01)")
+    parser.add_argument("--end", default=None, help="終了日時(例: 2026-02-28)")
+    parser.add_argument("--ma-type", default="SMA", choices=["SMA", "EMA"], help="MAタイプ")
+    args = parser.parse_args()
+
+    df = load_bars(args.csv, args.start, args.end)
+
+    stats = check_parity(df, Config(ma_type=args.ma_type))
+    lat = stats["latency_ns"] / 1000.0
+    print(f"[OK] parity: bars={stats['bars']:,} trades={stats['trades']:,} final_equity={stats['final_equity']:.2f}")
+    p50, p90, p99, p999 = np.percentile(lat, [50, 90, 99, 99.9]) if len(lat) else (np.nan,) * 4
+    print(f"on_bar latency(us): p50={p50:.2f} p90={p90:.2f} p99={p99:.2f} p99.9={p999:.2f} max={lat.max() if len(lat) else np.nan:.2f}")
+
+
+if __name__ == "__main__":
+    main()
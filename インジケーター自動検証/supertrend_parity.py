@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from backtest_heikin_ashi_ma_touch_5m import _supertrend_loop_jit, calc_atr, calc_supertrend, heikin_ashi_frame, supertrend_kernel
+from benchmark import SIZES, parse_sizes, synthetic_bars
+
+# supertrend_kernel（numba 版と Python 版）を、置き換える前の .iloc ループ版 calc_supertrend とビット単位で比べ、各件数で計時する。
+# .iloc 版は 100k 本で約30秒かかる（10M 本なら約1時間）ので、--iloc-max-bars を超える件数では比較・計時しない
+ILOC_MAX_BARS = 100_000
+
+
+def supertrend_iloc(df: pd.DataFrame, period: int, factor: float) -> tuple[pd.Series, pd.Series]:
+    # 置き換える前の calc_supertrend そのまま（比較の基準）
+    atr = calc_atr(df, period)
+    hl2 = (df["high"] + df["low"]) / 2.0
+    upper = hl2 + factor * atr
+    lower = hl2 - factor * atr
+
+    final_upper = upper.copy()
+    final_lower = lower.copy()
+    direction = pd.Series(index=df.index, dtype="int64")
+    st = pd.Series(index=df.index, dtype="float64")
+
+    direction.iloc[0] = -1
+    st.iloc[0] = lower.iloc[0]
+
+    for i in range(1, len(df)):
+        if upper.iloc[i] < final_upper.iloc[i - 1] or df["close"].iloc[i - 1] > final_upper.iloc[i - 1]:
+            final_upper.iloc[i] = upper.iloc[i]
+        else:
+            final_upper.iloc[i] = final_upper.iloc[i - 1]
+
+        if lower.iloc[i] > final_lower.iloc[i - 1] or df["close"].iloc[i - 1] < final_lower.iloc[i - 1]:
+            final_lower.iloc[i] = lower.iloc[i]
+        else:
+            final_lower.iloc[i] = final_lower.iloc[i - 1]
+
+        prev_dir = direction.iloc[i - 1]
+        if prev_dir == -1:
+            direction.iloc[i] = -1 if df["close"].iloc[i] >= final_lower.iloc[i] else 1
+        else:
+            direction.iloc[i] = 1 if df["close"].iloc[i] <= final_upper.iloc[i] else -1
+
+        st.iloc[i] = final_lower.iloc[i] if direction.iloc[i] == -1 else final_upper.iloc[i]
+
+    return st, direction
+
+
+def _assert_bits(name: str, got: np.ndarray, expected: np.ndarray) -> None:
+    # NaN も含めてビット単位で一致すること（python -O でも消えないよう assert 文は使わない）
+    if not got.dtype == expected.dtype == np.float64:
+        raise AssertionError(f"{name}: dtype が違います（{got.dtype} != {expected.dtype}）")
+    diff = np.flatnonzero(got.view(np.int64) != expected.view(np.int64))
+    if len(diff):
+        raise AssertionError(f"{name}: {len(diff):,} 本が不一致（最初は {diff[0]} 本目: {got[diff[0]]!r} != {expected[diff[0]]!r}）")
+
+
+def _timed(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t0
+
+
+def check_parity(df_raw: pd.DataFrame, period: int, factor: float, iloc: bool = True) -> dict:
+    # 平均足の上で、numba 版・Python 版・(iloc=True なら) .iloc 版の Supertrend が一致することを確かめる
+    data = heikin_ashi_frame(df_raw)
+    atr = calc_atr(data, period)
+    hl2 = (data["high"] + data["low"]) / 2.0
+    arrays = ((hl2 + factor * atr).to_numpy(), (hl2 - factor * atr).to_numpy(), data["close"].to_numpy())
+
+    (st_py, dir_py), py_sec = _timed(lambda: supertrend_kernel(*arrays, jit=False))
+    stats = {"bars": len(data), "python_sec": py_sec, "numba_sec": None, "iloc_sec": None}
+    if _supertrend_loop_jit is not None:
+        supertrend_kernel(*(a[:100] for a in arrays))  # コンパイル（キャッシュ読み込み）を計時に含めない
+        (st_jit, dir_jit), stats["numba_sec"] = _timed(lambda: supertrend_kernel(*arrays))
+        _assert_bits("numba st", st_jit, st_py)
+        _assert_bits("numba direction", dir_jit, dir_py)
+
+    # バックテストが使う calc_supertrend（指標キャッシュ経由）も同じ値を返すこと
+    st, direction = calc_supertrend(data, period, factor)
+    _assert_bits("calc_supertrend st", st.to_numpy(), st_py)
+    _assert_bits("calc_supertrend direction", direction.to_numpy(), dir_py)
+
+    if iloc:
+        (st_ref, dir_ref), stats["iloc_sec"] = _timed(lambda: supertrend_iloc(data, period, factor))
+        pd.testing.assert_series_equal(st, st_ref, check_exact=True)
+        pd.testing.assert_series_equal(direction, dir_ref, check_exact=True)
+        _assert_bits("iloc st", st_py, st_ref.to_numpy())
+        _assert_bits("iloc direction", dir_py, dir_ref.to_numpy())
+    stats["flips"] = int((np.diff(dir_py) != 0).sum())
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Supertrend の配列カーネルと旧 .iloc 版の一致(ビット単位)と処理時間を合成データで確認する")
+    parser.add_argument("--sizes", default="100k,1M,10M", help=f"足数(カンマ区切り: {','.join(SIZES)})")
+    parser.add_argument("--seed", type=int, default=0, help="合成データの乱数シード")
+    parser.add_argument("--period", type=int, default=10, help="Supertrend の ATR 期間")
+    parser.add_argument("--factor", type=float, default=3.0, help="Supertrend の倍率")
+    parser.add_argument("--iloc-max-bars", type=int, default=ILOC_MAX_BARS, help="この足数までだけ .iloc 版と比べる")
+    args = parser.parse_args()
+
+    if _supertrend_loop_jit is None:
+        print("numba が無いので Python 版だけを比べます")
+    for size in parse_sizes(args.sizes):
+        n = SIZES[size]
+        stats = check_parity(synthetic_bars(n, args.seed), args.period, args.factor, iloc=n <= args.iloc_max_bars)
+        names = [name for name in ("numba", "python", "iloc") if stats[f"{name}_sec"] is not None]
+        times = " ".join(f"{name}={stats[f'{name}_sec']:.3f}s" for name in names)
+        print(f"[OK] parity({'/'.join(names)}): bars={stats['bars']:,} flips={stats['flips']:,} {times}")
+
+
+if __name__ == "__main__":
+    main()
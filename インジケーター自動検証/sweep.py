@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable
+
+import pandas as pd
+
+from bar_store import load_bars
+from grid_runner import GridJob, run_grids
+from profiling import add_profile_arguments, finish_profile, start_profile
+from result_store import ResultStore, data_fingerprint, store_path_for
+from search_space import Param, SearchSpace, top_results
+
+# 仕様ファイル(JSON)に並べた (通貨ペア, 時間足, データ, 戦略, グリッド, 制約) のジョブを1つのワーカープールでまとめて評価する。
+# データは同じパスなら1回だけ読み込んで共有し、全ジョブの行を1つの表に、BEST/SAFE はジョブごとに出す
+
+# local_backtest の Config のフィールド -> 結果の列名（グリッドに入れたフィールドだけ列にする）
+LOCAL_COLUMNS = {
+    "sl_mult": "sl",
+    "tp_mult": "tp",
+    "use_be": "be",
+    "be_trigger": "be_tr",
+    "use_session": "session",
+    "use_cooldown": "cooldown",
+    "cooldown_bars": "cd_bars",
+    "use_macd_dir": "macd_dir",
+    "max_dev_atr": "max_dev_atr",
+}
+METRIC_COLUMNS = ("net", "net_pct", "dd", "dd_pct", "dd_bars", "pf", "wr", "trades")
+LOCAL_VERSION = 1  # local_backtest の評価や列を変えたら上げる（結果ストアの既存行を使わなくなる）
+
+
+def evaluate_local(
+    df: pd.DataFrame, cfg, start: str | None = None, end: str | None = None, columns: tuple[str, ...] = ()
+) -> dict | None:
+    from local_backtest import run_backtest
+
+    result, _ = run_backtest(df, cfg, start, end)
+    if result["total_trades"] == 0:
+        return None
+    return {
+        **{LOCAL_COLUMNS.get(name, name): getattr(cfg, name) for name in columns},
+        "net": round(result["net_pnl"], 0),
+        "net_pct": round(result["net_pct"], 3),
+        "dd": round(result["max_drawdown"], 0),
+        "pf": round(float(result["profit_factor"]) if pd.notna(result["profit_factor"]) else 999.0, 3),
+        "wr": round(result["win_rate"], 2),
+        "trades": int(result["total_trades"]),
+    }
+
+
+@dataclass
+class Strategy:
+    # base(job) -> 基準の Config、evaluate(job) -> evaluate(df, cfg or configs, start=, end=)、version(job) -> ストア用のバージョン
+    base: Callable[[dict], Any]
+    evaluate: Callable[[dict], Callable]
+    version: Callable[[dict], str]
+    batch: bool = False
+
+
+def _local_base(job: dict):
+    from local_backtest import Config, apply_preset
+
+    return apply_preset(Config(), job["preset"]) if job.get("preset") else Config()
+
+
+def _ha_touch_base(job: dict):
+    from backtest_heikin_ashi_ma_touch_5m import Config
+
+    return Config()
+
+
+def _ha_touch_evaluate(job: dict) -> Callable:
+    from optimize_ha_touch_5m import evaluate
+
+    return evaluate
+
+
+def _ha_touch_version(job: dict) -> str:
+    from optimize_ha_touch_5m import STRATEGY
+
+    return STRATEGY
+
+
+STRATEGIES = {
+    "local_backtest": Strategy(
+        base=_local_base,
+        evaluate=lambda job: partial(evaluate_local, columns=tuple(job["grid"])),
+        version=lambda job: f"local_backtest/{LOCAL_VERSION}:{','.join(job['grid'])}",
+    ),
+    "ha_touch_5m": Strategy(base=_ha_touch_base, evaluate=_ha_touch_evaluate, version=_ha_touch_version, batch=True),
+}
+
+
+@dataclass
+class SweepJob:
+    name: str
+    symbol: str
+    timeframe: str
+    data: str
+    strategy: str
+    space: SearchSpace
+    start: str | None
+    end: str | None
+    max_dd: float
+    top: int = 10
+    out: str | None = None
+    spec: dict = field(default_factory=dict)
+
+
+def parse_param(name: str, value) -> Param:
+    # [値, ...] か {"values": [...], "when": {...}, "default": 値}
+    if isinstance(value, dict):
+        return Param(name, list(value["values"]), when=value.get("when", {}), default=value.get("default"))
+    return Param(name, list(value))
+
+
+def load_spec(path: str | Path) -> tuple[dict, list[SweepJob]]:
+    spec = json.loads(Path(path).read_text(encoding="utf-8"))
+    jobs = []
+    for job in spec["jobs"]:
+        missing = [k for k in ("name", "symbol", "timeframe", "data", "strategy", "grid", "max_dd") if k not in job]
+        if missing:
+            raise ValueError(f"ジョブ {job.get('name', '?')} に必要な項目がありません: {missing}")
+        if job["strategy"] not in STRATEGIES:
+            raise ValueError(f"未対応の戦略です: {job['strategy']}（{', '.join(STRATEGIES)}）")
+        jobs.append(
+            SweepJob(
+                name=job["name"],
+                symbol=job["symbol"],
+                timeframe=job["timeframe"],
+                data=job["data"],
+                strategy=job["strategy"],
+                space=SearchSpace([parse_param(k, v) for k, v in job["grid"].items()]),
+                start=job.get("start", spec.get("start")),
+                end=job.get("end", spec.get("end")),
+                max_dd=job["max_dd"],
+                top=job.get("top", spec.get("top", 10)),
+                out=job.get("out"),
+                spec=job,
+            )
+        )
+    names = [j.name for j in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("ジョブ名が重複しています")
+    return spec, jobs
+
+
+def check_timeframe(df: pd.DataFrame, timeframe: str, path: str) -> None:
+    # 足の間隔の中央値が時間足と違えば、データの取り違えとして止める
+    if len(df) < 2:
+        return
+    step = pd.Series(df.index[1:] - df.index[:-1]).median()
+    if step != pd.to_timedelta(timeframe):
+        raise ValueError(f"{path} の足の間隔 {step} が時間足 {timeframe} と一致しません")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="仕様ファイルの複数の通貨ペア・時間足のグリッドサーチを1つのプールでまとめて実行する")
+    parser.add_argument("spec", help="スイープ仕様(JSON)。例: sweeps/aggressive.json")
+    parser.add_argument("--jobs", nargs="+", default=None, help="実行するジョブ名(省略時は全ジョブ)")
+    parser.add_argument("--workers", type=int, default=1, help="並列ワーカー数(全ジョブで共有)")
+    parser.add_argument("--chunk-size", type=int, default=8, help="ワーカーへ一度に渡す設定数")
+    parser.add_argument("--progress-interval", type=float, default=1.0, help="進捗表示の間隔(秒)。0で非表示")
+    parser.add_argument("--out", default=None, help="全ジョブをまとめた結果CSV(既定: result_sweep_<仕様名>.csv)")
+    parser.add_argument("--store", default=None, help="結果ストア(.sqlite)のパス(既定: 結果CSVと同じ名前の .sqlite)")
+    parser.add_argument("--no-store", action="store_true", help="結果ストアを使わず全設定を評価し直す")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile(args)
+
+    spec, jobs = load_spec(args.spec)
+    if args.jobs:
+        unknown = sorted(set(args.jobs) - {j.name for j in jobs})
+        if unknown:
+            raise ValueError(f"仕様に無いジョブです: {unknown}")
+        jobs = [j for j in jobs if j.name in args.jobs]
+    out_path = args.out or spec.get("out") or f"result_sweep_{Path(args.spec).stem}.csv"
+
+    # データは同じパスなら1回だけ読む
+    datasets: dict[str, pd.DataFrame] = {}
+    for job in jobs:
+        if job.data not in datasets:
+            datasets[job.data] = load_bars(job.data)
+        check_timeframe(datasets[job.data], job.timeframe, job.data)
+
+    store = None if args.no_store else ResultStore(args.store or store_path_for(out_path))
+    grid_jobs = []
+    for job in jobs:
+        strategy = STRATEGIES[job.strategy]
+        configs = job.space.configs(strategy.base(job.spec))
+        scope = None
+        if store is not None:
+            df = datasets[job.data]
+            bars = df if job.end is None else df[df.index <= pd.to_datetime(job.end, utc=True)]
+            scope = store.scope(data_fingerprint(bars), strategy.version(job.spec), job.start, job.end)
+        evaluate = partial(strategy.evaluate(job.spec), start=job.start, end=job.end)
+        grid_jobs.append(GridJob(job.name, job.data, configs, evaluate, strategy.batch, scope))
+        print(f"[sweep] {job.name}: {job.symbol} {job.timeframe} {job.data} {len(configs):,} 設定")
+
+    results = run_grids(
+        datasets, grid_jobs, workers=args.workers, chunk_size=args.chunk_size, progress_interval=args.progress_interval
+    )
+    finish_profile(args)
+
+    tables = []
+    for job, grid_job, res in zip(jobs, grid_jobs, results):
+        print(f"\n=== {job.name} ({job.symbol} {job.timeframe}) ===")
+        if res.empty:
+            print("No result")
+            continue
+        res = res.sort_values(["net", "pf"], ascending=[False, False])
+        best, safe = top_results(res, grid_job.store, job.top, job.max_dd)
+        print(f"BEST_NET_TOP{job.top}")
+        print(best.to_string(index=False))
+        print(f"\nSAFE_TOP{job.top}(net>0, dd<={job.max_dd})")
+        print("None" if safe.empty else safe.to_string(index=False))
+        if job.out:
+            res.to_csv(job.out, index=False)
+            print(f"Saved: {job.out}")
+        tables.append(res.assign(job=job.name, symbol=job.symbol, timeframe=job.timeframe))
+
+    if not tables:
+        return
+    # ジョブ・グリッドの列を先に、成績の列を後ろに（グリッドに無い列は空欄）
+    combined = pd.concat(tables, ignore_index=True)
+    lead = ["job", "symbol", "timeframe"]
+    params = [c for c in combined.columns if c not in lead and c not in METRIC_COLUMNS]
+    combined = combined[lead + params + [c for c in combined.columns if c in METRIC_COLUMNS]]
+    combined.to_csv(out_path, index=False)
+    print(f"\nSaved: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
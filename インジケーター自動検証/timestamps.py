@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import re
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+try:
+    from numba import njit
+except ImportError:  # numba は任意依存。無ければ NumPy の列演算で読む
+    njit = None
+
+# 日時列のパース（バックテストの parse_datetime と tick 変換の parse_timestamp で共通）。
+# 先頭〜末尾から拾った数十行で形式を決め、列全体はその形式だけでパースする（1要素ずつの推測はしない）
+DATETIME_FORMATS = [
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S%z",  # 足のCSV（2025-01-01 00:00:00+00:00）
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%d %H:%M:%S.%f%z",
+    "%Y-%m-%dT%H:%M:%S.%f%z",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d %H:%M:%S.%f UTC",  # BigQuery などの書き出し（2024-01-01 00:00:00 UTC）
+    "%Y-%m-%d %H:%M:%S UTC",
+    "%Y-%m-%d %H:%M UTC",
+    "%Y-%m-%dT%H:%M:%S.%f UTC",
+    "%Y-%m-%dT%H:%M:%S UTC",
+    "%Y.%m.%d %H:%M:%S.%f",  # OANDA
+    "%Y.%m.%d %H:%M:%S",
+    "%Y.%m.%d %H:%M",
+    "%Y/%m/%d %H:%M:%S.%f",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y/%m/%d %H:%M",
+    "%Y%m%d %H%M%S",  # %S%f は %S を1桁にしても合ってしまうので、ミリ秒なしを先に試す
+    "%Y%m%d %H%M%S%f",
+    "%Y%m%d %H:%M:%S.%f",
+    "%Y%m%d %H:%M:%S",
+    "%Y-%m-%d",
+    "%Y.%m.%d",
+    "%Y/%m/%d",
+    "%Y%m%d",
+    "ISO8601",  # タイムゾーン付きなど上の固定形式に合わないもの（pandas の ISO パーサ）
+]
+# 上のどれにも合わない列は、従来の pd.to_datetime と同じく先頭の値から pandas が推測した形式1つで読む
+# （01/02/2024 00:00 は月/日、13/02/2024 は日/月、01 Jan 2024 など）
+DATE_FORMATS = ["%Y-%m-%d", "%Y.%m.%d", "%Y/%m/%d", "%Y%m%d", "ISO8601"]
+TIME_FORMATS = ["%H:%M:%S.%f", "%H:%M:%S", "%H:%M", "%H%M%S", "%H%M%S%f"]
+
+_SAMPLE = 64
+_NUMBER = re.compile(r"^\s*-?\d+(\.\d*)?\s*$")
+_FIELD_WIDTH = {"Y": 4, "m": 2, "d": 2, "H": 2, "M": 2, "S": 2, "+": 1, "h": 2, "i": 2}
+_OFFSET_TOKENS = ["%+", "%h", ":", "%i"]  # %z は "+09:00" の形（符号・時・分）だけを固定幅で読む
+_NAT = np.iinfo(np.int64).min
+_DAY_NS = 86_400 * 10**9
+_EPOCH_SCALE = {"s": 10**9, "ms": 10**6, "us": 10**3, "ns": 1}
+_PANDAS_TIME_BASE = pd.Timestamp("1900-01-01").value  # 時刻だけの形式を pandas で読むと 1900-01-01 になる
+
+
+@dataclass(frozen=True)
+class TimestampFormat:
+    kind: str  # "epoch"（spec は s/ms/us/ns）または "format"（spec は strptime 形式か ISO8601）
+    spec: str
+
+    def __str__(self) -> str:
+        return f"UNIX時刻({self.spec})" if self.kind == "epoch" else self.spec
+
+
+def epoch_unit(values: np.ndarray) -> str:
+    # 桁数で秒・ミリ秒・マイクロ秒・ナノ秒を見分ける
+    finite = values[np.isfinite(values)] if values.dtype.kind == "f" else values
+    max_abs = np.abs(finite).max() if len(finite) else 0
+    if max_abs > 1e17:
+        return "ns"
+    if max_abs > 1e14:
+        return "us"
+    return "ms" if max_abs > 1e11 else "s"
+
+
+def _as_values(values) -> np.ndarray:
+    # pandas 3 の str 型なども object の ndarray にそろえる（欠損は None）
+    if isinstance(values, (pd.Series, pd.Index)):
+        if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+            return values.to_numpy()
+        if values.dtype == object:
+            return values.to_numpy()
+        return values.to_numpy(dtype=object, na_value=None)
+    return np.asarray(values)
+
+
+def _is_number_array(values: np.ndarray) -> bool:
+    return values.dtype.kind in "iuf"
+
+
+def _null_mask(values: np.ndarray) -> np.ndarray:
+    if _is_number_array(values):
+        return np.isnan(values) if values.dtype.kind == "f" else np.zeros(len(values), dtype=bool)
+    return pd.isna(values) | (values == "")
+
+
+def _sample(values: np.ndarray) -> np.ndarray:
+    # 先頭から末尾まで等間隔に拾う。拾った所が欠損ばかりなら欠損以外から取り直す
+    pos = np.unique(np.linspace(0, len(values) - 1, min(len(values), _SAMPLE)).astype(np.int64))
+    pos = pos[~_null_mask(values[pos])]
+    if not len(pos):
+        pos = np.flatnonzero(~_null_mask(values))[:_SAMPLE]
+    return values[pos]
+
+
+def detect_format(values, candidates: list[str] = DATETIME_FORMATS, guess: bool = True) -> TimestampFormat:
+    values = _as_values(values)
+    if _is_number_array(values):
+        return TimestampFormat("epoch", epoch_unit(values))
+    sample = _sample(values)
+    if not len(sample):
+        raise ValueError("日時列が空です")
+    sample = np.array([str(v).strip() for v in sample], dtype=object)
+
+    best, best_count = None, 0
+    for fmt in candidates:
+        count = int(pd.to_datetime(sample, format=fmt, errors="coerce", utc=True).notna().sum())
+        if count == len(sample):
+            return TimestampFormat("format", fmt)
+        if count > best_count:
+            best, best_count = fmt, count
+    if all(_NUMBER.match(v) for v in sample):
+        return TimestampFormat("epoch", epoch_unit(pd.to_numeric(sample).astype(np.float64)))
+    # 形式を推測するのは列全体の判定の時だけ。読めなかった行の判定し直し（guess=False）では推測しないので、
+    # 01/02 と 13/02 が混ざる列を月/日と日/月で読み分けることはなく、合わない行は従来どおり NaT になる
+    guessed = guess_datetime_format(sample[0]) if guess else None
+    if guessed is not None and guessed not in candidates:
+        count = int(pd.to_datetime(sample, format=guessed, errors="coerce", utc=True).notna().sum())
+        if count == len(sample):
+            return TimestampFormat("format", guessed)
+        if count > best_count:
+            best, best_count = guessed, count
+    if best is None:
+        raise ValueError(f"日時の形式を判定できませんでした: {sample[0]!r}（対応形式は timestamps.DATETIME_FORMATS と pandas が推測できる形式）")
+    # 一部の行だけ合う形式。合わなかった行は parse 側で形式を判定し直す
+    return TimestampFormat("format", best)
+
+
+def _layout(fmt: str, width: int) -> list[tuple[str, int, int]] | None:
+    # 固定幅の形式なら [(フィールド名か区切り文字, 開始位置, 幅)]。%f の桁数は文字列の長さから決める
+    tokens = []
+    i = 0
+    while i < len(fmt):
+        if fmt[i] == "%":
+            if i + 1 >= len(fmt) or fmt[i + 1] not in "YmdHMSfz":
+                return None
+            tokens += _OFFSET_TOKENS if fmt[i + 1] == "z" else ["%" + fmt[i + 1]]
+            i += 2
+        else:
+            tokens.append(fmt[i])
+            i += 1
+    fixed = sum(_FIELD_WIDTH.get(t[1], 0) if t.startswith("%") else 1 for t in tokens)
+    frac = width - fixed
+    if ("%f" in tokens and not 1 <= frac <= 9) or ("%f" not in tokens and frac != 0):
+        return None
+
+    layout = []
+    pos = 0
+    for t in tokens:
+        n = (frac if t == "%f" else _FIELD_WIDTH[t[1]]) if t.startswith("%") else 1
+        layout.append((t, pos, n))
+        pos += n
+    return layout
+
+
+_CODES = {"Y": 1, "m": 2, "d": 3, "H": 4, "M": 5, "S": 6, "f": 7, "+": 8, "h": 9, "i": 10}
+_DAYS_IN_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], dtype=np.int64)
+
+
+def _days_from_civil(year, month, day):
+    # 1970-01-01 からの日数（グレゴリオ暦。H. Hinnant の days_from_civil）
+    y = year - (month <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    return era * 146097 + yoe * 365 + yoe // 4 - yoe // 100 + doy - 719468
+
+
+def _parse_fixed_loop(mat, kinds, literals, width, has_date, frac_scale, days_in_month, out) -> None:
+    # kinds[k] は k 文字目が入るフィールド（0 は区切り文字で literals[k] と一致すること）
+    fields = np.zeros(11, dtype=np.int64)
+    for i in range(mat.shape[0]):
+        ok = mat[i, width] == 0 and mat[i, width - 1] != 0
+        fields[:] = 0
+        for k in range(width):
+            b = np.int64(mat[i, k])
+            c = kinds[k]
+            if c == 0:
+                if b != literals[k]:
+                    ok = False
+            elif c == 8:
+                fields[8] = 1 if b == 43 else -1
+                if b != 43 and b != 45:
+                    ok = False
+            else:
+                d = b - 48
+                if d < 0 or d > 9:
+                    ok = False
+                fields[c] = fields[c] * 10 + d
+        # 年月日の無い形式（時刻だけ）は 1970-01-01 として組み立てる
+        year = fields[1] if has_date else 1970
+        month = fields[2] if has_date else 1
+        day = fields[3] if has_date else 1
+        hour, minute, second = fields[4], fields[5], fields[6]
+        if ok and (month < 1 or month > 12 or hour > 23 or minute > 59 or second > 59 or fields[9] > 23 or fields[10] > 59):
+            ok = False
+        if ok:
+            leap = year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+            ok = 1 <= day <= days_in_month[month - 1] + (1 if month == 2 and leap else 0)
+        if not ok:
+            out[i] = _NAT
+            continue
+        y = year - 1 if month <= 2 else year
+        era = y // 400
+        yoe = y - era * 400
+        doy = (153 * (month - 3 if month > 2 else month + 9) + 2) // 5 + day - 1
+        days = era * 146097 + yoe * 365 + yoe // 4 - yoe // 100 + doy - 719468
+        # +09:00 の時刻は UTC では9時間前
+        offset = fields[8] * (fields[9] * 60 + fields[10]) * 60
+        out[i] = (((days * 24 + hour) * 60 + minute) * 60 + second - offset) * 1_000_000_000 + fields[7] * frac_scale
+
+
+_parse_fixed_loop_jit = njit(cache=True)(_parse_fixed_loop) if njit is not None else None
+
+
+def _parse_fixed(values: np.ndarray, layout: list[tuple[str, int, int]], width: int) -> np.ndarray:
+    # 文字列をバイト列の行列にして、各桁を整数演算で組み立てる（形式に合わない行は NaT）
+    raw = values.astype(f"S{width + 1}")
+    mat = raw.view(np.uint8).reshape(len(values), width + 1)
+    if _parse_fixed_loop_jit is not None:
+        kinds = np.zeros(width, dtype=np.int64)
+        literals = np.zeros(width, dtype=np.int64)
+        frac_scale = 0
+        for token, pos, n in layout:
+            if token.startswith("%"):
+                kinds[pos : pos + n] = _CODES[token[1]]
+                frac_scale = 10 ** (9 - n) if token == "%f" else frac_scale
+            else:
+                literals[pos] = ord(token)
+        out = np.empty(len(values), dtype=np.int64)
+        _parse_fixed_loop_jit(mat, kinds, literals, width, "%Y" in [t for t, _, _ in layout], frac_scale, _DAYS_IN_MONTH, out)
+        return out
+
+    # numba が無い時は1列ずつ NumPy で計算する
+    ok = (mat[:, width] == 0) & (mat[:, width - 1] != 0)
+    fields = {}
+    for token, pos, n in layout:
+        if not token.startswith("%"):
+            ok &= mat[:, pos] == ord(token)
+            continue
+        if token == "%+":
+            ok &= (mat[:, pos] == ord("+")) | (mat[:, pos] == ord("-"))
+            fields["+"] = (np.where(mat[:, pos] == ord("-"), -1, 1), n)
+            continue
+        value = np.zeros(len(values), dtype=np.int64)
+        for k in range(pos, pos + n):
+            digit = mat[:, k] - np.uint8(48)
+            ok &= digit < 10
+            value *= 10
+            value += digit
+        fields[token[1]] = (value, n)
+
+    def field(key: str, default: int) -> np.ndarray:
+        return fields[key][0] if key in fields else np.full(len(values), default, dtype=np.int64)
+
+    year, month, day = field("Y", 1970), field("m", 1), field("d", 1)
+    hour, minute, second = field("H", 0), field("M", 0), field("S", 0)
+    offset_hour, offset_minute = field("h", 0), field("i", 0)
+    ok &= (month >= 1) & (month <= 12) & (hour < 24) & (minute < 60) & (second < 60)
+    ok &= (offset_hour < 24) & (offset_minute < 60)
+    month = np.clip(month, 1, 12)
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    ok &= (day >= 1) & (day <= _DAYS_IN_MONTH[month - 1] + ((month == 2) & leap))
+
+    offset = field("+", 1) * (offset_hour * 60 + offset_minute) * 60
+    ns = ((_days_from_civil(year, month, day) * 24 + hour) * 60 + minute) * 60 + second - offset
+    ns *= 10**9
+    if "f" in fields:
+        frac, n = fields["f"]
+        ns += frac * 10 ** (9 - n)
+    ns[~ok] = _NAT
+    return ns
+
+
+def _parse_pandas(values: np.ndarray, fmt: str) -> np.ndarray:
+    ts = pd.to_datetime(values, format=fmt, errors="coerce", utc=True)
+    ns = pd.DatetimeIndex(ts).as_unit("ns").asi8.copy()
+    if "%Y" not in fmt and fmt != "ISO8601":
+        ns[ns != _NAT] -= _PANDAS_TIME_BASE
+    return ns
+
+
+def _parse_with(values: np.ndarray, fmt: TimestampFormat) -> np.ndarray:
+    # 判定した1つの形式で列全体を UTC ns にする（読めない行は NaT）
+    if fmt.kind == "epoch":
+        num = values if _is_number_array(values) else pd.to_numeric(values, errors="coerce")
+        scale = _EPOCH_SCALE[fmt.spec]
+        if num.dtype.kind in "iu" and len(num) and np.abs(num).max() < np.iinfo(np.int64).max // scale:
+            # 整数ならそのまま掛け算で ns にする
+            return num.astype(np.int64) * scale
+        return pd.DatetimeIndex(pd.to_datetime(num, unit=fmt.spec, errors="coerce", utc=True)).as_unit("ns").asi8.copy()
+
+    width = len(str(_sample(values)[0]))
+    layout = _layout(fmt.spec, width) if fmt.spec != "ISO8601" else None
+    ns = None
+    if layout is not None:
+        try:
+            ns = _parse_fixed(values, layout, width)
+        except UnicodeEncodeError:
+            pass
+    if ns is None:
+        ns = _parse_pandas(values, fmt.spec)
+    # 幅が違う・前後に空白がある行などだけ、空白を除いて同じ形式で読み直す
+    rest = np.flatnonzero(ns == _NAT)
+    if len(rest):
+        ns[rest] = _parse_pandas(np.array([str(v).strip() for v in values[rest]], dtype=object), fmt.spec)
+    return ns
+
+
+def _parse_values(values: np.ndarray, candidates: list[str]) -> tuple[np.ndarray, str]:
+    # (UTC ns, 判定した形式)。1つ目の形式で読めない行が残ったら、その行だけで形式を判定し直す
+    fmt = detect_format(values, candidates)
+    ns = _parse_with(values, fmt)
+    used = [fmt]
+    todo = np.flatnonzero(ns == _NAT)
+    while len(todo):
+        todo = todo[~_null_mask(values[todo])]
+        if not len(todo):
+            break
+        part = values[todo]
+        try:
+            fmt = detect_format(part, candidates, guess=False)
+        except ValueError:
+            break
+        if fmt in used:
+            break
+        used.append(fmt)
+        ns[todo] = _parse_with(part, fmt)
+        todo = todo[ns[todo] == _NAT]
+    return ns, " / ".join(str(f) for f in used)
+
+
+def _to_index(ns: np.ndarray, name) -> pd.DatetimeIndex:
+    return pd.DatetimeIndex(ns.view("datetime64[ns]"), name=name).tz_localize("UTC")
+
+
+def parse_timestamps(values, name=None) -> tuple[pd.DatetimeIndex, str]:
+    # (UTC の DatetimeIndex, 判定した形式)。読めない行は NaT
+    if name is None and isinstance(values, pd.Series):
+        name = values.name
+    values = _as_values(values)
+    if not len(values):
+        return _to_index(np.empty(0, dtype=np.int64), name), ""
+    ns, fmt = _parse_values(values, DATETIME_FORMATS)
+    return _to_index(ns, name), fmt
+
+
+def _time_of_day_number(values: np.ndarray) -> np.ndarray:
+    # 数値の時刻列は HHMMSS(.fff) とみなす
+    v = values.astype(np.float64)
+    hour, rest = np.divmod(v, 10_000)
+    minute, second = np.divmod(rest, 100)
+    ns = np.round(((hour * 60 + minute) * 60 + second) * 1e9)
+    bad = ~np.isfinite(v) | (v < 0) | (hour >= 24) | (minute >= 60) | (second >= 60)
+    ns = np.where(bad, 0, ns).astype(np.int64)
+    ns[bad] = _NAT
+    return ns
+
+
+def parse_date_time(date, time_of_day, name=None) -> tuple[pd.DatetimeIndex, str]:
+    # 日付列と時刻列を文字列で結合せずに、別々に読んで足し合わせる。日付は種類が少ないので重複を除いてから読む
+    codes, uniques = pd.factorize(pd.Series(date), use_na_sentinel=True)
+    uniq = _as_values(pd.Index(uniques))
+    if _is_number_array(uniq):
+        uniq = np.array([str(int(v)) for v in uniq], dtype=object)
+    if len(uniq):
+        day_ns, date_fmt = _parse_values(uniq, DATE_FORMATS)
+    else:
+        day_ns, date_fmt = np.empty(0, dtype=np.int64), ""
+    day_ns = np.append(day_ns, _NAT)[codes]  # 欠損（-1）は末尾の NaT を指す
+
+    tod = _as_values(time_of_day)
+    if _is_number_array(tod):
+        tod_ns, time_fmt = _time_of_day_number(tod), "HHMMSS(数値)"
+    else:
+        tod_ns, time_fmt = _parse_values(tod, TIME_FORMATS)
+
+    ns = day_ns + tod_ns
+    ns[(day_ns == _NAT) | (tod_ns == _NAT)] = _NAT
+    return _to_index(ns, name), f"{date_fmt} + {time_fmt}"
+
+
+def _bench_strings(n: int, fmt: str) -> pd.Series:
+    rng = np.random.default_rng(0)
+    start = pd.Timestamp("2024-01-01").value // 10**6
+    ms = np.sort(start + rng.integers(0, 365 * 86_400_000, n))
+    # strftime を n 回呼ぶと遅いので、10万件分の文字列を繰り返して使う
+    base = pd.to_datetime(ms[: min(n, 100_000)], unit="ms", utc=True).strftime(fmt)
+    if "%f" in fmt:
+        base = base.str.replace(r"(\.\d{3})\d{3}", r"\1", regex=True)
+    if "%z" in fmt:
+        base = base.str.replace(r"([+-]\d\d)(\d\d)$", r"\1:\2", regex=True)
+    return pd.Series(np.resize(base.to_numpy(dtype=object), n))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="日時列パースのベンチマーク（従来の pd.to_datetime と比較）")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    def timed(label: str, fn):
+        t0 = time.perf_counter()
+        result = fn()
+        print(f"{label:24s}: {time.perf_counter() - t0:7.2f}s")
+        return result
+
+    def check(old: pd.Series, new: pd.DatetimeIndex, detected: str) -> None:
+        print(f"  形式: {detected} / 従来と一致: {bool((old.to_numpy() == new.to_numpy()).all())}")
+
+    parse_timestamps(pd.Series(["2024-01-01 00:00:00"]))  # numba のコンパイル（キャッシュ読み込み）を計測から外す
+    print(f"rows: {args.rows:,}")
+    cases = [
+        ("tick ISO", "%Y-%m-%d %H:%M:%S.%f"),
+        ("tick OANDA", "%Y.%m.%d %H:%M:%S.%f"),
+        ("足CSV(+00:00)", "%Y-%m-%d %H:%M:%S%z"),
+    ]
+    for label, fmt in cases:
+        s = _bench_strings(args.rows, fmt)
+        old = timed(f"{label} 従来", lambda: pd.to_datetime(s, utc=True, errors="coerce"))
+        check(old, *timed(f"{label} 共通", lambda: parse_timestamps(s)))
+
+    s = _bench_strings(args.rows, "%Y.%m.%d %H:%M:%S.%f")
+    date, tod = s.str[:10], s.str[11:]
+    old = timed("DATE+TIME 従来", lambda: pd.to_datetime(date + " " + tod, utc=True, errors="coerce"))
+    check(old, *timed("DATE+TIME 共通", lambda: parse_date_time(date, tod)))
+
+    ms = pd.Series(_bench_strings(args.rows, "%Y-%m-%d %H:%M:%S.%f").pipe(pd.to_datetime).astype("int64") // 10**6)
+    old = timed("UNIX ms 従来", lambda: pd.to_datetime(ms, unit="ms", utc=True, errors="coerce"))
+    check(old, *timed("UNIX ms 共通", lambda: parse_timestamps(ms)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import math
+import sys
+from concurrent.futures import FIRST_COMPLETED, wait
+from dataclasses import replace
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable
+
+import numpy as np
+import pandas as pd
+
+from grid_runner import ProgressLine, RowWriter, chunk_result, submit_chunk, worker_pool
+
+if TYPE_CHECKING:
+    from search_space import SearchSpace
+
+# 取引なし・DD超過の設定は制約を満たす設定より必ず下位になるようにする
+_NO_RESULT_SCORE = -1e18
+
+
+def constrained_score(row: dict | None, max_dd: float | None) -> float:
+    if row is None:
+        return _NO_RESULT_SCORE
+    if max_dd is not None and row["dd"] > max_dd:
+        return -1e15 - float(row["dd"])
+    return float(row["net"])
+
+
+class TPESampler:
+    # 離散パラメータ用の Tree-structured Parzen Estimator（パラメータ間は独立に推定）
+    def __init__(
+        self, space: SearchSpace, seed: int | None = None, gamma: float = 0.25, n_startup: int = 10, n_candidates: int = 24
+    ) -> None:
+        self.space = space
+        self.rng = np.random.default_rng(seed)
+        self.gamma = gamma
+        self.n_startup = n_startup
+        self.n_candidates = n_candidates
+        self.observations: list[tuple[dict[str, Any], float]] = []
+
+    def key(self, assigned: dict[str, Any]) -> tuple:
+        return tuple(assigned[p.name] for p in self.space.params)
+
+    def observe(self, assigned: dict[str, Any], score: float) -> None:
+        self.observations.append((assigned, score))
+
+    def _random(self) -> dict[str, Any]:
+        assigned: dict[str, Any] = {}
+        for p in self.space.params:
+            if p.active(assigned):
+                assigned[p.name] = p.values[self.rng.integers(len(p.values))]
+            else:
+                assigned[p.name] = p.default if p.default is not None else p.values[0]
+        return assigned
+
+    def _densities(self) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+        ranked = sorted(self.observations, key=lambda o: o[1], reverse=True)
+        n_good = max(1, math.ceil(self.gamma * len(ranked)))
+        good, bad = ranked[:n_good], ranked[n_good:]
+        out = {}
+        for p in self.space.params:
+            k = len(p.values)
+            counts = []
+            for group in (good, bad):
+                c = np.ones(k)  # 一様事前分布
+                for assigned, _ in group:
+                    if p.active(assigned) and assigned[p.name] in p.values:
+                        c[p.values.index(assigned[p.name])] += 1
+                counts.append(c / c.sum())
+            out[p.name] = (counts[0], counts[1])
+        return out
+
+    def propose(self, exclude: set[tuple]) -> dict[str, Any] | None:
+        if len(self.observations) >= self.n_startup:
+            dens = self._densities()
+            candidates = []
+            for _ in range(self.n_candidates):
+                assigned: dict[str, Any] = {}
+                score = 0.0
+                for p in self.space.params:
+                    if p.active(assigned):
+                        lp, gp = dens[p.name]
+                        j = self.rng.choice(len(p.values), p=lp)
+                        assigned[p.name] = p.values[j]
+                        score += math.log(lp[j]) - math.log(gp[j])
+                    else:
+                        assigned[p.name] = p.default if p.default is not None else p.values[0]
+                candidates.append((score, assigned))
+            candidates.sort(key=lambda c: c[0], reverse=True)
+            for _, assigned in candidates:
+                if self.key(assigned) not in exclude:
+                    return assigned
+
+        # 初期ランダム探索、または候補が全て評価済みのときは未評価の設定を一様に引く
+        for _ in range(200):
+            assigned = self._random()
+            if self.key(assigned) not in exclude:
+                return assigned
+        return None
+
+
+def tpe_search(
+    df: pd.DataFrame,
+    space: SearchSpace,
+    base: Any,
+    evaluate: Callable,
+    budget: int,
+    *,
+    max_dd: float | None = None,
+    workers: int = 1,
+    seed: int | None = None,
+    out_path: str | Path | None = None,
+    progress_interval: float = 1.0,
+    batch: bool = False,
+) -> pd.DataFrame:
+    # evaluate(df, cfg) -> dict | None（batch=True なら設定リストを受け取る）。行の net/dd を目的関数に使う
+    sampler = TPESampler(space, seed=seed, n_startup=max(5, min(20, budget // 10)))
+    writer = RowWriter(out_path)
+    progress = ProgressLine(budget, progress_interval, label="tpe")
+    rows: list[dict] = []
+    seen: set[tuple] = set()
+
+    def next_config() -> tuple[dict[str, Any], Any] | None:
+        if len(seen) >= budget:
+            return None
+        assigned = sampler.propose(seen)
+        if assigned is None:
+            return None
+        seen.add(sampler.key(assigned))
+        return assigned, replace(base, **assigned)
+
+    def collect(assigned: dict[str, Any], row: dict | None) -> None:
+        sampler.observe(assigned, constrained_score(row, max_dd))
+        if row is not None:
+            rows.append(row)
+            writer.write([row])
+        progress.update(1)
+
+    interrupted = False
+    try:
+        if workers <= 1:
+            while (item := next_config()) is not None:
+                assigned, cfg = item
+                row = evaluate(df, [cfg])[0] if batch else evaluate(df, cfg)
+                collect(assigned, row)
+        else:
+            with worker_pool(df, evaluate, workers, batch) as pool:
+                # 空いたワーカーから順に、その時点までの観測で次の設定を提案する（非同期）
+                pending = {}
+                for _ in range(workers):
+                    item = next_config()
+                    if item is None:
+                        break
+                    pending[submit_chunk(pool, 0, [item[1]])] = item[0]
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        assigned = pending.pop(fut)
+                        collect(assigned, chunk_result(fut)[1][0])
+                        item = next_config()
+                        if item is not None:
+                            pending[submit_chunk(pool, 0, [item[1]])] = item[0]
+    except KeyboardInterrupt:
+        interrupted = True
+
+    progress.finish()
+    if interrupted:
+        print(f"[中断] 評価済み {progress.done:,}/{budget:,} 件の結果を保存しました", file=sys.stderr)
+    return pd.DataFrame(rows)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import sys
+from concurrent.futures import as_completed
+from dataclasses import dataclass
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from backtest_heikin_ashi_ma_touch_5m import (
+    Config,
+    backtest_kernel,
+    calc_ma,
+    calc_supertrend,
+    grid_metrics,
+    heikin_ashi_frame,
+    infer_pip_unit,
+    simulate,
+    summarize,
+)
+from bar_store import load_bars
+from grid_runner import ProgressLine, chunk_result, submit_chunk, worker_pool
+from indicator_cache import IndicatorCache, set_cache
+from metrics import batch_metrics, drawdown_stats
+from optimize_ha_touch_5m import GRID_COLUMNS, MAX_DD, SPACE
+from tpe_search import constrained_score
+
+
+@dataclass
+class Fold:
+    fold: int
+    is_start: pd.Timestamp
+    is_end: pd.Timestamp  # 終端は含まない（= oos_start）
+    oos_start: pd.Timestamp
+    oos_end: pd.Timestamp
+
+
+def make_folds(
+    index: pd.DatetimeIndex,
+    is_months: int,
+    oos_months: int,
+    step_months: int | None = None,
+    anchored: bool = False,
+) -> list[Fold]:
+    # rolling: IS窓を step ずつずらす / anchored: IS の開始をデータ先頭に固定して伸ばす
+    if len(index) == 0:
+        return []
+    step = pd.DateOffset(months=step_months or oos_months)
+    first, last = index[0], index[-1]
+    folds = []
+    oos_start = first + pd.DateOffset(months=is_months)
+    while oos_start <= last:
+        is_start = first if anchored else oos_start - pd.DateOffset(months=is_months)
+        oos_end = oos_start + pd.DateOffset(months=oos_months)
+        folds.append(Fold(len(folds), is_start, oos_start, oos_start, oos_end))
+        oos_start = oos_start + step
+    return folds
+
+
+def _ma_col(ma_type: str, length: int) -> str:
+    return f"ma_{ma_type.upper()}_{length}"
+
+
+def _st_cols(period: int, factor: float) -> tuple[str, str]:
+    return f"st_{period}_{factor}", f"st_dir_{period}_{factor}"
+
+
+def build_indicator_table(df_raw: pd.DataFrame, configs: list[Config]) -> pd.DataFrame:
+    # 全期間で1回だけ HA・MA・Supertrend を計算し、ユニークな組み合わせを列として持つ
+    table = heikin_ashi_frame(df_raw)
+    columns = {}
+    for ma_type, length in sorted({(c.ma_type.upper(), n) for c in configs for n in (c.ma_fast_len, c.ma_slow_len)}):
+        columns[_ma_col(ma_type, length)] = calc_ma(table["close"], ma_type, length)
+    for period, factor in sorted({(c.st_period, c.st_factor) for c in configs}):
+        st_col, dir_col = _st_cols(period, factor)
+        columns[st_col], columns[dir_col] = calc_supertrend(table, period, factor)
+    return pd.concat([table, pd.DataFrame(columns, index=table.index)], axis=1)
+
+
+def indicator_frame(table: pd.DataFrame, cfg: Config, i0: int, i1: int) -> pd.DataFrame:
+    st_col, dir_col = _st_cols(cfg.st_period, cfg.st_factor)
+    cols = {
+        "open": "open",
+        "high": "high",
+        "low": "low",
+        "close": "close",
+        _ma_col(cfg.ma_type, cfg.ma_fast_len): "ma_fast",
+        _ma_col(cfg.ma_type, cfg.ma_slow_len): "ma_slow",
+        st_col: "st",
+        dir_col: "st_dir",
+    }
+    part = table.iloc[i0:i1]
+    return pd.DataFrame({new: part[old] for old, new in cols.items()}, index=part.index)
+
+
+def _in_sample_run(arrays: dict[str, np.ndarray], cfg: Config, pip_units: dict) -> tuple[np.ndarray, float, tuple] | None:
+    # IS の設定選択は成績指標だけあればよいので、フレームを作らず配列カーネルを直接呼ぶ。(損益, 最終資産, (DD額, DD%, DDバー数))
+    st_col, dir_col = _st_cols(cfg.st_period, cfg.st_factor)
+    names = ["open", "high", "low", "close", _ma_col(cfg.ma_type, cfg.ma_fast_len), _ma_col(cfg.ma_type, cfg.ma_slow_len)]
+    cols = [arrays[c] for c in names] + [arrays[st_col], arrays[dir_col]]
+    valid = np.logical_and.reduce([~np.isnan(c) for c in cols])
+    if not valid.all():
+        cols = [c[valid] for c in cols]  # simulate の dropna() と同じ
+    if len(cols[3]) == 0:
+        return None
+    key = (int(valid.argmax()), int(valid.sum()))
+    if key not in pip_units:
+        pip_units[key] = infer_pip_unit(cols[3])
+
+    trades, equity, curve = backtest_kernel(
+        *cols[:6], cols[7], cfg.touch_margin_pips * pip_units[key], cfg.initial_capital, cfg.qty_pct
+    )
+    if len(trades) == 0:
+        return None
+    return trades["pnl"], equity, drawdown_stats(curve)
+
+
+def in_sample_rows(arrays: dict[str, np.ndarray], configs: list[Config]) -> list[dict | None]:
+    # 全設定を回してから、損益の集計は batch_metrics でまとめて1回で行う
+    pip_units: dict = {}
+    runs = [_in_sample_run(arrays, cfg, pip_units) for cfg in configs]
+    done = [k for k, run in enumerate(runs) if run is not None]
+    m = batch_metrics([runs[k][0] for k in done])
+    rows: list[dict | None] = [None] * len(configs)
+    for j, k in enumerate(done):
+        _, equity, dd = runs[k]
+        net = equity - configs[k].initial_capital
+        rows[k] = grid_metrics(
+            {
+                "net_pnl": net,
+                "net_pct": (net / configs[k].initial_capital) * 100,
+                "total_trades": int(m["total_trades"][j]),
+                "win_rate": float(m["win_rate"][j]),
+                "profit_factor": float(m["profit_factor"][j]),
+                "max_drawdown": dd[0],
+                "max_drawdown_pct": dd[1],
+                "max_drawdown_bars": dd[2],
+            }
+        )
+    return rows
+
+
+def _positions(index: pd.DatetimeIndex, fold: Fold) -> tuple[int, int, int, int]:
+    bounds = index.searchsorted([fold.is_start, fold.is_end, fold.oos_start, fold.oos_end], side="left")
+    return tuple(int(b) for b in bounds)
+
+
+def run_fold(table: pd.DataFrame, fold: Fold, configs: list[Config], max_dd: float | None) -> dict | None:
+    # IS で最良の設定を選び（SAFE 表と同じ dd 上限を制約に）、そのまま OOS で検証する
+    is0, is1, oos0, oos1 = _positions(table.index, fold)
+    if is1 - is0 < 2 or oos1 - oos0 < 2:
+        return None
+
+    arrays = {col: table[col].to_numpy()[is0:is1] for col in table.columns}
+    best_cfg, best_row, best_score = None, None, -np.inf
+    for cfg, row in zip(configs, in_sample_rows(arrays, configs)):
+        score = constrained_score(row, max_dd)
+        if score > best_score:
+            best_cfg, best_row, best_score = cfg, row, score
+    if best_row is None:
+        return None
+
+    result, trades, curve = simulate(indicator_frame(table, best_cfg, oos0, oos1), best_cfg)
+    return {
+        "fold": fold,
+        "cfg": best_cfg,
+        "is": best_row,
+        "oos": result,
+        "trades": trades,
+        "curve": curve,
+    }
+
+
+def stitch(fold_results: list[dict], initial_capital: float) -> tuple[pd.DataFrame, pd.DataFrame, pd.Series, dict]:
+    # 各フォールドは初期資金から始まるので、損益は資金に比例する性質を使い
+    # 直前フォールド終了時の資金で倍率をかけて OOS を複利でつなぐ
+    equity = initial_capital
+    rows, trades_parts, curve_parts = [], [], []
+    for fr in fold_results:
+        fold, cfg, oos = fr["fold"], fr["cfg"], fr["oos"]
+        scale = equity / cfg.initial_capital
+        trades = fr["trades"].assign(pnl=fr["trades"]["pnl"] * scale, fold=fold.fold)
+        trades_parts.append(trades)
+        curve_parts.append(fr["curve"] * scale)
+        start_equity = equity
+        equity = equity + oos["net_pnl"] * scale
+
+        row = {"fold": fold.fold}
+        row.update({k: getattr(fold, k).strftime("%Y-%m-%d") for k in ("is_start", "is_end", "oos_start", "oos_end")})
+        row.update({GRID_COLUMNS[k]: getattr(cfg, k) for k in GRID_COLUMNS})
+        row.update({f"is_{k}": v for k, v in fr["is"].items()})
+        row.update({f"oos_{k}": v for k, v in grid_metrics(oos).items()})
+        row["oos_start_equity"] = round(start_equity, 0)
+        row["oos_end_equity"] = round(equity, 0)
+        rows.append(row)
+
+    trades = pd.concat(trades_parts, ignore_index=True) if trades_parts else pd.DataFrame()
+    curve = pd.concat(curve_parts) if curve_parts else pd.Series(dtype=np.float64, name="equity")
+    if trades.empty:
+        trades = pd.DataFrame(columns=["time", "side", "entry", "exit", "pnl", "reason", "fold"])
+    summary = summarize(trades, curve.to_numpy(), initial_capital, equity)
+    return pd.DataFrame(rows), trades, curve, summary
+
+
+def walk_forward(
+    df_raw: pd.DataFrame,
+    configs: list[Config],
+    folds: list[Fold],
+    *,
+    max_dd: float | None = None,
+    workers: int = 1,
+    progress_interval: float = 1.0,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.Series, dict]:
+    table = build_indicator_table(df_raw, configs)
+    evaluate = partial(run_fold, configs=configs, max_dd=max_dd)
+    progress = ProgressLine(len(folds), progress_interval, label="wfa")
+    results: dict[int, dict | None] = {}
+
+    if workers <= 1:
+        for fold in folds:
+            results[fold.fold] = evaluate(table, fold)
+            progress.update(1)
+    else:
+        # 指標表を共有メモリに置き、フォールド単位でワーカーへ配る
+        with worker_pool(table, evaluate, workers) as pool:
+            futures = [submit_chunk(pool, fold.fold, [fold]) for fold in folds]
+            for fut in as_completed(futures):
+                fold_id, (res,) = chunk_result(fut)
+                results[fold_id] = res
+                progress.update(1)
+    progress.finish()
+
+    skipped = [f.fold for f in folds if results.get(f.fold) is None]
+    if skipped:
+        print(f"[SKIP] 取引なし・データ不足のフォールド: {skipped}", file=sys.stderr)
+    fold_results = [results[f.fold] for f in folds if results.get(f.fold) is not None]
+    initial_capital = configs[0].initial_capital if configs else Config().initial_capital
+    return stitch(fold_results, initial_capital)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Heikin Ashi MA Touch(5分足)のウォークフォワード分析")
+    parser.add_argument("--csv", default="data/usdjpy_5m.csv", help="5分足OHLCV CSV またはバーストア(.bars)")
+    parser.add_argument("--start", default=None, help="開始日時(例: 2025-01-01)")
+    parser.add_argument("--end", default=None, help="終了日時(例: 2026-02-28)")
+    parser.add_argument("--is-months", type=int, default=6, help="インサンプル期間(月)")
+    parser.add_argument("--oos-months", type=int, default=1, help="アウトオブサンプル期間(月)")
+    parser.add_argument("--step-months", type=int, default=None, help="フォールドのずらし幅(月)。省略時は OOS 期間")
+    parser.add_argument("--anchored", action="store_true", help="IS の開始をデータ先頭に固定する")
+    parser.add_argument("--max-dd", type=float, default=MAX_DD, help="IS で設定を選ぶときの dd 上限")
+    parser.add_argument("--workers", type=int, default=1, help="並列ワーカー数")
+    parser.add_argument("--progress-interval", type=float, default=1.0, help="進捗表示の間隔(秒)。0で非表示")
+    parser.add_argument("--out", default="result_walk_forward_5m.csv", help="フォールド別結果CSV出力先")
+    parser.add_argument("--out-equity", default="result_walk_forward_equity_5m.csv", help="OOS 連結資産曲線CSV出力先")
+    parser.add_argument("--out-trades", default=None, help="OOS トレード履歴CSV出力先")
+    parser.add_argument("--cache-dir", default=None, help="指標キャッシュの保存先フォルダ(プロセス間で再利用)")
+    args = parser.parse_args()
+
+    if args.cache_dir:
+        set_cache(IndicatorCache(disk_dir=args.cache_dir))
+
+    df = load_bars(args.csv, args.start, args.end)
+
+    folds = make_folds(df.index, args.is_months, args.oos_months, args.step_months, args.anchored)
+    if not folds:
+        print("No fold")
+        return
+    configs = SPACE.configs(Config())
+    print(f"folds={len(folds)} configs={len(configs)} mode={'anchored' if args.anchored else 'rolling'}")
+
+    table, trades, curve, summary = walk_forward(
+        df, configs, folds, max_dd=args.max_dd, workers=args.workers, progress_interval=args.progress_interval
+    )
+    if table.empty:
+        print("No result")
+        return
+
+    print(table.to_string(index=False))
+    print("\n=== Walk-Forward OOS Summary ===")
+    print(f"Initial Capital : {summary['initial_capital']:.0f}")
+    print(f"Final Equity    : {summary['final_equity']:.0f}")
+    print(f"Net PnL         : {summary['net_pnl']:.0f} ({summary['net_pct']:.2f}%)")
+    print(f"Trades          : {summary['total_trades']}")
+    print(f"Win Rate        : {summary['win_rate']:.2f}%")
+    pf = summary["profit_factor"]
+    print(f"Profit Factor   : {pf:.2f}" if pd.notna(pf) else "Profit Factor   : inf")
+    print(f"Max Drawdown    : {summary['max_drawdown']:.0f} ({summary['max_drawdown_pct']:.2f}%, {summary['max_drawdown_bars']} bars)")
+
+    table.to_csv(args.out, index=False)
+    curve.to_frame().to_csv(args.out_equity, index_label="time")
+    print(f"\nSaved: {args.out}, {args.out_equity}")
+    if args.out_trades:
+        trades.to_csv(args.out_trades, index=False)
+        print(f"Saved: {args.out_trades}")
+
+
+if __name__ == "__main__":
+    main()